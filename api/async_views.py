@@ -0,0 +1,221 @@
+"""
+async def версии эндпоинтов чтения (посты, пользователи, списки друзей) для запуска под ASGI.
+
+Включаются настройкой API_ASYNC_VIEWS (api/urls.py), ответы совпадают с api.views. Запросы к БД идут через
+асинхронный ORM, кэши сущностей - через aget_many. DRF не поддерживает async def view, поэтому проверка метода,
+CSRF-cookie и пользователь сессии или токена (aget_user) сделаны здесь.
+Документация берется у синхронных view (documented_as).
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user
+from django.middleware.csrf import get_token
+from rest_framework.exceptions import AuthenticationFailed
+
+from api import views
+from api.entity_cache import post_cache, user_cache
+from api.instrumentation import JsonResponse
+from api.models import Post
+from api.pagination import CursorError, apaginate, is_legacy_request
+from api.response_cache import cached_response, public_cache
+from api.serializers import post_serializer, user_serializer
+from api.streaming import aiterate, astream_collection, is_stream_request
+from users.authentication import TokenAuthentication, get_bearer_token
+from users.models import User, UserFriend
+
+
+async def aget_user(request):
+    """
+    Пользователь токена или сессии. Результат запоминается там же, где его хранит request.user.
+    Проверки те же, что у синхронных view: TokenAuthentication и django.contrib.auth.get_user в sync_to_async.
+    Недействительный токен - AuthenticationFailed, ответ 401 формирует async_api_view
+    """
+    if not hasattr(request, '_cached_user'):
+        if get_bearer_token(request) is not None:
+            request._cached_user, _ = await sync_to_async(TokenAuthentication().authenticate)(request)
+        else:
+            request._cached_user = await sync_to_async(get_user)(request)
+    return request._cached_user
+
+
+def async_api_view(methods, ensure_csrf: bool = True):
+    """Аналог @api_view + @ensure_csrf_cookie из api.views для async def view. ensure_csrf=False - без csrf-cookie"""
+    allowed = set(methods) | ({'HEAD'} if 'GET' in methods else set())
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in allowed:
+                response = JsonResponse({'detail': f'Метод "{request.method}" не разрешен.'}, status=405)
+                response['Allow'] = ', '.join(sorted(allowed))
+                return response
+
+            try:
+                if not ensure_csrf:
+                    return await view(request, *args, **kwargs)
+
+                # Как ensure_csrf_cookie: токен создается, cookie ставит CsrfViewMiddleware
+                get_token(request)
+                response = await view(request, *args, **kwargs)
+            except AuthenticationFailed as e:
+                # Как ответ DRF на ошибку TokenAuthentication
+                response = JsonResponse({'detail': e.detail}, status=e.status_code)
+                response['WWW-Authenticate'] = TokenAuthentication().authenticate_header(request)
+                return response
+
+            response['X-CSRFToken'] = request.META['CSRF_COOKIE']
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def documented_as(sync_view):
+    """drf_yasg строит схему по DRF-представлению синхронного view с теми же параметрами и ответами"""
+    def decorator(view):
+        for attribute in ('cls', 'initkwargs', '_swagger_auto_schema'):
+            setattr(view, attribute, getattr(sync_view, attribute))
+        return view
+
+    return decorator
+
+
+async def posts_collection_response(request, posts):
+    posts = post_serializer.values(posts)
+
+    if is_legacy_request(request):
+        return astream_collection('posts', (post_serializer.serialize(row) async for row in aiterate(posts)))
+
+    try:
+        page, next_cursor = await apaginate(posts, request)
+    except CursorError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'posts': tuple(post_serializer.rows(page)),
+        'next_cursor': next_cursor,
+    })
+
+
+async def friends_ids_response(request, friends_queryset):
+    if views.is_expand_request(request):
+        return await friends_expanded_response(request, friends_queryset)
+
+    ids = friends_queryset.values_list('id', flat=True)
+    if is_stream_request(request):
+        return astream_collection('users', aiterate(ids))
+
+    return JsonResponse({'users': [pk async for pk in ids]})
+
+
+async def friends_expanded_response(request, friends_queryset):
+    serializer = user_serializer
+    fields = request.GET.get('fields', None)
+    if fields:
+        try:
+            serializer = user_serializer.subset([field.strip() for field in fields.split(',') if field.strip()])
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    values = serializer.values(friends_queryset)
+    if is_stream_request(request):
+        return astream_collection('users', (serializer.serialize(row) async for row in aiterate(values)))
+
+    return JsonResponse({'users': [serializer.serialize(row) async for row in values]})
+
+
+@documented_as(views.get_all_posts_view)
+@async_api_view(['GET'], ensure_csrf=False)
+@public_cache
+async def get_all_posts_view(request):
+    return await posts_collection_response(request, Post.objects.all())
+
+
+@documented_as(views.get_post_view)
+@async_api_view(['GET'], ensure_csrf=False)
+@public_cache
+@cached_response('get_post', lambda post_id: [f'post:{post_id}'])
+async def get_post_view(request, post_id):
+    try:
+        post: Post = await post_cache.aget(post_id)
+    except Post.DoesNotExist:
+        return JsonResponse({'error': 'Пост не найден'}, status=404)
+    return JsonResponse(post.json)
+
+
+@documented_as(views.get_user_posts_view)
+@async_api_view(['GET'], ensure_csrf=False)
+@public_cache
+@cached_response('user_posts', lambda user_id: [f'user-posts:{user_id}'])
+async def get_user_posts_view(request, user_id):
+    return await posts_collection_response(request, Post.objects.filter(author_id=user_id))
+
+
+@documented_as(views.get_user_view)
+@async_api_view(['GET'], ensure_csrf=False)
+@public_cache
+@cached_response('user', lambda user_id: [f'user:{user_id}'])
+async def get_user_view(request, user_id):
+    try:
+        user: User = await user_cache.aget(user_id)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'Пользователь не найден'}, status=404)
+    return JsonResponse(user.json)
+
+
+@documented_as(views.get_user_self_view)
+@async_api_view(['GET'])
+async def get_user_self_view(request):
+    user: User = await aget_user(request)
+
+    if user.is_anonymous:
+        return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
+
+    return JsonResponse(user.json)
+
+
+@documented_as(views.user_friend_count_view)
+@async_api_view(['GET'], ensure_csrf=False)
+@public_cache
+async def user_friend_count_view(request, user_id):
+    try:
+        user: User = await user_cache.aget(user_id)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'Пользователь не найден'}, status=404)
+    return JsonResponse({"friendCount": user.friend_count})
+
+
+@documented_as(views.user_friends_view)
+@async_api_view(['GET'], ensure_csrf=False)
+@public_cache
+@cached_response('friends', lambda user_id: [f'user-friends:{user_id}'], bypass=views.is_expand_request)
+async def user_friends_view(request, user_id):
+    try:
+        user: User = await user_cache.aget(user_id)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'Пользователь не найден'}, status=404)
+    return await friends_ids_response(request, UserFriend.get_friends(user))
+
+
+@documented_as(views.user_friends_requests_view)
+@async_api_view(['GET'])
+async def user_friends_requests_view(request):
+    user: User = await aget_user(request)
+
+    if user.is_anonymous:
+        return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
+
+    return await friends_ids_response(request, UserFriend.get_friend_requests(user))
+
+
+@documented_as(views.user_friends_requests_send_view)
+@async_api_view(['GET'])
+async def user_friends_requests_send_view(request):
+    user: User = await aget_user(request)
+
+    if user.is_anonymous:
+        return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
+
+    return await friends_ids_response(request, UserFriend.get_friend_requests_send(user))
@@ -0,0 +1,221 @@
+"""
+Двухуровневый кэш сущностей (User, Post) по первичному ключу.
+
+1. Локальный LRU в памяти процесса с коротким TTL - без сети и без БД.
+2. Общий кэш Django (ENTITY_CACHE_ALIAS), один для всех процессов. Без общего кэша (ENTITY_CACHE_ALIAS = None)
+   этого уровня нет: кэш в памяти процесса вместо него хранил бы записи, сброшенные в других процессах.
+Промах на всех уровнях - один запрос id__in на все недостающие ключи.
+
+Сохранение и удаление моделей сбрасывают запись (api.signals). Локальные кэши других процессов
+об этом не узнают, поэтому их TTL (ENTITY_CACHE_LOCAL_TTL) должен быть коротким.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+
+from api import metrics
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key, None)
+            if item is None:
+                self.misses += 1
+                return _MISSING
+
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                self.expirations += 1
+                return _MISSING
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'max_size': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class EntityCache:
+    def __init__(self, model_label: str):
+        self.model_label = model_label
+        self._local = None
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.db_queries = 0
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    @property
+    def local(self) -> LRUCache:
+        if self._local is None:
+            self._local = LRUCache(settings.ENTITY_CACHE_LOCAL_SIZE, settings.ENTITY_CACHE_LOCAL_TTL)
+        return self._local
+
+    @property
+    def shared(self):
+        """Общий кэш или None, если он не настроен"""
+        alias = settings.ENTITY_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    def _key(self, pk) -> str:
+        return f'entity:{self.model_label}:{pk}'
+
+    def _normalize(self, pks) -> list:
+        to_python = self.model._meta.pk.to_python
+        normalized = []
+        for pk in pks:
+            try:
+                normalized.append(to_python(pk))
+            except ValidationError:
+                continue
+        return list(dict.fromkeys(normalized))
+
+    def _lookup_local(self, pks):
+        found = {}
+        missing = []
+        for pk in self._normalize(pks):
+            instance = self.local.get(pk)
+            if instance is _MISSING:
+                missing.append(pk)
+            else:
+                found[pk] = instance
+        metrics.cache_requests.inc(len(found), cache=self.model_label, level='local', result='hit')
+        metrics.cache_requests.inc(len(missing), cache=self.model_label, level='local', result='miss')
+        return found, missing
+
+    def _accept_shared(self, missing: list, shared: dict, found: dict) -> list:
+        still_missing = []
+        for pk in missing:
+            instance = shared.get(self._key(pk), None)
+            if instance is None:
+                still_missing.append(pk)
+                continue
+            self.local.set(pk, instance)
+            found[pk] = instance
+        self.shared_hits += len(missing) - len(still_missing)
+        self.shared_misses += len(still_missing)
+        metrics.cache_requests.inc(len(missing) - len(still_missing), cache=self.model_label, level='shared',
+                                   result='hit')
+        metrics.cache_requests.inc(len(still_missing), cache=self.model_label, level='shared', result='miss')
+        return still_missing
+
+    def _accept_loaded(self, loaded: dict, found: dict) -> dict:
+        """Кладет загруженные из БД экземпляры в локальный кэш, возвращает записи для общего"""
+        self.db_queries += 1
+        for pk, instance in loaded.items():
+            self.local.set(pk, instance)
+        found.update(loaded)
+        return {self._key(pk): instance for pk, instance in loaded.items()}
+
+    def get_many(self, pks) -> dict:
+        """{pk: экземпляр} для найденных ключей. Каждый вызов получает свои копии экземпляров"""
+        found, missing = self._lookup_local(pks)
+        shared_cache = self.shared
+
+        if missing and shared_cache is not None:
+            shared = shared_cache.get_many([self._key(pk) for pk in missing])
+            missing = self._accept_shared(missing, shared, found)
+
+        if missing:
+            loaded = {instance.pk: instance for instance in self.model._default_manager.filter(pk__in=missing)}
+            entries = self._accept_loaded(loaded, found)
+            if entries and shared_cache is not None:
+                shared_cache.set_many(entries, settings.ENTITY_CACHE_SHARED_TIMEOUT)
+
+        return {pk: copy.copy(instance) for pk, instance in found.items()}
+
+    async def aget_many(self, pks) -> dict:
+        """get_many для async-кода: общий кэш через aget_many, БД через асинхронный ORM"""
+        found, missing = self._lookup_local(pks)
+        shared_cache = self.shared
+
+        if missing and shared_cache is not None:
+            shared = await shared_cache.aget_many([self._key(pk) for pk in missing])
+            missing = self._accept_shared(missing, shared, found)
+
+        if missing:
+            loaded = {instance.pk: instance async for instance in self.model._default_manager.filter(pk__in=missing)}
+            entries = self._accept_loaded(loaded, found)
+            if entries and shared_cache is not None:
+                await shared_cache.aset_many(entries, settings.ENTITY_CACHE_SHARED_TIMEOUT)
+
+        return {pk: copy.copy(instance) for pk, instance in found.items()}
+
+    def get(self, pk):
+        for instance in self.get_many([pk]).values():
+            return instance
+        raise self.model.DoesNotExist(f'{self.model.__name__} с id={pk} не найден')
+
+    async def aget(self, pk):
+        for instance in (await self.aget_many([pk])).values():
+            return instance
+        raise self.model.DoesNotExist(f'{self.model.__name__} с id={pk} не найден')
+
+    def invalidate(self, *pks):
+        for pk in pks:
+            self.local.delete(pk)
+        if self.shared is not None:
+            self.shared.delete_many([self._key(pk) for pk in pks])
+
+    def stats(self) -> dict:
+        return {
+            'local': self.local.stats(),
+            'shared': None if self.shared is None else {
+                'hits': self.shared_hits,
+                'misses': self.shared_misses,
+                # Вытеснением в общем кэше управляет его бэкенд, процессу оно не видно
+                'evictions': None,
+            },
+            'db_queries': self.db_queries,
+        }
+
+
+user_cache = EntityCache('users.User')
+post_cache = EntityCache('api.Post')
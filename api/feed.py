@@ -0,0 +1,91 @@
+"""
+Лента постов друзей.
+
+Посты раскладываются по лентам друзей автора при создании (fan-out-on-write) в фоне, пачками.
+Решение о раскладке хранится в самом посте (Post.fanned_out): посты пользователей с очень большим числом
+друзей (больше FEED_FANOUT_MAX_FRIENDS) не раскладываются, а вместе с ещё не разложенными постами
+подмешиваются при чтении ленты (fan-out-on-read).
+"""
+from django.conf import settings
+from django.db.models import Subquery
+
+from api.models import Post, TimelineEntry
+from api.serializers import post_serializer
+from users.models import UserFriend
+
+
+def is_high_degree(friend_count: int) -> bool:
+    return friend_count > settings.FEED_FANOUT_MAX_FRIENDS
+
+
+def fan_out_post(post_id: int):
+    post = (Post.objects.filter(id=post_id, fanned_out=False)
+            .values('author_id', 'author__friend_count', 'created_date').first())
+    if post is None or is_high_degree(post['author__friend_count']):
+        return
+
+    friends = UserFriend.objects.filter(user_id=post['author_id'], is_friend=True).order_by('friend_id')
+    batch_size = settings.FEED_FANOUT_BATCH_SIZE
+    last_friend_id = 0
+    while True:
+        friend_ids = list(friends.filter(friend_id__gt=last_friend_id).values_list('friend_id', flat=True)[:batch_size])
+        if not friend_ids:
+            break
+        last_friend_id = friend_ids[-1]
+
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(owner_id=friend_id, post_id=post_id, author_id=post['author_id'],
+                          created_date=post['created_date'])
+            for friend_id in friend_ids
+        ], ignore_conflicts=True)
+
+    # Только после раскладки: до этого момента пост читается из постов друзей
+    Post.objects.filter(id=post_id).update(fanned_out=True)
+
+
+def mark_fanned_out(posts=None) -> int:
+    """Отмечает посты авторов с небольшим числом друзей разложенными (для лент, заполненных backfill_timeline)"""
+    if posts is None:
+        posts = Post.objects.all()
+    return (posts.filter(fanned_out=False, author__friend_count__lte=settings.FEED_FANOUT_MAX_FRIENDS)
+            .update(fanned_out=True))
+
+
+def backfill_timeline(owner_id: int, author_id: int):
+    """
+    Последние посты нового друга в ленту владельца.
+    Копируются и неразложенные посты: раскладка могла прочитать список друзей до новой дружбы,
+    а повторы с постами, подмешанными при чтении, paginate_merged отбрасывает
+    """
+    posts = (Post.objects.filter(author_id=author_id).order_by('-created_date', '-id')
+             .values_list('id', 'created_date')[:settings.FEED_BACKFILL_SIZE])
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(owner_id=owner_id, post_id=post_id, author_id=author_id, created_date=created_date)
+        for post_id, created_date in posts
+    ], ignore_conflicts=True)
+
+
+def prune_timeline(owner_id: int, author_id: int):
+    TimelineEntry.objects.filter(owner_id=owner_id, author_id=author_id).delete()
+
+
+def on_friendship_created(user_id: int, friend_id: int):
+    backfill_timeline(user_id, friend_id)
+    backfill_timeline(friend_id, user_id)
+
+
+def on_friendship_removed(user_id: int, friend_id: int):
+    prune_timeline(user_id, friend_id)
+    prune_timeline(friend_id, user_id)
+
+
+def feed_sources(user) -> list:
+    """Выборки для api.pagination.paginate_merged: лента пользователя и неразложенные посты друзей"""
+    timeline = post_serializer.values(
+        TimelineEntry.objects.filter(owner=user), prefix='post__', extra=('created_date', 'post_id')
+    )
+    friend_ids = UserFriend.objects.filter(user=user, is_friend=True).values('friend_id')
+    posts = post_serializer.values(
+        Post.objects.filter(fanned_out=False, author_id__in=Subquery(friend_ids))
+    )
+    return [(timeline, 'created_date', 'post_id'), (posts, 'created_date', 'id')]
@@ -0,0 +1,49 @@
+import logging
+
+from api.models import Post
+from api.storage import is_blob
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+
+def _process(instance, field_name: str, ready_field: str, force: bool = False) -> bool:
+    """
+    True, если варианты созданы и флаг ready_field поставлен. Если изображение не декодируется, флаг остается
+    False и клиенты получают оригинал
+    """
+    name = getattr(instance, field_name).name
+    if not name:
+        return False
+
+    # Pillow нужен только самой задаче, а не view, которые ее ставят
+    from PIL import Image, UnidentifiedImageError
+
+    from api.images import generate_variants, variants_exist
+
+    # Файл из контентно-адресуемого хранилища уже мог быть загружен раньше вместе с вариантами
+    if force or not (is_blob(name) and variants_exist(name)):
+        try:
+            generate_variants(name)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+            logger.warning('Варианты %s не созданы, остается оригинал: %r', name, e)
+            return False
+
+    # Пока варианты создавались, изображение могли заменить - тогда флаг не ставится
+    model = type(instance)
+    if not model.objects.filter(pk=instance.pk, **{field_name: name}).exists():
+        return False
+    setattr(instance, ready_field, True)
+    # save(), а не update(): сигналы сохранения сбрасывают кэши ответа и сущности
+    instance.save(update_fields=[ready_field])
+    return True
+
+
+def process_post_image(post_id: int, force: bool = False) -> bool:
+    post = Post.objects.filter(id=post_id).first()
+    return post is not None and _process(post, 'image', 'image_variants_ready', force)
+
+
+def process_avatar(user_id: int, force: bool = False) -> bool:
+    user = User.objects.filter(id=user_id).first()
+    return user is not None and _process(user, 'avatar', 'avatar_variants_ready', force)
@@ -0,0 +1,58 @@
+"""
+Варианты изображений (thumb, medium, full): уменьшенные копии без EXIF в формате IMAGE_VARIANT_FORMAT.
+Имена вариантов выводятся из имени оригинала, поэтому ссылки на них строятся без обращения к хранилищу.
+"""
+import io
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def variant_name(name: str, variant: str) -> str:
+    stem, _ = posixpath.splitext(name)
+    return posixpath.join(
+        settings.IMAGE_VARIANTS_DIR, f'{stem}_{variant}.{EXTENSIONS[settings.IMAGE_VARIANT_FORMAT]}'
+    )
+
+
+def variant_urls(name: str) -> dict:
+    return {variant: default_storage.url(variant_name(name, variant)) for variant in settings.IMAGE_VARIANTS}
+
+
+def variants_exist(name: str) -> bool:
+    return all(default_storage.exists(variant_name(name, variant)) for variant in settings.IMAGE_VARIANTS)
+
+
+def encode_variant(image: Image.Image, max_side: int) -> bytes:
+    variant = image.copy()
+    variant.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    image_format = settings.IMAGE_VARIANT_FORMAT
+    if image_format == 'JPEG' or variant.mode not in ('RGB', 'RGBA'):
+        variant = variant.convert('RGBA' if image_format == 'WEBP' and 'A' in variant.getbands() else 'RGB')
+
+    # exif и icc_profile не передаются - метаданные оригинала в варианты не попадают
+    buffer = io.BytesIO()
+    variant.save(buffer, format=image_format, quality=settings.IMAGE_VARIANT_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def generate_variants(name: str, storage=default_storage):
+    """Создает все варианты изображения name из хранилища storage. Существующие варианты перезаписываются"""
+    with storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        # Поворот по EXIF применяется к пикселям, сам EXIF отбрасывается
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    for variant, max_side in settings.IMAGE_VARIANTS.items():
+        target = variant_name(name, variant)
+        content = encode_variant(image, max_side)
+        if default_storage.exists(target):
+            default_storage.delete(target)
+        default_storage.save(target, ContentFile(content))
@@ -0,0 +1,97 @@
+"""
+Замеры одного запроса для RequestTimingMiddleware (api.middleware).
+
+RequestTimings текущего запроса лежит в contextvar: он виден и в потоке синхронного view под ASGI, и в
+sync_to_async асинхронного ORM. SQL считает query_timer - execute_wrapper, который ставится на каждое
+соединение при его создании (api.signals) и без замера в текущем запросе только проверяет contextvar.
+Время сериализации - время json.dumps в JsonResponse; потоковые ответы сериализуются уже после middleware.
+"""
+import time
+from contextvars import ContextVar
+
+from django.http import JsonResponse as BaseJsonResponse
+
+SQL_MAX_LENGTH = 500
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('url_name', 'sampled', 'started', 'view_started', 'queries', 'db_time', 'slowest_time',
+                 'slowest_sql', 'serialize_time', 'view_time', 'total_time')
+
+    def __init__(self, sampled: bool):
+        self.url_name = None
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = None
+        self.serialize_time = 0.0
+        self.view_time = 0.0
+        self.total_time = 0.0
+
+    def add_query(self, sql: str, duration: float):
+        self.queries += 1
+        self.db_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_sql = sql
+
+    def finish(self, url_name):
+        finished = time.perf_counter()
+        self.url_name = url_name
+        self.total_time = finished - self.started
+        if self.view_started is not None:
+            self.view_time = finished - self.view_started
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing, длительности в миллисекундах"""
+        metrics = [f'total;dur={self.total_time * 1000:.1f}', f'view;dur={self.view_time * 1000:.1f}']
+        if self.sampled:
+            metrics.append(f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"')
+            metrics.append(f'serialize;dur={self.serialize_time * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def start(sampled: bool):
+    """Начало замеров запроса: (timings, token для stop)"""
+    timings = RequestTimings(sampled)
+    return timings, _current.set(timings)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def query_timer(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None or not timings.sampled:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql[:SQL_MAX_LENGTH], time.perf_counter() - started)
+
+
+def install_query_timer(connection):
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class JsonResponse(BaseJsonResponse):
+    """django.http.JsonResponse, время json.dumps идет в serialize_time текущего запроса"""
+
+    def __init__(self, *args, **kwargs):
+        timings = _current.get()
+        if timings is None or not timings.sampled:
+            super().__init__(*args, **kwargs)
+            return
+
+        started = time.perf_counter()
+        super().__init__(*args, **kwargs)
+        timings.serialize_time += time.perf_counter() - started
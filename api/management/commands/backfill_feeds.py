@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api import feed
+from users.models import UserFriend
+
+
+class Command(BaseCommand):
+    help = 'Заполнение лент друзей последними постами друзей (для данных, созданных до появления лент)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Записей дружбы за один проход')
+
+    def handle(self, *args, **options):
+        friendships = UserFriend.objects.filter(is_friend=True).order_by('id')
+        last_id = 0
+        filled = 0
+        while True:
+            batch = list(
+                friendships.filter(id__gt=last_id).values_list('id', 'user_id', 'friend_id')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            # Дружба хранится в обе стороны, поэтому каждой записи достаточно одного направления
+            for _, owner_id, author_id in batch:
+                feed.backfill_timeline(owner_id, author_id)
+            filled += len(batch)
+
+        # Посты, разложенные здесь, больше не нужно подмешивать при чтении ленты
+        marked = feed.mark_fanned_out()
+        self.stdout.write(self.style.SUCCESS(f'Заполнено лент по записям дружбы: {filled}, постов разложено: {marked}'))
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.image_variants import process_avatar, process_post_image
+from api.models import Post
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Создание вариантов (thumb, medium, full) для уже загруженных изображений постов и аватарок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Количество параллельных потоков')
+        parser.add_argument('--force', action='store_true', help='Пересоздать варианты и для уже обработанных')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+        users = User.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if not options['force']:
+            posts = posts.filter(image_variants_ready=False)
+            users = users.filter(avatar_variants_ready=False)
+
+        jobs = [(process_post_image, pk) for pk in posts.values_list('id', flat=True)]
+        jobs += [(process_avatar, pk) for pk in users.values_list('id', flat=True)]
+
+        failed = skipped = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(self.run, task, pk, options['force']) for task, pk in jobs]
+            for (task, pk), future in zip(jobs, futures):
+                error = future.exception()
+                if error is not None:
+                    failed += 1
+                    self.stderr.write(f'{task.__name__}({pk}): {error}')
+                elif not future.result():
+                    # Изображение не декодируется или было заменено, подробности - в логе api.image_variants
+                    skipped += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {len(jobs) - failed - skipped}, без вариантов: {skipped}, с ошибкой: {failed}'
+        ))
+
+    @staticmethod
+    def run(task, pk, force):
+        try:
+            return task(pk, force)
+        finally:
+            connection.close()
@@ -0,0 +1,186 @@
+import asyncio
+import importlib
+import io
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import clear_url_caches
+
+from api.models import Post
+from users.models import User, UserFriend
+
+PREFIX = 'bench_async_'
+
+
+class Command(BaseCommand):
+    help = ('Сравнение эндпоинтов чтения под WSGI (синхронные view) и под ASGI (синхронные и async def view из '
+            'api.async_views) при высокой конкурентности: запросов/сек и задержки p50/p95/p99. Обработчики '
+            'вызываются в процессе, без сети. Данные создаются перед замером и удаляются после')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Запросов на каждый режим')
+        parser.add_argument('--concurrency', type=int, default=64, help='Одновременных запросов')
+        parser.add_argument('--users', type=int, default=200, help='Пользователей в тестовых данных')
+        parser.add_argument('--posts', type=int, default=2000, help='Постов в тестовых данных')
+        parser.add_argument('--friends', type=int, default=20, help='Друзей у каждого пользователя')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        user_ids, post_ids = self.create_data(options)
+        try:
+            self.cookie = self.login(user_ids[0])
+            rng = random.Random(options['seed'])
+            paths = [self.random_path(rng, user_ids, post_ids) for _ in range(options['requests'])]
+
+            self.stdout.write(f'{"Режим":<22}{"запр/сек":>10}{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}'
+                              f'{"max, мс":>10}{"ошибок":>8}')
+            for title, async_views, runner in (
+                ('WSGI, sync view', False, self.run_wsgi),
+                ('ASGI, sync view', False, self.run_asgi),
+                ('ASGI, async view', True, self.run_asgi),
+            ):
+                with self.urlconf(async_views):
+                    started = time.perf_counter()
+                    latencies, errors = runner(paths, options['concurrency'])
+                    elapsed = time.perf_counter() - started
+                self.report(title, latencies, errors, elapsed)
+        finally:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    def create_data(self, options):
+        rng = random.Random(options['seed'])
+        User.objects.bulk_create(User(username=f'{PREFIX}{i}', first_name='Имя', last_name='Фамилия')
+                                 for i in range(options['users']))
+        user_ids = list(User.objects.filter(username__startswith=PREFIX).order_by('id').values_list('id', flat=True))
+
+        Post.objects.bulk_create(Post(title=f'Пост {i}', description='Текст поста', author_id=rng.choice(user_ids))
+                                 for i in range(options['posts']))
+        post_ids = list(Post.objects.filter(author_id__in=user_ids).values_list('id', flat=True))
+
+        pairs = set()
+        for user_id in user_ids:
+            for friend_id in rng.sample(user_ids, min(options['friends'], len(user_ids))):
+                if friend_id != user_id:
+                    pairs.update({(user_id, friend_id), (friend_id, user_id)})
+        UserFriend.objects.bulk_create(
+            [UserFriend(user_id=user_id, friend_id=friend_id, is_friend=True) for user_id, friend_id in pairs],
+            batch_size=1000,
+        )
+        return user_ids, post_ids
+
+    def login(self, user_id) -> str:
+        client = Client()
+        client.force_login(User.objects.get(id=user_id))
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    @staticmethod
+    def random_path(rng, user_ids, post_ids) -> str:
+        return rng.choice((
+            lambda: '/api/posts/get/all/',
+            lambda: f'/api/posts/get/user/{rng.choice(user_ids)}/',
+            lambda: f'/api/posts/get/{rng.choice(post_ids)}/',
+            lambda: f'/api/users/get/{rng.choice(user_ids)}/',
+            lambda: '/api/users/get/me/',
+            lambda: f'/api/users/get/{rng.choice(user_ids)}/friends/?expand=users',
+        ))()
+
+    @staticmethod
+    def urlconf(async_views: bool):
+        """Пересборка URLconf с нужными view: api.urls выбирает их по API_ASYNC_VIEWS при импорте"""
+        class Context(override_settings):
+            def enable(self):
+                super().enable()
+                self.reload()
+
+            def disable(self):
+                super().disable()
+                self.reload()
+
+            @staticmethod
+            def reload():
+                importlib.reload(importlib.import_module('api.urls'))
+                importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+                clear_url_caches()
+
+        return Context(API_ASYNC_VIEWS=async_views)
+
+    def run_wsgi(self, paths, concurrency):
+        handler = WSGIHandler()
+
+        def request(path):
+            path, _, query = path.partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': self.host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': self.host, 'HTTP_COOKIE': self.cookie,
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False, 'wsgi.version': (1, 0),
+            }
+            status = []
+            started = time.perf_counter()
+            response = handler(environ, lambda s, headers, exc_info=None: status.append(s))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            return time.perf_counter() - started, not status[0].startswith('200')
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(request, paths))
+        return [latency for latency, _ in results], sum(error for _, error in results)
+
+    def run_asgi(self, paths, concurrency):
+        handler = ASGIHandler()
+
+        async def request(path, semaphore):
+            path, _, query = path.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'client': ('127.0.0.1', 0), 'server': (self.host, 80),
+                'headers': [(b'host', self.host.encode()), (b'cookie', self.cookie.encode())],
+            }
+            done = asyncio.Event()
+            status = []
+
+            async def receive():
+                if not status:
+                    status.append(None)
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await done.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif message['type'] == 'http.response.body' and not message.get('more_body', False):
+                    done.set()
+
+            async with semaphore:
+                started = time.perf_counter()
+                await handler(scope, receive, send)
+                return time.perf_counter() - started, status[-1] != 200
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(request(path, semaphore) for path in paths))
+
+        results = asyncio.run(main())
+        return [latency for latency, _ in results], sum(error for _, error in results)
+
+    def report(self, title, latencies, errors, elapsed):
+        quantiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{title:<22}{len(latencies) / elapsed:>10.0f}{quantiles[49] * 1000:>10.1f}{quantiles[94] * 1000:>10.1f}'
+            f'{quantiles[98] * 1000:>10.1f}{max(latencies) * 1000:>10.1f}{errors:>8}'
+        )
@@ -0,0 +1,350 @@
+import io
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+
+from api import feed, synthetic, tasks, urls
+from api.models import Post
+from users import tokens
+from users.models import User, UserFriend
+
+PREFIX = 'bench_endpoints_'
+PASSWORD = 'password'
+API_PREFIX = '/api/'
+# Число SQL-запросов из заголовка Server-Timing (api.instrumentation)
+QUERIES_RE = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный замер всех маршрутов api/urls.py на синтетической соцсети (api.synthetic): для каждого '
+            'эндпоинта запросов/сек, задержки p50/p95/p99 и число SQL-запросов. Эндпоинты нагружаются по очереди, '
+            'каждый - --concurrency одновременными запросами к WSGI-обработчику в процессе, без сети. '
+            'Данные создаются во временной тестовой БД (как у manage.py test), настроенная БД не меняется. '
+            'Результат можно сохранить в JSON и сравнить с прошлым запуском')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Пользователей в тестовых данных')
+        parser.add_argument('--posts', type=int, default=10000, help='Постов в тестовых данных')
+        parser.add_argument('--friends', type=float, default=10, help='Среднее число друзей')
+        parser.add_argument('--exponent', type=float, default=2.5, help='Показатель степенного закона числа друзей')
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на каждый эндпоинт')
+        parser.add_argument('--concurrency', type=int, default=16, help='Одновременных запросов')
+        parser.add_argument('--only', nargs='+', metavar='NAME', help='Только эндпоинты с этими именами URL')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Сохранить результат в JSON-файл')
+        parser.add_argument('--compare', help='JSON-файл прошлого запуска: вывести изменения')
+
+    def handle(self, *args, **options):
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3':
+            self.stderr.write('Замер рассчитан на локальную SQLite, результаты с другой БД несравнимы')
+        previous = self.load(options['compare']) if options['compare'] else None
+
+        self.host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        try:
+            spec = synthetic.SyntheticSpec(options['users'], options['posts'], friends=options['friends'],
+                                           exponent=options['exponent'], seed=options['seed'], prefix=PREFIX)
+        except ValueError as e:
+            raise CommandError(e)
+
+        with self.test_database():
+            user_ids = synthetic.create_dataset(spec, password=PASSWORD,
+                                                log=lambda message: self.stdout.write(f'  {message}'))
+            self.rng = random.Random(options['seed'])
+            self.prepare(user_ids)
+            scenarios = self.scenarios()
+
+            results = []
+            self.stdout.write(f'{"Эндпоинт":<52}{"запр/сек":>9}{"p50, мс":>9}{"p95, мс":>9}{"p99, мс":>9}'
+                              f'{"SQL":>6}{"ошибок":>8}')
+            with tempfile.TemporaryDirectory() as metrics_dir, self.measurement_settings(metrics_dir):
+                handler = WSGIHandler()
+                for pattern in urls.urlpatterns:
+                    route, name = str(pattern.pattern), pattern.name
+                    if options['only'] and name not in options['only']:
+                        continue
+                    if route not in scenarios:
+                        self.stderr.write(f'Нет сценария для {route} ({name}), эндпоинт пропущен')
+                        continue
+                    method, make_request = scenarios[route]
+                    # Запросы готовятся заранее: выдача токенов и выборки для них не входят в замер
+                    requests = [make_request() for _ in range(options['requests'])]
+                    result = self.run(handler, method, requests, options['concurrency'])
+                    result.update(method=method, route=route, name=name)
+                    results.append(result)
+                    self.report(result, previous)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'environment': self.environment(), 'dataset': spec.as_dict(),
+                           'requests': options['requests'], 'concurrency': options['concurrency'],
+                           'endpoints': results}, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результат записан в {options["output"]}')
+
+    @staticmethod
+    def load(path) -> dict:
+        try:
+            with open(path, encoding='utf-8') as file:
+                return {f'{item["method"]} {item["route"]}': item for item in json.load(file)['endpoints']}
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Не удалось прочитать {path}: {e}')
+
+    @contextmanager
+    def test_database(self):
+        """
+        Временная БД с миграциями вместо настроенной, удаляется после замера. SQLite - файлом, а не в памяти:
+        с общей in-memory БД параллельные запросы блокируют друг друга по таблицам
+        """
+        connection = connections[DEFAULT_DB_ALIAS]
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'bench.sqlite3')
+            old_name = connection.settings_dict['NAME']
+            self.stdout.write('Создание временной БД...')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                # Кэши процесса не должны отдавать данные настроенной БД
+                for alias in caches:
+                    caches[alias].clear()
+                yield
+            finally:
+                # Фоновые задачи замеров пишут во временную БД, она удаляется только после них
+                tasks.shutdown()
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def measurement_settings(metrics_dir):
+        # Замер SQL в каждом запросе, без журнала медленных запросов и без метрик в рабочем каталоге
+        return override_settings(
+            API_TIMING_SAMPLE_RATE=1.0, API_TIMING_HEADER=True, API_TIMING_SLOW_MS=float('inf'),
+            API_TIMING_QUERY_BUDGET=float('inf'), API_METRICS_DIR=metrics_dir,
+        )
+
+    @staticmethod
+    def environment() -> dict:
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': settings.DATABASES['default']['ENGINE'],
+            'platform': platform.platform(),
+        }
+
+    def prepare(self, user_ids):
+        """Пользователи, от имени которых идут запросы, и данные для сценариев записи"""
+        rng = self.rng
+        self.user_ids = user_ids
+        self.post_ids = list(Post.objects.filter(author__username__startswith=PREFIX).values_list('id', flat=True))
+
+        self.actors = rng.sample(user_ids, min(50, len(user_ids)))
+        User.objects.filter(id=self.actors[0]).update(is_staff=True)
+        self.actor_tokens = [self.token_for(user_id) for user_id in self.actors]
+
+        # Ленты заполняются только у пользователей, от имени которых читается лента
+        friendships = UserFriend.objects.filter(user_id__in=self.actors, is_friend=True)
+        for owner_id, author_id in friendships.values_list('user_id', 'friend_id'):
+            feed.backfill_timeline(owner_id, author_id)
+        feed.mark_fanned_out(Post.objects.filter(author__username__startswith=PREFIX))
+
+        relations = UserFriend.objects.filter(user__username__startswith=PREFIX)
+        self.related = set()
+        self.pending = []
+        for user_id, friend_id, is_friend in relations.values_list('user_id', 'friend_id', 'is_friend'):
+            self.related.update({(user_id, friend_id), (friend_id, user_id)})
+            if not is_friend:
+                self.pending.append((friend_id, user_id))
+        rng.shuffle(self.pending)
+
+    @staticmethod
+    def token_for(user_id) -> str:
+        return tokens.issue_tokens(User.objects.get(id=user_id))['access']
+
+    def actor(self) -> str:
+        return self.actor_tokens[self.rng.randrange(len(self.actor_tokens))]
+
+    def sample(self, ids, count=10) -> str:
+        return ','.join(str(item) for item in self.rng.sample(ids, min(count, len(ids))))
+
+    def new_pair(self):
+        """Пара пользователей без дружбы и заявок между ними"""
+        while True:
+            user_id, friend_id = self.rng.sample(self.user_ids, 2)
+            if (user_id, friend_id) not in self.related:
+                self.related.update({(user_id, friend_id), (friend_id, user_id)})
+                return user_id, friend_id
+
+    def scenarios(self) -> dict:
+        """
+        Маршрут из api/urls.py -> (метод, функция, возвращающая запрос (путь, тело, access-токен)).
+        Тело None у POST - данных для запроса не осталось, он пропускается
+        """
+        rng = self.rng
+
+        def user_id():
+            return rng.choice(self.user_ids)
+
+        def answer_request(path):
+            # Каждая заявка (получатель, отправитель) принимается или отклоняется один раз
+            if not self.pending:
+                return path, None, None
+            receiver, sender = self.pending.pop()
+            return path, {'user_id': sender}, self.token_for(receiver)
+
+        def make_friend():
+            sender, receiver = self.new_pair()
+            return 'users/make-friend/', {'user_id': receiver}, self.token_for(sender)
+
+        def login():
+            username = f'{PREFIX}{rng.randrange(len(self.user_ids))}'
+            return 'users/auth/login/', {'username': username, 'password': PASSWORD, 'mode': 'token'}, None
+
+        def logout():
+            issued = tokens.issue_tokens(User.objects.get(id=user_id()))
+            return 'users/auth/logout/', {'refresh': issued['refresh']}, issued['access']
+
+        def refresh():
+            issued = tokens.issue_tokens(User.objects.get(id=user_id()))
+            return 'users/auth/refresh/', {'refresh': issued['refresh']}, None
+
+        return {
+            'posts/get/all/': ('GET', lambda: ('posts/get/all/', None, None)),
+            'posts/get/user/<int:user_id>/': ('GET', lambda: (f'posts/get/user/{user_id()}/', None, None)),
+            'posts/get/batch/': ('GET', lambda: (f'posts/get/batch/?ids={self.sample(self.post_ids)}', None, None)),
+            'posts/get/feed/': ('GET', lambda: ('posts/get/feed/', None, self.actor())),
+            'posts/create/': ('POST', lambda: (
+                'posts/create/', {'title': 'Новый пост', 'description': 'Текст поста'}, self.actor(),
+            )),
+            'posts/get/<int:post_id>/': ('GET', lambda: (f'posts/get/{rng.choice(self.post_ids)}/', None, None)),
+
+            'users/get/me/': ('GET', lambda: ('users/get/me/', None, self.actor())),
+            'users/get/me/counters/': ('GET', lambda: ('users/get/me/counters/', None, self.actor())),
+            'users/get/<int:user_id>/': ('GET', lambda: (f'users/get/{user_id()}/', None, None)),
+            'users/get/batch/': ('GET', lambda: (f'users/get/batch/?ids={self.sample(self.user_ids)}', None, None)),
+            'users/auth/csrf/': ('GET', lambda: ('users/auth/csrf/', None, None)),
+            'users/auth/login/': ('POST', login),
+            'users/auth/logout/': ('POST', logout),
+            'users/auth/refresh/': ('POST', refresh),
+            'users/get/<int:user_id>/friends-count/': ('GET', lambda: (
+                f'users/get/{user_id()}/friends-count/', None, None,
+            )),
+            'users/get/<int:user_id>/friends/': ('GET', lambda: (f'users/get/{user_id()}/friends/', None, None)),
+            'users/get/me/friends-requests/': ('GET', lambda: ('users/get/me/friends-requests/', None, self.actor())),
+            'users/get/me/friends-requests-send/': ('GET', lambda: (
+                'users/get/me/friends-requests-send/', None, self.actor(),
+            )),
+            'users/make-friend/': ('POST', make_friend),
+            'users/accept-friend/': ('POST', lambda: answer_request('users/accept-friend/')),
+            'users/reject-friend/': ('POST', lambda: answer_request('users/reject-friend/')),
+            'users/update-profile/': ('POST', lambda: (
+                'users/update-profile/', {'description': 'Обновленное описание'}, self.actor(),
+            )),
+
+            'cache/stats/': ('GET', lambda: ('cache/stats/', None, self.actor_tokens[0])),
+        }
+
+    def run(self, handler, method, requests, concurrency) -> dict:
+        def request(item):
+            path, body, token = item
+            if body is None and method != 'GET':
+                # Данных для сценария не осталось (например, заявок в друзья)
+                return None
+            route_path, _, query = path.partition('?')
+            payload = json.dumps(body or {}).encode() if method != 'GET' else b''
+            environ = {
+                'REQUEST_METHOD': method, 'PATH_INFO': API_PREFIX + route_path, 'QUERY_STRING': query,
+                'SCRIPT_NAME': '', 'SERVER_NAME': self.host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': self.host, 'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(payload)),
+                'wsgi.input': io.BytesIO(payload), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+                'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False, 'wsgi.version': (1, 0),
+            }
+            if token:
+                environ['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+
+            response_start = []
+            started = time.perf_counter()
+            response = handler(environ, lambda status, headers, exc_info=None: response_start.append((status, headers)))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            latency = time.perf_counter() - started
+
+            status, headers = response_start[0]
+            match = QUERIES_RE.search(dict(headers).get('Server-Timing', ''))
+            queries, db_time = (int(match.group(2)), float(match.group(1))) if match else (None, None)
+            return latency, int(status.split()[0]), queries, db_time
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = time.perf_counter()
+            results = [result for result in executor.map(request, requests) if result is not None]
+            elapsed = time.perf_counter() - started
+        return self.summary(results, elapsed)
+
+    @staticmethod
+    def summary(results, elapsed) -> dict:
+        latencies = sorted(latency * 1000 for latency, _, _, _ in results)
+        statuses = {}
+        for _, status, _, _ in results:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        queries = [count for _, _, count, _ in results if count is not None]
+        db_times = [db_time for _, _, _, db_time in results if db_time is not None]
+
+        def percentile(value):
+            # Ближайший ранг: на малом числе запросов не выходит за наблюдаемые значения
+            return latencies[min(len(latencies) - 1, int(len(latencies) * value / 100))] if latencies else None
+
+        return {
+            'requests': len(results),
+            'errors': sum(1 for _, status, _, _ in results if status >= 400),
+            'statuses': statuses,
+            'throughput': len(results) / elapsed if results else 0.0,
+            'p50': percentile(50),
+            'p95': percentile(95),
+            'p99': percentile(99),
+            'max': latencies[-1] if latencies else None,
+            'mean': statistics.fmean(latencies) if latencies else None,
+            'queries': statistics.fmean(queries) if queries else None,
+            'max_queries': max(queries) if queries else None,
+            'db_ms': statistics.fmean(db_times) if db_times else None,
+        }
+
+    def report(self, result, previous):
+        title = f'{result["method"]} {result["route"]}'
+        if not result['requests']:
+            self.stdout.write(f'{title:<52}{"нет данных для запросов":>50}')
+            return
+
+        queries = '-' if result['queries'] is None else f'{result["queries"]:.1f}'
+        self.stdout.write(
+            f'{title:<52}{result["throughput"]:>9.0f}{result["p50"]:>9.1f}{result["p95"]:>9.1f}{result["p99"]:>9.1f}'
+            f'{queries:>6}{result["errors"]:>8}'
+        )
+
+        before = (previous or {}).get(title)
+        if before and before.get('requests'):
+            def change(key):
+                return f'{(result[key] - before[key]) / before[key] * 100:+.0f}%' if before[key] else '-'
+
+            queries = '' if result['queries'] is None or before.get('queries') is None else \
+                f'{result["queries"] - before["queries"]:+.1f}'
+            self.stdout.write(f'{"  изменение":<52}{change("throughput"):>9}{change("p50"):>9}{change("p95"):>9}'
+                              f'{change("p99"):>9}{queries:>6}')
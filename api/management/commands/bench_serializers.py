@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Post
+from api.serializers import post_serializer, user_serializer
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Сравнение скорости сериализации (строк/сек): свойства Model.json против строк .values_list(). '
+            'Данные создаются во временной транзакции и откатываются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Количество постов и пользователей')
+        parser.add_argument('--repeat', type=int, default=3, help='Количество прогонов, берется лучший')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+
+        with transaction.atomic():
+            User.objects.bulk_create(
+                User(username=f'bench_serializers_{i}', first_name='Имя', last_name='Фамилия', description='Описание')
+                for i in range(rows)
+            )
+            users = list(User.objects.filter(username__startswith='bench_serializers_').order_by('id'))
+            Post.objects.bulk_create(
+                Post(title=f'Пост {i}', description='Текст поста', author=users[i % len(users)])
+                for i in range(rows)
+            )
+            posts = Post.objects.filter(author__in=users)
+            users = User.objects.filter(username__startswith='bench_serializers_')
+
+            cases = [
+                # Прежнее поведение Post.json: автор подгружался отдельным запросом на каждый пост
+                ('Post.json + post.author.id', lambda: [dict(post.json, author=post.author.id) for post in posts.all()]),
+                ('Post.json', lambda: [post.json for post in posts.all()]),
+                ('post_serializer.rows', lambda: list(post_serializer.rows(post_serializer.values(posts)))),
+                ('User.json', lambda: [user.json for user in users.all()]),
+                ('user_serializer.rows', lambda: list(user_serializer.rows(user_serializer.values(users)))),
+            ]
+
+            self.stdout.write(f'{"Способ":<32}{"строк/сек":>14}{"сек":>10}')
+            for name, case in cases:
+                best = min(self.measure(case) for _ in range(options['repeat']))
+                self.stdout.write(f'{name:<32}{rows / best:>14.0f}{best:>10.3f}')
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def measure(case) -> float:
+        started = time.perf_counter()
+        case()
+        return time.perf_counter() - started
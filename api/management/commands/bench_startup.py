@@ -0,0 +1,90 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Холодный старт воркера: то же, что делает WSGI-сервер до первого ответа (get_wsgi_application и загрузка URLconf)
+WORKER_SCRIPT = '''
+import json, os, resource, sys, time
+started = time.perf_counter()
+os.environ['DJANGO_SETTINGS_MODULE'] = sys.argv[1]
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+setup = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+finished = time.perf_counter()
+print(json.dumps({
+    'setup': setup - started,
+    'urls': finished - setup,
+    'modules': len(sys.modules),
+    'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Замер холодного старта воркера в отдельных процессах (python -X importtime): время до готовности, '
+            'django.setup и загрузка URLconf, число модулей, пиковая память (RSS) и самые дорогие по импорту пакеты')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Запусков, в отчете медиана')
+        parser.add_argument('--top', type=int, default=15, help='Сколько самых дорогих пакетов показать')
+        parser.add_argument('--json', action='store_true', help='Вывести результат одним JSON-объектом')
+
+    def handle(self, *args, **options):
+        runs = [self.run_worker() for _ in range(options['runs'])]
+        result = {
+            key: statistics.median(run[key] for run in runs)
+            for key in ('total', 'setup', 'urls', 'modules', 'rss')
+        }
+        # Время импорта пакетов по последнему запуску: кэши файловой системы и .pyc уже прогреты
+        packages = runs[-1]['packages'].most_common(options['top'])
+
+        if options['json']:
+            result['packages'] = dict(packages)
+            self.stdout.write(json.dumps(result, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f'Запусков: {len(runs)}, медиана')
+        self.stdout.write(f'  до готовности воркера: {result["total"] * 1000:.0f} мс '
+                          f'(django.setup {result["setup"] * 1000:.0f} мс, URLconf {result["urls"] * 1000:.0f} мс)')
+        self.stdout.write(f'  модулей загружено: {result["modules"]:.0f}')
+        # ru_maxrss в Linux - в килобайтах
+        self.stdout.write(f'  пиковая память: {result["rss"] / 1024:.1f} МБ')
+        self.stdout.write('Импорт по пакетам (собственное время модулей):')
+        for package, microseconds in packages:
+            self.stdout.write(f'  {package:<30}{microseconds / 1000:>8.1f} мс')
+
+    def run_worker(self) -> dict:
+        env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+        started = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', WORKER_SCRIPT, settings.SETTINGS_MODULE],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        total = time.perf_counter() - started
+        if process.returncode != 0:
+            raise CommandError(f'Воркер завершился с ошибкой:\n{process.stderr[-2000:]}')
+
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result['total'] = total
+        result['packages'] = self.parse_importtime(process.stderr)
+        return result
+
+    @staticmethod
+    def parse_importtime(output: str) -> Counter:
+        """Сумма собственного времени импорта (мкс) по пакетам верхнего уровня"""
+        packages = Counter()
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_time, _, name = line[len('import time:'):].split('|')
+            packages[name.strip().split('.')[0]] += int(self_time)
+        return packages
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.openapi import generate_schema, read_schema_file
+
+
+class Command(BaseCommand):
+    help = ('Сборка OpenAPI-схемы в OPENAPI_SCHEMA_FILE, откуда ее отдает /docs/swagger.json/. '
+            'С --check файл не пишется: команда завершается с ошибкой, если он не совпадает со схемой view')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Проверить, что файл схемы совпадает со схемой текущих view')
+
+    def handle(self, *args, **options):
+        path = settings.OPENAPI_SCHEMA_FILE
+        content = generate_schema()
+
+        if options['check']:
+            current = read_schema_file()
+            if current is None:
+                raise CommandError(f'Файл схемы {path} не найден, выполните build_openapi')
+            if current != content:
+                raise CommandError(f'Схема в {path} устарела: view изменились, выполните build_openapi')
+            self.stdout.write(f'Схема в {path} актуальна')
+            return
+
+        with open(path, 'wb') as file:
+            file.write(content)
+        self.stdout.write(f'Схема записана в {path} ({len(content)} байт)')
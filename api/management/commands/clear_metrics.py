@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import metrics
+
+
+class Command(BaseCommand):
+    help = ('Удаление файлов метрик процессов из API_METRICS_DIR (api.metrics). Запускается перед стартом сервера: '
+            'иначе в /metrics входят значения воркеров прошлого запуска')
+
+    def handle(self, *args, **options):
+        removed = metrics.clear()
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов метрик: {removed} ({settings.API_METRICS_DIR})'))
@@ -0,0 +1,112 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from api.images import variant_name
+from api.models import MediaBlob, Post
+from api.storage import get_content_storage
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Удаление файлов контентно-адресуемого хранилища, на которые не осталось ссылок '
+            '(и их вариантов), а также файлов без записи MediaBlob')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=None,
+                            help='Не трогать файлы, измененные меньше стольких секунд назад '
+                                 '(по умолчанию MEDIA_GC_GRACE_SECONDS)')
+        parser.add_argument('--recount', action='store_true',
+                            help='Сначала пересчитать ссылки по Post.image и User.avatar')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не удалять')
+
+    def handle(self, *args, **options):
+        grace = settings.MEDIA_GC_GRACE_SECONDS if options['grace'] is None else options['grace']
+        dry_run = options['dry_run']
+        self.storage = get_content_storage()
+        self.cutoff = time.time() - grace
+        cutoff_date = timezone.now() - timedelta(seconds=grace)
+
+        if options['recount']:
+            changed = self.recount(dry_run)
+            self.stdout.write(f'Исправлено счетчиков ссылок: {changed}')
+
+        removed = 0
+        unused = MediaBlob.objects.filter(ref_count=0, updated_date__lt=cutoff_date)
+        for name in list(unused.values_list('name', flat=True)):
+            if dry_run:
+                removed += 1
+                continue
+            # Условие повторяется в DELETE: ссылка могла появиться после выборки
+            deleted, _ = unused.filter(name=name).delete()
+            if deleted and self.delete_file(name):
+                removed += 1
+
+        orphans = 0
+        for names in self.iter_blob_names():
+            known = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+            for name in names:
+                if name in known:
+                    continue
+                if dry_run or self.delete_file(name):
+                    orphans += 1
+
+        message = f'Удалено файлов без ссылок: {removed}, файлов без записи: {orphans}'
+        self.stdout.write(message if dry_run else self.style.SUCCESS(message))
+
+    def recount(self, dry_run: bool) -> int:
+        prefix = settings.MEDIA_BLOBS_DIR + '/'
+        counts = Counter()
+        for model, field in ((Post, 'image'), (User, 'avatar')):
+            rows = (model.objects.filter(**{f'{field}__startswith': prefix})
+                    .values(field).annotate(references=Count('pk')).values_list(field, 'references').order_by())
+            for name, references in rows:
+                counts[name] += references
+
+        changed = 0
+        for name, ref_count in MediaBlob.objects.values_list('name', 'ref_count'):
+            actual = counts.pop(name, 0)
+            if actual != ref_count:
+                changed += 1
+                if not dry_run:
+                    MediaBlob.objects.filter(name=name).update(ref_count=actual, updated_date=timezone.now())
+
+        # Ссылки на файлы без записи (например, после bulk_create, который не вызывает сигналы)
+        for name, ref_count in counts.items():
+            changed += 1
+            if not dry_run and self.storage.exists(name):
+                MediaBlob.objects.get_or_create(
+                    name=name, defaults={'size': self.storage.size(name), 'ref_count': ref_count}
+                )
+        return changed
+
+    def iter_blob_names(self):
+        """Имена старых файлов хранилища порциями по каталогу"""
+        root = self.storage.path(settings.MEDIA_BLOBS_DIR)
+        for directory, _, files in os.walk(root):
+            names = []
+            for file in files:
+                path = os.path.join(directory, file)
+                if os.path.getmtime(path) < self.cutoff:
+                    names.append(os.path.relpath(path, self.storage.location).replace(os.sep, '/'))
+            if names:
+                yield names
+
+    def delete_file(self, name: str) -> bool:
+        path = self.storage.path(name)
+        # Тот же файл мог быть только что загружен повторно (хранилище обновляет его время) - тогда он остается
+        if os.path.exists(path) and os.path.getmtime(path) >= self.cutoff:
+            return False
+
+        self.storage.delete(name)
+        if not os.path.basename(name).startswith('.upload-'):
+            for variant in settings.IMAGE_VARIANTS:
+                default_storage.delete(variant_name(name, variant))
+        return True
@@ -0,0 +1,95 @@
+import io
+import os
+import pstats
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import profiling
+
+
+class Command(BaseCommand):
+    help = ('Снимки профилирования запросов из API_PROFILE_DIR (api.profiling): список по view, сводка '
+            'cProfile-снимков одного view и объединение их свернутых стеков. '
+            '--token выдает значение заголовка X-Profile')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--token', action='store_true',
+                            help='Вывести токен для заголовка X-Profile (действует API_PROFILE_TOKEN_MAX_AGE секунд)')
+        parser.add_argument('--view', help='Имя URL: свести все снимки этого view')
+        parser.add_argument('--sort', default='cumulative', help='Сортировка сводки pstats (cumulative, tottime, ...)')
+        parser.add_argument('--limit', type=int, default=30, help='Строк в сводке pstats')
+        parser.add_argument('--folded-output', help='Файл для объединенных стеков сэмплера (--view)')
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(profiling.make_token())
+            return
+
+        captures = self.find_captures(Path(settings.API_PROFILE_DIR))
+        if options['view']:
+            self.aggregate(options['view'], captures.get(options['view'], []), options)
+        else:
+            self.list(captures)
+
+    @staticmethod
+    def find_captures(directory: Path) -> dict:
+        """{имя URL: [(время, режим, путь), ...]}, по времени снимка"""
+        captures = defaultdict(list)
+        if directory.is_dir():
+            for name in os.listdir(directory):
+                parsed = profiling.parse_capture_name(name)
+                if parsed is not None:
+                    url_name, stamp, mode = parsed
+                    captures[url_name].append((stamp, mode, directory / name))
+        for items in captures.values():
+            items.sort()
+        return captures
+
+    def list(self, captures: dict):
+        if not captures:
+            self.stdout.write(f'Снимков нет в {settings.API_PROFILE_DIR}')
+            return
+
+        self.stdout.write(f'{"View":<36}{"cProfile":>10}{"сэмплер":>10}  Последний')
+        for url_name, items in sorted(captures.items(), key=lambda item: -len(item[1])):
+            modes = Counter(mode for _, mode, _ in items)
+            self.stdout.write(f'{url_name:<36}{modes[profiling.CPROFILE]:>10}{modes[profiling.SAMPLE]:>10}  '
+                              f'{items[-1][0]}')
+
+    def aggregate(self, url_name: str, items: list, options):
+        if not items:
+            raise CommandError(f'Нет снимков view {url_name}')
+
+        prof_files = [str(path) for _, mode, path in items if mode == profiling.CPROFILE]
+        if prof_files:
+            output = io.StringIO()
+            stats = pstats.Stats(*prof_files, stream=output)
+            stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+            self.stdout.write(f'cProfile, снимков: {len(prof_files)}, время - сумма по всем снимкам')
+            self.stdout.write(output.getvalue())
+
+        folded_files = [path for _, mode, path in items if mode == profiling.SAMPLE]
+        if folded_files:
+            stacks = Counter()
+            for path in folded_files:
+                with open(path, encoding='utf-8') as file:
+                    for line in file:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        stacks[stack] += int(count)
+
+            self.stdout.write(f'Сэмплер, снимков: {len(folded_files)}, сэмплов: {sum(stacks.values())}')
+            if options['folded_output']:
+                with open(options['folded_output'], 'w', encoding='utf-8') as file:
+                    for stack, count in stacks.most_common():
+                        file.write(f'{stack} {count}\n')
+                self.stdout.write(f'Объединенные стеки записаны в {options["folded_output"]}')
+            else:
+                # Без файла - самые частые функции на вершине стека
+                leaves = Counter()
+                for stack, count in stacks.items():
+                    leaves[stack.rsplit(';', 1)[-1]] += count
+                for leaf, count in leaves.most_common(options['limit']):
+                    self.stdout.write(f'{count:>8}  {leaf}')
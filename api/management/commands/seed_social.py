@@ -0,0 +1,47 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import synthetic
+
+
+class Command(BaseCommand):
+    help = ('Наполнение базы синтетической соцсетью (api.synthetic): N пользователей, M постов, дружбы со степенным '
+            'распределением числа друзей и заявки в друзья. Строки генерируются кусками в --workers процессах, '
+            'вставка - bulk_create по кускам в транзакциях, хэш пароля считается один раз. При одинаковых '
+            'параметрах и --seed данные одинаковые. Ленты друзей после этого заполняет manage.py backfill_feeds')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, required=True, help='Пользователей')
+        parser.add_argument('--posts', type=int, required=True, help='Постов')
+        parser.add_argument('--friends', type=float, default=20, help='Среднее число друзей')
+        parser.add_argument('--requests', type=float, default=1, help='Среднее число входящих заявок в друзья')
+        parser.add_argument('--exponent', type=float, default=2.5,
+                            help='Показатель степенного закона числа друзей, больше 2 (меньше - сильнее перекос)')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--days', type=float, default=365, help='За сколько последних дней созданы посты')
+        parser.add_argument('--prefix', default='seed_', help='Префикс логинов, логин - префикс и номер')
+        parser.add_argument('--password', default='password', help='Пароль всех пользователей')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессов генерации строк')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Строк в одном bulk_create')
+
+    def handle(self, *args, **options):
+        try:
+            spec = synthetic.SyntheticSpec(
+                options['users'], options['posts'], friends=options['friends'], requests=options['requests'],
+                exponent=options['exponent'], seed=options['seed'], prefix=options['prefix'], days=options['days'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        started = time.perf_counter()
+        try:
+            synthetic.create_dataset(
+                spec, workers=options['workers'], batch_size=options['batch_size'], password=options['password'],
+                log=lambda message: self.stdout.write(f'  {message}'),
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(f'Данные созданы за {time.perf_counter() - started:.0f} с'))
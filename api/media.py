@@ -0,0 +1,151 @@
+"""
+Отдача медиафайлов.
+
+MEDIA_SERVE_MODE:
+- 'direct' - файл отдает Django: FileResponse (wsgi.file_wrapper, sendfile у сервера), Range/206,
+  ETag/If-None-Match, Last-Modified/If-Modified-Since;
+- 'x-accel' - только заголовок X-Accel-Redirect (nginx, internal location MEDIA_ACCEL_PREFIX);
+- 'x-sendfile' - только заголовок X-Sendfile с путем к файлу (Apache mod_xsendfile, lighttpd).
+В режимах offload файл, Range и условные запросы обрабатывает веб-сервер, воркер Python байты не читает.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+
+from api.storage import is_blob
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def get_cache_control(name: str) -> str:
+    if is_blob(name):
+        # Имя файла - хэш содержимого, по этому адресу всегда те же байты
+        return f'public, max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}, immutable'
+    return f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}'
+
+
+def get_etag(name: str, stat: os.stat_result) -> str:
+    if is_blob(name):
+        return '"%s"' % posixpath.splitext(posixpath.basename(name))[0]
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+def parse_range(header: str, size: int):
+    """(start, end) включительно для одного диапазона, None - отдать файл целиком, ValueError - 416"""
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match:
+        # Несколько диапазонов и другие единицы не поддерживаются: по RFC 9110 можно ответить 200 целиком
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if size == 0:
+        # В пустом файле нет ни одного байта, любой диапазон невыполним
+        raise ValueError
+
+    if not start:
+        # bytes=-N - последние N байт
+        length = int(end)
+        if length == 0:
+            raise ValueError
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def iter_range(path: str, start: int, length: int):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def is_not_modified(request, etag: str, mtime: int) -> bool:
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = (tag.strip() for tag in if_none_match.split(','))
+        tags = (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+        return if_none_match.strip() == '*' or etag in tags
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and mtime <= if_modified_since
+
+
+def serve_direct(request, name: str, path: str, stat: os.stat_result):
+    etag = get_etag(name, stat)
+    mtime = int(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(mtime),
+        'Cache-Control': get_cache_control(name),
+        'Accept-Ranges': 'bytes',
+    }
+
+    if is_not_modified(request, etag, mtime):
+        return HttpResponseNotModified(headers=headers)
+
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+    size = stat.st_size
+
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # If-Range с другой версией файла - диапазон игнорируется, отдается новый файл целиком
+    if range_header and (if_range is None or if_range.strip() in (etag, http_date(mtime))):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                iter_range(path, start, end - start + 1), status=206, content_type=content_type, headers=headers
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+            return response
+
+    response = FileResponse(open(path, 'rb'), content_type=content_type, headers=headers)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404('Файл не найден')
+    if not os.path.isfile(full_path):
+        raise Http404('Файл не найден')
+
+    mode = settings.MEDIA_SERVE_MODE
+    if mode == 'direct':
+        return serve_direct(request, path, full_path, stat)
+
+    response = HttpResponse(content_type=mimetypes.guess_type(full_path)[0] or 'application/octet-stream')
+    response['Cache-Control'] = get_cache_control(path)
+    if mode == 'x-accel':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = full_path
+    else:
+        raise ValueError(f'Неизвестный MEDIA_SERVE_MODE: {mode}')
+    return response
@@ -0,0 +1,271 @@
+"""
+Метрики процессов в формате Prometheus без внешних зависимостей.
+
+Каждый процесс пишет свои значения в файл <API_METRICS_DIR>/<pid>.db через mmap: запись - это изменение
+числа в памяти, без системных вызовов и блокировок между процессами. /metrics читает файлы всех процессов
+и суммирует значения, поэтому воркеры WSGI-сервера видны как один сервис. Файлы завершившихся воркеров
+остаются и продолжают входить в сумму (счетчики не уменьшаются), поэтому каталог очищается командой
+clear_metrics перед запуском сервера.
+
+Без API_METRICS_TOKEN /metrics доступен только с DEBUG.
+
+Пока метрики не включены (enable() из api.middleware.MetricsMiddleware), запись ничего не делает:
+команды manage.py не создают файлов.
+"""
+import hmac
+import json
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+
+INITIAL_SIZE = 64 * 1024
+# Начало файла - занятый размер (int32) и выравнивание до 8 байт
+HEADER_SIZE = 8
+
+_registry = {}
+_values = None
+_values_lock = threading.Lock()
+_enabled = False
+
+
+class MmapValues:
+    """
+    Словарь ключ -> float в файле. Запись: длина ключа (int32), ключ в UTF-8, выравнивание до 8 байт,
+    значение (double). Новые записи дописываются в конец, затем обновляется занятый размер в начале файла
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.pid = os.getpid()
+        self._file = open(path, 'a+b')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._file.truncate(INITIAL_SIZE)
+            size = INITIAL_SIZE
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._lock = threading.Lock()
+        self._positions = {}
+
+        self._used = struct.unpack_from('i', self._mmap, 0)[0]
+        if self._used == 0:
+            self._used = HEADER_SIZE
+            struct.pack_into('i', self._mmap, 0, self._used)
+        for key, _, position in read_entries(self._mmap, self._used):
+            self._positions[key] = position
+
+    def add(self, key: str, amount: float):
+        with self._lock:
+            position = self._positions.get(key, None)
+            if position is None:
+                position = self._append(key)
+            value = struct.unpack_from('d', self._mmap, position)[0]
+            struct.pack_into('d', self._mmap, position, value + amount)
+
+    def _append(self, key: str) -> int:
+        encoded = key.encode('utf-8')
+        padded = len(encoded) + (8 - (len(encoded) + 4) % 8)
+        size = 4 + padded + 8
+        while self._used + size > len(self._mmap):
+            capacity = len(self._mmap) * 2
+            self._mmap.close()
+            self._file.truncate(capacity)
+            self._mmap = mmap.mmap(self._file.fileno(), capacity)
+
+        struct.pack_into(f'i{padded}sd', self._mmap, self._used, len(encoded), encoded, 0.0)
+        position = self._used + 4 + padded
+        self._used += size
+        # Размер меняется последним: читатель не увидит запись без значения
+        struct.pack_into('i', self._mmap, 0, self._used)
+        self._positions[key] = position
+        return position
+
+
+def read_entries(data, used: int):
+    """(ключ, значение, позиция значения) всех записей файла"""
+    position = HEADER_SIZE
+    while position < used:
+        length = struct.unpack_from('i', data, position)[0]
+        padded = length + (8 - (length + 4) % 8)
+        key = bytes(data[position + 4:position + 4 + length]).decode('utf-8')
+        value_position = position + 4 + padded
+        yield key, struct.unpack_from('d', data, value_position)[0], value_position
+        position = value_position + 8
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def _get_values():
+    global _values
+    pid = os.getpid()
+    # После fork у дочернего процесса свой файл
+    if _values is None or _values.pid != pid:
+        with _values_lock:
+            if _values is None or _values.pid != pid:
+                directory = Path(settings.API_METRICS_DIR)
+                directory.mkdir(parents=True, exist_ok=True)
+                _values = MmapValues(directory / f'{pid}.db')
+    return _values
+
+
+def _key(name: str, labels) -> str:
+    return json.dumps([name, labels], ensure_ascii=False, separators=(',', ':'))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _labels(self, labels: dict) -> list:
+        return [[name, str(labels[name])] for name in self.labelnames]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        if _enabled and amount:
+            _get_values().add(_key(f'{self.name}_total', self._labels(labels)), amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not _enabled:
+            return
+        labels = self._labels(labels)
+        bound = next((bucket for bucket in self.buckets if value <= bucket), None)
+        # В файле - число значений в каждом интервале, накопительные бакеты считаются при выгрузке
+        le = '+Inf' if bound is None else repr(float(bound))
+        values = _get_values()
+        values.add(_key(f'{self.name}_bucket', labels + [['le', le]]), 1)
+        values.add(_key(f'{self.name}_sum', labels), value)
+
+
+def clear() -> int:
+    """Удаляет файлы значений всех процессов (перед запуском сервера). Число удаленных файлов"""
+    directory = Path(settings.API_METRICS_DIR)
+    if not directory.is_dir():
+        return 0
+    removed = 0
+    for path in directory.glob('*.db'):
+        path.unlink()
+        removed += 1
+    return removed
+
+
+def collect() -> dict:
+    """Сумма значений всех процессов: {(имя, метки): значение}"""
+    totals = {}
+    directory = Path(settings.API_METRICS_DIR)
+    if not directory.is_dir():
+        return totals
+    for path in directory.glob('*.db'):
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < HEADER_SIZE:
+            continue
+        for key, value, _ in read_entries(data, struct.unpack_from('i', data, 0)[0]):
+            name, labels = json.loads(key)
+            sample = (name, tuple(tuple(label) for label in labels))
+            totals[sample] = totals.get(sample, 0.0) + value
+    return totals
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_sample(name: str, labels, value: float) -> str:
+    if labels:
+        name += '{%s}' % ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+    return f'{name} {value!r}'
+
+
+def render() -> str:
+    """Текстовый формат Prometheus 0.0.4"""
+    totals = collect()
+    lines = []
+    for metric in _registry.values():
+        # У счетчика в формате 0.0.4 имя семейства совпадает с именем значения (..._total)
+        family = f'{metric.name}_total' if metric.type == 'counter' else metric.name
+        lines.append(f'# HELP {family} {metric.documentation}')
+        lines.append(f'# TYPE {family} {metric.type}')
+
+        if metric.type == 'counter':
+            name = family
+            for (sample_name, labels), value in sorted(totals.items()):
+                if sample_name == name:
+                    lines.append(_format_sample(name, labels, value))
+            continue
+
+        # Гистограмма: накопительные бакеты, +Inf, _sum и _count на каждый набор меток
+        series = {}
+        for (sample_name, labels), value in totals.items():
+            if sample_name == f'{metric.name}_bucket':
+                series.setdefault(labels[:-1], {})[labels[-1][1]] = value
+        for labels in sorted(series):
+            counts = series[labels]
+            cumulative = 0.0
+            for bucket in metric.buckets:
+                cumulative += counts.get(repr(float(bucket)), 0.0)
+                lines.append(_format_sample(f'{metric.name}_bucket', labels + (('le', repr(float(bucket))),),
+                                            cumulative))
+            cumulative += counts.get('+Inf', 0.0)
+            lines.append(_format_sample(f'{metric.name}_bucket', labels + (('le', '+Inf'),), cumulative))
+            total = totals.get((f'{metric.name}_sum', labels), 0.0)
+            lines.append(_format_sample(f'{metric.name}_sum', labels, total))
+            lines.append(_format_sample(f'{metric.name}_count', labels, cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = settings.API_METRICS_TOKEN
+    if not token:
+        # Без токена метрики (имена view, нагрузка) открыты всем: это допустимо только при разработке
+        if not settings.DEBUG:
+            return HttpResponse(status=404)
+    # compare_digest сравнивает строки только из ASCII, заголовок может быть любым
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    response = HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+requests_total = Counter(
+    'api_requests', 'Запросы по имени URL, методу и коду ответа', ('view', 'method', 'status'),
+)
+request_duration = Histogram(
+    'api_request_duration_seconds', 'Время обработки запроса', ('view',), LATENCY_BUCKETS,
+)
+db_queries = Histogram(
+    'api_db_queries', 'SQL-запросов на запрос (только запросы с замером SQL)', ('view',),
+    (0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+db_duration = Histogram(
+    'api_db_duration_seconds', 'Время в БД на запрос (только запросы с замером SQL)', ('view',), LATENCY_BUCKETS,
+)
+cache_requests = Counter(
+    'api_cache_requests', 'Обращения к кэшам: кэш, уровень (local, shared) и результат (hit, miss, not_modified)',
+    ('cache', 'level', 'result'),
+)
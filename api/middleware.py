@@ -0,0 +1,236 @@
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from api import instrumentation, metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_STATUSES = (200, 304, 404)
+
+
+def is_anonymous_request(request) -> bool:
+    return settings.SESSION_COOKIE_NAME not in request.COOKIES and 'HTTP_AUTHORIZATION' not in request.META
+
+
+class PublicCacheMiddleware:
+    """
+    Cache-Control для ответов @public_cache (api.response_cache). Стоит перед SessionMiddleware, чтобы убрать
+    добавленный ею Vary: Cookie: анонимный публичный ответ не зависит от cookie и хранится прокси/CDN один раз.
+    Ответ с Set-Cookie или на запрос с сессией/токеном помечается private и Vary: Cookie, Authorization
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    def process(self, request, response):
+        if not getattr(response, 'public_cache', False):
+            return response
+
+        if is_anonymous_request(request) and not response.cookies and response.status_code in PUBLIC_STATUSES:
+            patch_cache_control(
+                response, public=True, max_age=settings.API_PUBLIC_CACHE_MAX_AGE,
+                stale_while_revalidate=settings.API_PUBLIC_CACHE_STALE_WHILE_REVALIDATE,
+            )
+            if response.has_header('Vary'):
+                vary = [value.strip() for value in response['Vary'].split(',')]
+                vary = [value for value in vary if value and value.lower() != 'cookie']
+                if vary:
+                    response['Vary'] = ', '.join(vary)
+                else:
+                    del response['Vary']
+        else:
+            patch_cache_control(response, private=True)
+            # Ответ зависит от пользователя. SessionMiddleware добавляет Vary: Cookie, только если view читал
+            # сессию, а async view с токеном сессию не читают
+            patch_vary_headers(response, ('Cookie', 'Authorization'))
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Метрики запроса (api.metrics): счетчик по имени URL, методу и коду ответа, гистограммы времени ответа,
+    числа SQL и времени в БД. Стоит перед RequestTimingMiddleware и берет его замеры (request.timings)
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        metrics.enable()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process(request, await self.get_response(request))
+
+    @staticmethod
+    def process(request, response):
+        timings = getattr(request, 'timings', None)
+        if timings is None:
+            return response
+
+        # Только имена URL, а не пути: число рядов метрик не зависит от id в адресах
+        view = timings.url_name or 'unresolved'
+        metrics.requests_total.inc(view=view, method=request.method, status=response.status_code)
+        metrics.request_duration.observe(timings.total_time, view=view)
+        if timings.sampled:
+            metrics.db_queries.observe(timings.queries, view=view)
+            metrics.db_duration.observe(timings.db_time, view=view)
+        return response
+
+
+class RequestTimingMiddleware:
+    """
+    Замеры запроса (api.instrumentation): число SQL-запросов и время в БД, самый долгий из них, сериализация JSON,
+    время view и общее. Запрос помечается именем URL (request.timings.url_name), ответ получает Server-Timing,
+    запрос дольше API_TIMING_SLOW_MS или с числом SQL больше API_TIMING_QUERY_BUDGET пишется в лог.
+    SQL и сериализация считаются у доли запросов API_TIMING_SAMPLE_RATE, общее время - у всех
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            instrumentation.stop(token)
+        return self.process(request, response)
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            instrumentation.stop(token)
+        return self.process(request, response)
+
+    @staticmethod
+    def start(request):
+        sampled = settings.API_TIMING_SAMPLE_RATE >= 1 or random.random() < settings.API_TIMING_SAMPLE_RATE
+        request.timings, token = instrumentation.start(sampled)
+        return token
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timings.view_started = time.perf_counter()
+
+    def process(self, request, response):
+        timings = request.timings
+        match = getattr(request, 'resolver_match', None)
+        timings.finish(match.view_name if match else None)
+
+        if settings.API_TIMING_HEADER:
+            response['Server-Timing'] = timings.server_timing()
+
+        slow = timings.total_time * 1000 > settings.API_TIMING_SLOW_MS
+        if slow or timings.queries > settings.API_TIMING_QUERY_BUDGET:
+            self.log(request, response, timings)
+        return response
+
+    @staticmethod
+    def log(request, response, timings):
+        if timings.sampled:
+            logger.warning(
+                'Медленный запрос %s %s [%s] %s: %.1f мс (view %.1f мс), SQL: %d за %.1f мс, '
+                'сериализация %.1f мс, самый долгий SQL %.1f мс: %s',
+                request.method, request.path, timings.url_name, response.status_code, timings.total_time * 1000,
+                timings.view_time * 1000, timings.queries, timings.db_time * 1000, timings.serialize_time * 1000,
+                timings.slowest_time * 1000, timings.slowest_sql,
+            )
+        else:
+            logger.warning(
+                'Медленный запрос %s %s [%s] %s: %.1f мс (view %.1f мс), SQL не замерялся',
+                request.method, request.path, timings.url_name, response.status_code, timings.total_time * 1000,
+                timings.view_time * 1000,
+            )
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запроса по требованию (api.profiling). Стоит после AuthenticationMiddleware: ?profile=
+    доступен персоналу по сессии. Имя файла снимка возвращается в заголовке X-Profile-Capture.
+    Под ASGI снимок async view включает и другие запросы, которые event loop обработал в это же время
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not profiling.is_requested(request):
+            return self.get_response(request)
+
+        capture = self.start(profiling.get_requested_mode(request))
+        if capture is None:
+            return self.process(request, None, self.get_response(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            capture.stop()
+        return self.process(request, capture, response)
+
+    async def __acall__(self, request):
+        if not profiling.is_requested(request):
+            return await self.get_response(request)
+
+        # Пользователь сессии загружается из БД, в event loop это можно сделать только через поток
+        capture = self.start(await sync_to_async(profiling.get_requested_mode)(request))
+        if capture is None:
+            return self.process(request, None, await self.get_response(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            capture.stop()
+        return self.process(request, capture, response)
+
+    @staticmethod
+    def start(mode):
+        # Неверный токен, не персонал или превышен лимит - запрос обрабатывается как обычно
+        if mode is None or not profiling.allow_capture():
+            return None
+        capture = profiling.Capture(mode)
+        capture.start()
+        return capture
+
+    @staticmethod
+    def process(request, capture, response):
+        if capture is not None:
+            match = getattr(request, 'resolver_match', None)
+            response['X-Profile-Capture'] = capture.save(match.view_name if match else None)
+        return response
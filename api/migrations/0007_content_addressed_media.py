@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:52
+
+import api.storage
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_image_variants_ready'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.get_content_storage, upload_to='post_images/', verbose_name='Изображение'),
+        ),
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='Размер')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('updated_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Медиафайл',
+                'verbose_name_plural': 'Медиафайлы',
+                'indexes': [models.Index(fields=['ref_count', 'updated_date'], name='media_blob_unused_idx')],
+            },
+        ),
+    ]
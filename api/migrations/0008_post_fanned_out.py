@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_fanned_out(apps, schema_editor):
+    # До этой миграции посты авторов с небольшим числом друзей уже раскладывались по лентам
+    Post = apps.get_model('api', 'Post')
+    Post.objects.filter(author__friend_count__lte=settings.FEED_FANOUT_MAX_FRIENDS).update(fanned_out=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_content_addressed_media'),
+        ('users', '0004_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='fanned_out',
+            field=models.BooleanField(default=False, verbose_name='Разложен по лентам'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['author', 'created_date', 'id'], name='post_not_fanned_out_idx'),
+        ),
+        migrations.RunPython(mark_fanned_out, migrations.RunPython.noop),
+    ]
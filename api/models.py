@@ -1,6 +1,10 @@
 from django.db import models
-from drf_yasg import openapi
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
 
+from api.serializers import lazy_schema, post_serializer
+from api.storage import get_content_storage
 from users.models import User
 
 
@@ -8,44 +12,97 @@ class Post(models.Model):
     title = models.CharField(max_length=200, verbose_name='Заголовок')
     description = models.TextField(verbose_name='Описание', blank=True, default='')
     created_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
-    image = models.ImageField(verbose_name='Изображение', upload_to='post_images/', null=True, blank=True)
+    image = models.ImageField(verbose_name='Изображение', upload_to='post_images/', null=True, blank=True,
+                              storage=get_content_storage)
+    image_variants_ready = models.BooleanField(default=False, verbose_name='Варианты изображения созданы')
     author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Автор')
+    # Пост разложен по лентам друзей (api.feed). Пока False, лента читает его из постов друзей при запросе
+    fanned_out = models.BooleanField(default=False, verbose_name='Разложен по лентам')
 
-    schema = openapi.Schema(
-        type=openapi.TYPE_OBJECT,
-        title='Пост',
-        required=['id', 'title', 'description', 'created_date', 'author'],
-        properties={
-            'id': openapi.Schema(type=openapi.TYPE_INTEGER, title='ID поста'),
-            'title': openapi.Schema(type=openapi.TYPE_STRING, title='Заголовок'),
-            'description': openapi.Schema(type=openapi.TYPE_STRING, title='Описание'),
-            'created_date': openapi.Schema(type=openapi.TYPE_NUMBER, title='Дата создания', description='Количество секунд с начала эпохи UNIX'),
-            'image': openapi.Schema(type=openapi.TYPE_STRING, title='Изображение', description='Ссылка на изображение'),
-            'author': openapi.Schema(type=openapi.TYPE_INTEGER, title='ID автора')
-        }
-    )
-
-    collection_schema = openapi.Schema(
-        type=openapi.TYPE_OBJECT,
-        title='Посты',
-        properties={
-            'posts': openapi.Schema(type=openapi.TYPE_ARRAY, title='Коллекция постов', items=schema)
-        }
-    )
+    schema = lazy_schema(post_serializer.schema)
+
+    @lazy_schema
+    def collection_schema():
+        from drf_yasg import openapi
+
+        return openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            title='Посты',
+            properties={
+                'posts': openapi.Schema(type=openapi.TYPE_ARRAY, title='Коллекция постов', items=Post.schema),
+                'next_cursor': openapi.Schema(
+                    type=openapi.TYPE_STRING, title='Курсор следующей страницы', x_nullable=True,
+                    description='null, если страница последняя. В режиме legacy отсутствует'
+                ),
+            }
+        )
 
     @property
     def json(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-            'created_date': self.created_date.timestamp(),
-            'image': self.image.url if self.image else None,
-            'author': self.author.id,
-        }
+        return post_serializer.from_instance(self)
+
     class Meta:
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
 
+        indexes = [
+            models.Index(fields=['created_date', 'id'], name='post_created_id_idx'),
+            models.Index(fields=['author', 'created_date', 'id'], name='post_author_created_id_idx'),
+            # Неразложенных постов мало: частичный индекс для их чтения в ленте
+            models.Index(fields=['author', 'created_date', 'id'], condition=models.Q(fanned_out=False),
+                         name='post_not_fanned_out_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.title} by {self.author}"
+
+class TimelineEntry(models.Model):
+    """Пост друга в ленте пользователя (fan-out-on-write), заполняется из api.feed"""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline', verbose_name='Владелец ленты')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries', verbose_name='Пост')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', verbose_name='Автор')
+    # Копия Post.created_date, чтобы страница ленты читалась по одному индексу без сортировки
+    created_date = models.DateTimeField(verbose_name='Дата создания поста')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+
+        unique_together = [['owner', 'post']]
+        indexes = [
+            models.Index(fields=['owner', 'created_date', 'post'], name='timeline_owner_created_idx'),
+            models.Index(fields=['owner', 'author'], name='timeline_owner_author_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.title} by {self.author}"
\ No newline at end of file
+        return f"{self.post_id} -> {self.owner_id}"
+
+
+class MediaBlob(models.Model):
+    """Файл контентно-адресуемого хранилища (api.storage) и число ссылок на него из Post.image и User.avatar"""
+    name = models.CharField(max_length=255, unique=True, verbose_name='Имя файла')
+    size = models.PositiveBigIntegerField(default=0, verbose_name='Размер')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')
+    updated_date = models.DateTimeField(default=timezone.now, verbose_name='Дата изменения')
+
+    class Meta:
+        verbose_name = 'Медиафайл'
+        verbose_name_plural = 'Медиафайлы'
+
+        indexes = [
+            # Поиск неиспользуемых файлов командой gc_media
+            models.Index(fields=['ref_count', 'updated_date'], name='media_blob_unused_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+    @classmethod
+    def acquire(cls, name: str, size: int = 0):
+        _, created = cls.objects.get_or_create(name=name, defaults={'size': size, 'ref_count': 1})
+        if not created:
+            cls.objects.filter(name=name).update(ref_count=F('ref_count') + 1, updated_date=timezone.now())
+
+    @classmethod
+    def release(cls, name: str):
+        cls.objects.filter(name=name).update(ref_count=Greatest(F('ref_count') - 1, 0), updated_date=timezone.now())
@@ -0,0 +1,114 @@
+"""
+OpenAPI-схема API, построенная один раз.
+
+Схема читается из OPENAPI_SCHEMA_FILE (пишется командой build_openapi), а если файла нет - строится
+генератором drf_yasg при первом запросе. Дальше JSON, YAML и их gzip-версии отдаются из памяти с ETag.
+Swagger UI и ReDoc загружают схему отсюда (SWAGGER_SETTINGS/REDOC_SETTINGS SPEC_URL).
+Генератор, кодеки и страницы UI drf_yasg импортируются при первом запросе документации, не при старте воркера.
+"""
+import gzip
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+CONTENT_TYPES = {
+    '.json': 'application/json',
+    '.yaml': 'application/yaml; charset=utf-8',
+}
+
+_documents = None
+_ui_views = {}
+_lock = threading.Lock()
+
+
+def get_api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Social API",
+        default_version='v1.0',
+        description="Общая документация для API Social",
+        contact=openapi.Contact(email="MikanDrawChannel@gmail.com"),
+    )
+
+
+class SchemaDocument:
+    def __init__(self, content: bytes, content_type: str):
+        self.content = content
+        self.content_type = content_type
+        # mtime=0 - одинаковые байты gzip при каждой сборке
+        self.gzip_content = gzip.compress(content, compresslevel=9, mtime=0)
+        self.etag = '"%s"' % hashlib.sha1(content).hexdigest()
+
+
+def generate_schema() -> bytes:
+    """JSON схемы по текущим view. request=None: без host и схемы протокола, UI подставляет текущие"""
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(get_api_info())
+    schema = generator.get_schema(request=None, public=True)
+    return OpenAPICodecJson(validators=[], pretty=True).encode(schema)
+
+
+def read_schema_file():
+    try:
+        with open(settings.OPENAPI_SCHEMA_FILE, 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def get_documents() -> dict:
+    global _documents
+    if _documents is None:
+        with _lock:
+            if _documents is None:
+                from drf_yasg.codecs import yaml_dump
+
+                content = read_schema_file() or generate_schema()
+                data = json.loads(content)
+                _documents = {
+                    '.json': SchemaDocument(content, CONTENT_TYPES['.json']),
+                    '.yaml': SchemaDocument(yaml_dump(data, binary=True), CONTENT_TYPES['.yaml']),
+                }
+    return _documents
+
+
+def schema_file_view(request, format):
+    document = get_documents().get(format, None)
+    if document is None:
+        raise Http404
+
+    if request.headers.get('If-None-Match', '') == document.etag:
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(document.gzip_content, content_type=document.content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(document.content, content_type=document.content_type)
+
+    response['ETag'] = document.etag
+    response['Cache-Control'] = f'public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def schema_ui_view(request, renderer):
+    """Страница Swagger UI (renderer='swagger') или ReDoc ('redoc'), схему она загружает из schema_file_view"""
+    view = _ui_views.get(renderer, None)
+    if view is None:
+        from drf_yasg.views import get_schema_view
+        from rest_framework import permissions
+
+        view = get_schema_view(
+            get_api_info(),
+            public=True,
+            permission_classes=[permissions.AllowAny],
+        ).with_ui(renderer, cache_timeout=0)
+        _ui_views[renderer] = view
+    return view(request)
@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from drf_yasg import openapi
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_date: datetime, pk: int) -> str:
+    raw = json.dumps([created_date.isoformat(), pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_date, pk = json.loads(raw)
+        return datetime.fromisoformat(created_date), int(pk)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise CursorError('Некорректный курсор') from e
+
+
+def get_page_size(request) -> int:
+    limit = request.GET.get('limit', None)
+    if not limit:
+        return settings.API_PAGE_SIZE
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise CursorError('Некорректный размер страницы')
+    if limit < 1:
+        raise CursorError('Некорректный размер страницы')
+
+    return min(limit, settings.API_PAGE_SIZE_MAX)
+
+
+def is_legacy_request(request) -> bool:
+    if settings.API_LEGACY_COLLECTIONS:
+        return True
+    return request.GET.get('legacy', '').lower() in ('1', 'true', 'yes')
+
+
+def _page_queryset(queryset, cursor, size: int, date_field: str, id_field: str):
+    queryset = queryset.order_by(f'-{date_field}', f'-{id_field}')
+    if cursor:
+        created_date, pk = cursor
+        queryset = queryset.filter(
+            Q(**{f'{date_field}__lt': created_date}) | Q(**{date_field: created_date, f'{id_field}__lt': pk})
+        )
+    return queryset[:size]
+
+
+def page_rows(queryset, cursor, size: int, date_field='created_date', id_field='id') -> list:
+    return list(_page_queryset(queryset, cursor, size, date_field, id_field))
+
+
+async def apage_rows(queryset, cursor, size: int, date_field='created_date', id_field='id') -> list:
+    return [row async for row in _page_queryset(queryset, cursor, size, date_field, id_field)]
+
+
+def _page_request(request):
+    size = get_page_size(request)
+    cursor = request.GET.get('cursor', None)
+    return size, decode_cursor(cursor) if cursor else None
+
+
+def _merge_pages(pages, sources, size: int):
+    keyed = {}
+    for rows, (_, date_field, id_field) in zip(pages, sources):
+        for row in rows:
+            keyed.setdefault((getattr(row, date_field), getattr(row, id_field)), row)
+
+    keys = sorted(keyed, reverse=True)
+    next_cursor = None
+    if len(keys) > size:
+        keys = keys[:size]
+        next_cursor = encode_cursor(*keys[-1])
+
+    return [keyed[key] for key in keys], next_cursor
+
+
+def paginate(queryset, request, date_field='created_date', id_field='id'):
+    """
+    Keyset-пагинация по (created_date, id) от новых к старым.
+    Каждая страница - один проход по индексу, без OFFSET.
+    Возвращает объекты страницы и курсор следующей страницы (None, если это последняя).
+    """
+    return paginate_merged(request, [(queryset, date_field, id_field)])
+
+
+def paginate_merged(request, sources):
+    """
+    Keyset-пагинация по объединению нескольких выборок [(queryset, date_field, id_field), ...] с общим ключом.
+    Из каждой выборки читается не больше страницы, одинаковые ключи (один и тот же пост) схлопываются.
+    """
+    size, cursor = _page_request(request)
+    pages = [page_rows(queryset, cursor, size + 1, date_field, id_field) for queryset, date_field, id_field in sources]
+    return _merge_pages(pages, sources, size)
+
+
+async def apaginate(queryset, request, date_field='created_date', id_field='id'):
+    return await apaginate_merged(request, [(queryset, date_field, id_field)])
+
+
+async def apaginate_merged(request, sources):
+    size, cursor = _page_request(request)
+    pages = [
+        await apage_rows(queryset, cursor, size + 1, date_field, id_field) for queryset, date_field, id_field in sources
+    ]
+    return _merge_pages(pages, sources, size)
+
+
+collection_parameters = [
+    openapi.Parameter(
+        'cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+        description='Курсор страницы из поля next_cursor предыдущего ответа'
+    ),
+    openapi.Parameter(
+        'limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+        description='Размер страницы (ограничен сервером)'
+    ),
+    openapi.Parameter(
+        'legacy', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+        description='Вернуть всю коллекцию целиком, без пагинации (старый формат ответа)'
+    ),
+]
@@ -0,0 +1,163 @@
+"""
+Профилирование отдельных запросов по требованию (api.middleware.ProfilingMiddleware).
+
+Запрос профилируется, если у него заголовок X-Profile с подписанным токеном (manage.py profile_captures --token)
+или параметр ?profile= и пользователь - персонал. Режимы:
+- 'cprofile' - cProfile, файл .prof для pstats/snakeviz;
+- 'sample' - сэмплер стека потока раз в API_PROFILE_SAMPLE_INTERVAL секунд, файл .folded в формате
+  свернутых стеков (flamegraph.pl, speedscope). Почти не замедляет запрос, но короткие вызовы не видны.
+Снимки пишутся в API_PROFILE_DIR как <имя URL>__<время>__<pid>.<расширение>,
+не чаще API_PROFILE_RATE_LIMIT в минуту.
+"""
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+MODES = (CPROFILE, SAMPLE)
+EXTENSIONS = {CPROFILE: '.prof', SAMPLE: '.folded'}
+
+TOKEN_VALUE = 'profile'
+SEPARATOR = '__'
+
+
+def _signer() -> signing.TimestampSigner:
+    return signing.TimestampSigner(salt='api.profiling')
+
+
+def make_token() -> str:
+    return _signer().sign(TOKEN_VALUE)
+
+
+def is_valid_token(token: str) -> bool:
+    try:
+        return _signer().unsign(token, max_age=settings.API_PROFILE_TOKEN_MAX_AGE) == TOKEN_VALUE
+    except signing.BadSignature:
+        return False
+
+
+def is_requested(request) -> bool:
+    """Быстрая проверка без обращения к пользователю и подписи"""
+    return 'X-Profile' in request.headers or 'profile' in request.GET
+
+
+def get_requested_mode(request):
+    """Режим профилирования для запроса или None, если профилировать не нужно"""
+    token = request.headers.get('X-Profile', None)
+    if token is not None:
+        if not is_valid_token(token):
+            return None
+        mode = request.headers.get('X-Profile-Mode', CPROFILE)
+    else:
+        mode = request.GET.get('profile', None)
+        if mode is None:
+            return None
+        # request.user здесь - пользователь сессии (AuthenticationMiddleware)
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_staff:
+            return None
+        if mode in ('', '1'):
+            mode = CPROFILE
+    return mode if mode in MODES else None
+
+
+def allow_capture() -> bool:
+    """Ограничение числа снимков в минуту, общее для процессов с общим кэшем"""
+    cache = caches[settings.API_PROFILE_CACHE_ALIAS]
+    key = f'profile-rate:{int(time.time() // 60)}'
+    cache.add(key, 0, 60)
+    try:
+        return cache.incr(key) <= settings.API_PROFILE_RATE_LIMIT
+    except ValueError:
+        # Ключ истек между add и incr
+        return False
+
+
+class StackSampler:
+    """Раз в interval секунд снимает стек потока thread_id и считает одинаковые стеки"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='api-profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+class Capture:
+    """Профилирование одного запроса: start() перед обработкой, save() после"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.profiler = None
+        self.sampler = None
+
+    def start(self):
+        if self.mode == CPROFILE:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), settings.API_PROFILE_SAMPLE_INTERVAL)
+            self.sampler.start()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        else:
+            self.sampler.stop()
+
+    def save(self, url_name) -> str:
+        """Записывает снимок в API_PROFILE_DIR, возвращает имя файла"""
+        directory = Path(settings.API_PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f'.{int(now * 1000) % 1000:03d}'
+        name = SEPARATOR.join((url_name or 'unresolved', stamp, str(os.getpid()))) + EXTENSIONS[self.mode]
+
+        if self.profiler is not None:
+            self.profiler.dump_stats(directory / name)
+        else:
+            self.sampler.dump(directory / name)
+        return name
+
+
+def parse_capture_name(name: str):
+    """(имя URL, время, режим) по имени файла снимка или None для посторонних файлов"""
+    stem, extension = os.path.splitext(name)
+    modes = {extension: mode for mode, extension in EXTENSIONS.items()}
+    parts = stem.split(SEPARATOR)
+    if extension not in modes or len(parts) != 3:
+        return None
+    return parts[0], parts[1], modes[extension]
@@ -0,0 +1,150 @@
+"""
+Кэш ответов GET-эндпоинтов с версиями объектов.
+
+Каждый эндпоинт зависит от версий объектов ('post:1', 'user:5', 'user-friends:5', ...), версии хранятся в кэше.
+Запись в объект меняет его версию (invalidate), из-за чего меняются ключ кэша и ETag всех зависящих ответов.
+Условный GET (If-None-Match / If-Modified-Since) проверяется только по версиям, без обращения к БД и к view.
+
+Версии живут не дольше API_RESPONSE_CACHE_TIMEOUT. С кэшем в процессе (LocMemCache) изменение в одном воркере
+не видно другим, и они отдают старые данные (и 304 на старый ETag), пока их версия не истечет. Чтобы изменения
+были видны сразу, кэш API_RESPONSE_CACHE_ALIAS должен быть общим (Redis, Memcached).
+"""
+import asyncio
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from api import metrics
+
+
+def get_cache():
+    return caches[settings.API_RESPONSE_CACHE_ALIAS]
+
+
+def _version_key(name: str) -> str:
+    return f'api:version:{name}'
+
+
+def get_versions(names) -> list:
+    """Версии (время изменения в наносекундах) по именам. Неизвестная версия считается изменившейся сейчас"""
+    cache = get_cache()
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), settings.API_RESPONSE_CACHE_TIMEOUT)
+            versions[key] = cache.get(key) or time.time_ns()
+
+    return [versions[key] for key in keys]
+
+
+def invalidate(*names):
+    cache = get_cache()
+    now = time.time_ns()
+    cache.set_many({_version_key(name): now for name in names}, settings.API_RESPONSE_CACHE_TIMEOUT)
+
+
+def _lookup(request, endpoint: str, names):
+    """(etag, last_modified, готовый ответ или None) - проверка версий, условного запроса и кэша"""
+    stamps = get_versions(names)
+    last_modified = max(stamps) // 10 ** 9
+    fingerprint = f'{endpoint}|{request.get_full_path()}|{",".join(map(str, stamps))}'
+    etag = '"%s"' % hashlib.sha1(fingerprint.encode()).hexdigest()
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        if not_modified.status_code == 304:
+            _set_validators(not_modified, etag, last_modified)
+            metrics.cache_requests.inc(cache='response', level='shared', result='not_modified')
+        return etag, last_modified, not_modified
+
+    cached = get_cache().get(f'api:response:{etag}')
+    metrics.cache_requests.inc(cache='response', level='shared', result='miss' if cached is None else 'hit')
+    if cached is not None:
+        content_type, content = cached
+        response = HttpResponse(content, content_type=content_type)
+        return etag, last_modified, _set_validators(response, etag, last_modified)
+
+    return etag, last_modified, None
+
+
+def _store(response, etag: str, last_modified: int):
+    if response.status_code != 200 or response.streaming:
+        return response
+    get_cache().set(f'api:response:{etag}', (response['Content-Type'], response.content),
+                    settings.API_RESPONSE_CACHE_TIMEOUT)
+    return _set_validators(response, etag, last_modified)
+
+
+def _set_validators(response, etag: str, last_modified: int):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def cached_response(endpoint: str, versions, bypass=None):
+    """
+    Кэширует успешные ответы view и отвечает 304 на условные запросы.
+    versions(**kwargs) - имена версий, от которых зависит ответ (kwargs - параметры из URL).
+    bypass(request) - True, если ответ зависит не только от versions: такой запрос идет в view без кэша и ETag.
+    Подходит и для async def view: обращения к кэшу тогда выполняются через sync_to_async.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD') or (bypass is not None and bypass(request)):
+                    return await view(request, *args, **kwargs)
+
+                etag, last_modified, response = await sync_to_async(_lookup)(request, endpoint, versions(**kwargs))
+                if response is not None:
+                    return response
+                response = await view(request, *args, **kwargs)
+                return await sync_to_async(_store)(response, etag, last_modified)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or (bypass is not None and bypass(request)):
+                return view(request, *args, **kwargs)
+
+            etag, last_modified, response = _lookup(request, endpoint, versions(**kwargs))
+            if response is not None:
+                return response
+            return _store(view(request, *args, **kwargs), etag, last_modified)
+
+        return wrapper
+
+    return decorator
+
+
+def public_cache(view):
+    """
+    Отмечает ответ публичного эндпоинта (одинаковый для всех пользователей). Заголовки Cache-Control: public
+    ставит api.middleware.PublicCacheMiddleware, если запрос анонимный и ответ не устанавливает cookie
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            response = await view(request, *args, **kwargs)
+            response.public_cache = True
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        response.public_cache = True
+        return response
+
+    return wrapper
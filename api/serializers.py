@@ -0,0 +1,151 @@
+import typing
+
+from django.core.files.storage import default_storage
+
+
+def to_timestamp(value):
+    return value.timestamp()
+
+
+def to_media_url(value):
+    # value - имя файла из .values() или FieldFile у экземпляра модели
+    return default_storage.url(str(value)) if value else None
+
+
+def to_variant_urls(value, ready):
+    # Ссылки на варианты появляются только после того, как фоновая задача их создала
+    if not (value and ready):
+        return None
+    # api.images импортирует Pillow: модели и сериализаторы не должны тянуть его при импорте
+    from api.images import variant_urls
+    return variant_urls(str(value))
+
+
+class lazy_schema:
+    """
+    Схема drf_yasg как атрибут класса (Post.schema): factory вызывается при первом обращении, то есть при
+    сборке документации, а не при импорте модели. drf_yasg импортируется только внутри factory
+    """
+
+    def __init__(self, factory: typing.Callable):
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        schema = self.factory()
+        # Дальше атрибут класса - готовая схема
+        setattr(owner, self.name, schema)
+        return schema
+
+
+class Field:
+    def __init__(self, key: str, source: typing.Union[str, tuple], type: str, title: str, description: str = None,
+                 required: bool = True, convert: typing.Callable = None):
+        """
+        source - поле модели или кортеж полей (тогда convert получает их значения и вызывается всегда),
+        type - тип OpenAPI ('integer', 'string', ...)
+        """
+        self.key = key
+        self.sources = (source,) if isinstance(source, str) else tuple(source)
+        self.type = type
+        self.title = title
+        self.description = description
+        self.required = required
+        self.convert = convert
+
+    def schema(self):
+        from drf_yasg import openapi
+
+        if self.description:
+            return openapi.Schema(type=self.type, title=self.title, description=self.description)
+        return openapi.Schema(type=self.type, title=self.title)
+
+
+class RowSerializer:
+    """
+    Единая карта полей для JSON-представления модели.
+    Из неё строятся openapi-схема, сериализация экземпляра (Model.json) и сериализация строк
+    .values_list() без создания экземпляров моделей.
+    """
+
+    def __init__(self, title: str, fields: typing.List[Field]):
+        self.title = title
+        self.fields = fields
+        # Каждое поле модели выбирается один раз, даже если нужно нескольким полям ответа
+        sources = {}
+        plan = []
+        for field in fields:
+            indexes = tuple(sources.setdefault(source, len(sources)) for source in field.sources)
+            plan.append((field.key, indexes[0] if len(indexes) == 1 else indexes, field.convert))
+        self.sources = tuple(sources)
+        self._plan = tuple(plan)
+
+    def schema(self):
+        from drf_yasg import openapi
+
+        return openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            title=self.title,
+            required=[field.key for field in self.fields if field.required],
+            properties={field.key: field.schema() for field in self.fields},
+        )
+
+    def from_instance(self, instance) -> dict:
+        return self.serialize(tuple(getattr(instance, source) for source in self.sources))
+
+    def values(self, queryset, prefix: str = '', extra: tuple = ()):
+        """
+        Строки для serialize(). prefix - путь до модели через связь (например 'post__'),
+        extra - дополнительные поля в конце строки (для курсора пагинации), в ответ не попадают
+        """
+        return queryset.values_list(*(prefix + source for source in self.sources), *extra, named=True)
+
+    def serialize(self, row) -> dict:
+        result = {}
+        for key, index, convert in self._plan:
+            if index.__class__ is tuple:
+                result[key] = convert(*(row[i] for i in index))
+            else:
+                value = row[index]
+                result[key] = convert(value) if convert and value is not None else value
+        return result
+
+    def rows(self, values):
+        return map(self.serialize, values)
+
+    def subset(self, keys) -> 'RowSerializer':
+        """Сериализатор только с полями keys (в порядке карты полей). Неизвестное поле - ValueError"""
+        unknown = set(keys) - {field.key for field in self.fields}
+        if unknown:
+            raise ValueError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+        return RowSerializer(self.title, [field for field in self.fields if field.key in keys])
+
+
+post_serializer = RowSerializer('Пост', [
+    Field('id', 'id', 'integer', 'ID поста'),
+    Field('title', 'title', 'string', 'Заголовок'),
+    Field('description', 'description', 'string', 'Описание'),
+    Field('created_date', 'created_date', 'number', 'Дата создания',
+          'Количество секунд с начала эпохи UNIX', convert=to_timestamp),
+    Field('image', 'image', 'string', 'Изображение', 'Ссылка на изображение',
+          required=False, convert=to_media_url),
+    Field('author', 'author_id', 'integer', 'ID автора'),
+    Field('image_variants', ('image', 'image_variants_ready'), 'object', 'Варианты изображения',
+          'Ссылки на уменьшенные копии: thumb, medium, full. null, пока копии не готовы',
+          required=False, convert=to_variant_urls),
+])
+
+user_serializer = RowSerializer('Пользователь', [
+    Field('id', 'id', 'integer', 'ID', 'ID пользователя'),
+    Field('username', 'username', 'string', 'Логин'),
+    Field('firstName', 'first_name', 'string', 'Имя'),
+    Field('lastName', 'last_name', 'string', 'Фамилия'),
+    Field('description', 'description', 'string', 'Описание профиля'),
+    Field('avatar', 'avatar', 'string', 'Аватар', 'Ссылка на изображение',
+          required=False, convert=to_media_url),
+    Field('avatar_variants', ('avatar', 'avatar_variants_ready'), 'object', 'Варианты аватара',
+          'Ссылки на уменьшенные копии: thumb, medium, full. null, пока копии не готовы',
+          required=False, convert=to_variant_urls),
+])
@@ -0,0 +1,91 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from api import instrumentation, response_cache
+from api.entity_cache import post_cache, user_cache
+from api.models import MediaBlob, Post
+from api.storage import is_blob
+from users.models import User
+
+
+# Версии меняются после коммита: иначе параллельный запрос успеет закэшировать старые данные под новой версией.
+# Так же покрываются изменения не через API (админка, shell).
+# Кэш сущностей сбрасывается и сразу (чтобы текущая транзакция не читала старое), и после коммита
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidate_post(sender, instance: Post, **kwargs):
+    post_cache.invalidate(instance.id)
+    transaction.on_commit(lambda: post_cache.invalidate(instance.id))
+    transaction.on_commit(
+        lambda: response_cache.invalidate(f'post:{instance.id}', f'user-posts:{instance.author_id}')
+    )
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user(sender, instance: User, **kwargs):
+    user_cache.invalidate(instance.id)
+    transaction.on_commit(lambda: user_cache.invalidate(instance.id))
+    transaction.on_commit(lambda: response_cache.invalidate(f'user:{instance.id}'))
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    # Пользователь сессии берется из кэша сущностей (users.backends), после выхода он перечитывается из БД
+    if user is not None:
+        user_cache.invalidate(user.id)
+
+
+# Ссылки на файлы контентно-адресуемого хранилища. Имя файла при загрузке экземпляра запоминается
+# из __dict__, чтобы не подгружать отложенное (.only()/.defer()) поле лишним запросом
+
+MEDIA_FIELDS = {Post: 'image', User: 'avatar'}
+
+
+def _file_name(value) -> str:
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Post)
+@receiver(post_init, sender=User)
+def remember_media_name(sender, instance, **kwargs):
+    field_name = MEDIA_FIELDS[sender]
+    if field_name in instance.__dict__:
+        instance._media_name = _file_name(instance.__dict__[field_name])
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=User)
+def count_media_references(sender, instance, update_fields=None, **kwargs):
+    field_name = MEDIA_FIELDS[sender]
+    if update_fields is not None and field_name not in update_fields:
+        return
+
+    file = getattr(instance, field_name)
+    new_name = file.name or ''
+    # Если прежнее имя неизвестно (поле было отложено), ссылка не освобождается: файл останется, но не пропадет
+    old_name = getattr(instance, '_media_name', None)
+    if new_name == old_name:
+        return
+
+    if is_blob(new_name):
+        MediaBlob.acquire(new_name, file.size)
+    if is_blob(old_name):
+        MediaBlob.release(old_name)
+    instance._media_name = new_name
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=User)
+def release_media(sender, instance, **kwargs):
+    name = _file_name(instance.__dict__.get(MEDIA_FIELDS[sender]))
+    if is_blob(name):
+        MediaBlob.release(name)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # Подсчет SQL для RequestTimingMiddleware, у каждого соединения (в том числе в потоках ASGI)
+    instrumentation.install_query_timer(connection)
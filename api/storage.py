@@ -0,0 +1,91 @@
+"""
+Контентно-адресуемое хранилище медиафайлов.
+
+Файл сохраняется под именем MEDIA_BLOBS_DIR/<ab>/<sha256>.<ext>: хэш считается на лету при копировании
+загрузки во временный файл, одинаковое содержимое хранится один раз. Расширение определяется по формату,
+который распознал Pillow, а не по имени от клиента: иначе a.jpg и a.jpeg с одним содержимым - два файла.
+Ссылки на файл считаются в MediaBlob (api.signals), неиспользуемые файлы удаляет команда gc_media.
+Содержимое по такому имени никогда не меняется, поэтому оно отдается с immutable Cache-Control (api.media).
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.move import file_move_safe
+
+
+def is_blob(name: str) -> bool:
+    return bool(name) and name.startswith(settings.MEDIA_BLOBS_DIR + '/')
+
+
+# Расширение файла по формату Pillow
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+
+
+def detect_extension(path: str, original_name: str) -> str:
+    """Расширение по формату содержимого. Если Pillow файл не распознал - расширение исходного имени"""
+    # Pillow нужен только при сохранении файла
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+    except (UnidentifiedImageError, OSError):
+        image_format = None
+
+    if image_format in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[image_format]
+    _, ext = posixpath.splitext(original_name)
+    return ext.lower()
+
+
+def blob_name(digest: str, ext: str) -> str:
+    return posixpath.join(settings.MEDIA_BLOBS_DIR, digest[:2], digest + ext)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяется содержимым в _save, подбирать свободное имя не нужно
+        return name
+
+    def _save(self, name, content):
+        directory = self.path(settings.MEDIA_BLOBS_DIR)
+        os.makedirs(directory, exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            name = blob_name(digest.hexdigest(), detect_extension(temp_path, name))
+            path = self.path(name)
+            if os.path.exists(path):
+                # Такой файл уже есть: обновляется только время, чтобы gc_media не удалил его прямо сейчас
+                os.utime(path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                file_move_safe(temp_path, path, allow_overwrite=True)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return name
+
+
+_storage = None
+
+
+def get_content_storage() -> ContentAddressedStorage:
+    """storage для ImageField: в миграции попадает ссылка на функцию, а не настройки хранилища"""
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from drf_yasg import openapi
+
+
+def is_stream_request(request) -> bool:
+    return request.GET.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def iterate(queryset):
+    """Проход по queryset курсором БД порциями, без кэша результатов в памяти"""
+    return queryset.iterator(chunk_size=settings.API_STREAM_CHUNK_SIZE)
+
+
+class CollectionChunks:
+    """
+    Фрагменты JSON-объекта {key: [...], **extra}: head(), затем add() на каждый элемент (возвращает готовый
+    фрагмент или None), в конце tail(). Элементы склеиваются порциями по API_STREAM_CHUNK_SIZE
+    """
+
+    def __init__(self, key: str, extra: dict = None):
+        self.encoder = DjangoJSONEncoder()
+        self.chunk_size = settings.API_STREAM_CHUNK_SIZE
+        self.key = key
+        self.extra = extra or {}
+        self.separator = ''
+        self.buffer = []
+
+    def head(self) -> str:
+        return '{%s: [' % self.encoder.encode(self.key)
+
+    def add(self, item):
+        self.buffer.append(self.encoder.encode(item))
+        if len(self.buffer) >= self.chunk_size:
+            return self._flush()
+        return None
+
+    def _flush(self) -> str:
+        chunk = self.separator + ', '.join(self.buffer)
+        self.separator = ', '
+        self.buffer = []
+        return chunk
+
+    def tail(self) -> str:
+        items = self._flush() if self.buffer else ''
+        encode = self.encoder.encode
+        return '%s]%s}' % (items, ''.join(', %s: %s' % (encode(k), encode(v)) for k, v in self.extra.items()))
+
+
+def iter_json_collection(key: str, items, extra: dict = None):
+    """
+    Отдает JSON-объект {key: [...], **extra} по частям.
+    Первый фрагмент уходит до обращения к БД.
+    """
+    chunks = CollectionChunks(key, extra)
+    yield chunks.head()
+    for item in items:
+        chunk = chunks.add(item)
+        if chunk is not None:
+            yield chunk
+    yield chunks.tail()
+
+
+def aiterate(queryset):
+    return queryset.aiterator(chunk_size=settings.API_STREAM_CHUNK_SIZE)
+
+
+async def aiter_json_collection(key: str, items, extra: dict = None):
+    """iter_json_collection для асинхронного источника items (ASGI отдает его без отдельного потока)"""
+    chunks = CollectionChunks(key, extra)
+    yield chunks.head()
+    async for item in items:
+        chunk = chunks.add(item)
+        if chunk is not None:
+            yield chunk
+    yield chunks.tail()
+
+
+def stream_collection(key: str, items, extra: dict = None) -> StreamingHttpResponse:
+    return StreamingHttpResponse(iter_json_collection(key, items, extra), content_type='application/json')
+
+
+def astream_collection(key: str, items, extra: dict = None) -> StreamingHttpResponse:
+    return StreamingHttpResponse(aiter_json_collection(key, items, extra), content_type='application/json')
+
+
+stream_parameter = openapi.Parameter(
+    'stream', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+    description='Потоковая отдача коллекции (для больших списков, без Content-Length)'
+)
@@ -0,0 +1,277 @@
+"""
+Синтетическая соцсеть для бенчмарков (manage.py bench_endpoints) и локальной базы в масштабе продакшена
+(manage.py seed_social).
+
+Число друзей распределено по степенному закону: у пользователя ранга r вес (r + 1) ** (-1 / (exponent - 1)),
+оба конца каждой дружбы выбираются пропорционально весам (модель Chung-Lu). Несколько пользователей получают
+тысячи друзей, большинство - единицы. Авторы постов и отправители заявок выбираются по тем же весам.
+
+Строки генерируются кусками по CHUNK_SIZE, у каждого куска свой генератор случайных чисел от (seed, вид, номер).
+Результат зависит только от параметров SyntheticSpec, но не от числа процессов и порядка обработки кусков.
+Пользователи в кусках - индексы 0..users-1, id в БД им сопоставляет create_dataset.
+Даты постов равномерно распределены по последним days дням и растут вместе с id, как у настоящих постов.
+"""
+import math
+import multiprocessing
+import random
+import time
+from contextlib import contextmanager
+from functools import partial
+
+CHUNK_SIZE = 10_000
+
+FIRST_NAMES = ('Александр', 'Мария', 'Иван', 'Анна', 'Дмитрий', 'Елена', 'Сергей', 'Ольга', 'Андрей', 'Наталья',
+               'Алексей', 'Татьяна', 'Михаил', 'Ирина', 'Никита', 'Юлия', 'Павел', 'Светлана', 'Егор', 'Дарья')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров', 'Соколов', 'Михайлов', 'Новиков',
+              'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров', 'Павлов', 'Козлов')
+WORDS = ('сегодня', 'город', 'новый', 'проект', 'друзья', 'море', 'работа', 'книга', 'фото', 'вечер', 'кофе',
+         'музыка', 'поездка', 'утро', 'идея', 'выходные', 'кино', 'дом', 'погода', 'концерт', 'спорт', 'код')
+
+
+class SyntheticSpec:
+    """
+    Параметры набора данных.
+    friends - среднее число друзей, requests - среднее число входящих заявок на пользователя,
+    exponent - показатель степенного закона числа друзей (больше 2, чем меньше - тем сильнее перекос),
+    days - за сколько последних дней созданы посты
+    """
+
+    def __init__(self, users: int, posts: int, friends: float = 20, requests: float = 1, exponent: float = 2.5,
+                 seed: int = 1, prefix: str = 'synthetic_', days: float = 365):
+        if users < 2:
+            raise ValueError('Нужно хотя бы два пользователя')
+        if exponent <= 2:
+            raise ValueError('Показатель степенного закона должен быть больше 2')
+        if days <= 0:
+            raise ValueError('Период постов должен быть больше нуля дней')
+
+        self.users = users
+        self.posts = posts
+        self.friends = friends
+        self.requests = requests
+        self.exponent = exponent
+        self.seed = seed
+        self.prefix = prefix
+        self.days = days
+
+        # Обратная функция распределения ранга с плотностью, пропорциональной весу, на [0, users)
+        self._power = 1 - 1 / (exponent - 1)
+        self._span = (users + 1) ** self._power - 1
+
+        # Ранг -> индекс пользователя: самые популярные пользователи разбросаны по всему диапазону id
+        rng = self.rng('permutation', 0)
+        self._multiplier = rng.randrange(1, users)
+        while math.gcd(self._multiplier, users) != 1:
+            self._multiplier += 1
+        self._offset = rng.randrange(users)
+
+    def as_dict(self) -> dict:
+        return {'users': self.users, 'posts': self.posts, 'friends': self.friends, 'requests': self.requests,
+                'exponent': self.exponent, 'seed': self.seed, 'days': self.days}
+
+    @property
+    def friendships(self) -> int:
+        return int(self.users * self.friends / 2)
+
+    @property
+    def friend_requests(self) -> int:
+        return int(self.users * self.requests)
+
+    def rng(self, kind: str, chunk: int) -> random.Random:
+        return random.Random(f'{self.seed}:{kind}:{chunk}')
+
+    def sample_user(self, rng: random.Random) -> int:
+        """Индекс пользователя с вероятностью, пропорциональной его весу"""
+        rank = int((1 + rng.random() * self._span) ** (1 / self._power) - 1)
+        return (min(rank, self.users - 1) * self._multiplier + self._offset) % self.users
+
+
+def chunk_count(total: int) -> int:
+    return (total + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+
+def _chunk_range(total: int, chunk: int) -> range:
+    return range(chunk * CHUNK_SIZE, min((chunk + 1) * CHUNK_SIZE, total))
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def user_rows(spec: SyntheticSpec, chunk: int) -> list:
+    """[(индекс, имя, фамилия, описание), ...]"""
+    rng = spec.rng('users', chunk)
+    return [
+        (index, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), _text(rng, rng.randint(0, 12)))
+        for index in _chunk_range(spec.users, chunk)
+    ]
+
+
+def post_rows(spec: SyntheticSpec, chunk: int) -> list:
+    """[(индекс автора, заголовок, текст), ...]"""
+    rng = spec.rng('posts', chunk)
+    return [
+        (spec.sample_user(rng), _text(rng, rng.randint(2, 6)), _text(rng, rng.randint(5, 60)))
+        for _ in _chunk_range(spec.posts, chunk)
+    ]
+
+
+def post_ages(spec: SyntheticSpec, chunk: int) -> list:
+    """
+    Возраст постов куска в секундах от момента создания набора. У поста с индексом i - доля (i + случайное
+    от 0 до 1) / posts периода days, поэтому посты с большим индексом (и id) новее
+    """
+    rng = spec.rng('post-dates', chunk)
+    period = spec.days * 24 * 3600
+    return [period * (1 - (index + rng.random()) / spec.posts) for index in _chunk_range(spec.posts, chunk)]
+
+
+def friendship_pairs(spec: SyntheticSpec, chunk: int) -> list:
+    """[(меньший индекс, больший индекс), ...] без повторов внутри куска; между кусками повторы возможны"""
+    rng = spec.rng('friendships', chunk)
+    pairs = set()
+    for _ in _chunk_range(spec.friendships, chunk):
+        first, second = spec.sample_user(rng), spec.sample_user(rng)
+        if first != second:
+            pairs.add((min(first, second), max(first, second)))
+    return sorted(pairs)
+
+
+def request_pairs(spec: SyntheticSpec, chunk: int) -> list:
+    """[(отправитель, получатель), ...]: отправители по весам, получатели равномерно"""
+    rng = spec.rng('requests', chunk)
+    pairs = set()
+    for _ in _chunk_range(spec.friend_requests, chunk):
+        sender, receiver = spec.sample_user(rng), rng.randrange(spec.users)
+        if sender != receiver:
+            pairs.add((sender, receiver))
+    return sorted(pairs)
+
+
+def friendship_rows(spec: SyntheticSpec, chunk: int) -> list:
+    """Записи UserFriend куска: дружба хранится в обе стороны"""
+    return [row for first, second in friendship_pairs(spec, chunk) for row in ((first, second), (second, first))]
+
+
+@contextmanager
+def _mapper(workers: int):
+    """map по кускам: в этом процессе или в пуле из workers процессов, порядок результатов сохраняется"""
+    if workers <= 1:
+        yield map
+        return
+
+    from django.db import connections
+
+    # Процессы только генерируют строки, открытые соединения с БД им не нужны
+    connections.close_all()
+    with multiprocessing.Pool(workers) as pool:
+        yield partial(pool.imap, chunksize=1)
+
+
+@contextmanager
+def _fast_sqlite_writes():
+    """
+    SQLite без fsync при каждой фиксации транзакции. При сбое ОС теряются только последние куски синтетических
+    данных, их проще создать заново
+    """
+    from django.db import connection
+
+    # Внутри транзакции (например, в тестах) SQLite не дает менять synchronous
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        yield
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous')
+        previous = cursor.fetchone()[0]
+        cursor.execute('PRAGMA synchronous = OFF')
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA synchronous = {int(previous)}')
+
+
+def create_dataset(spec: SyntheticSpec, workers: int = 1, batch_size: int = 5000, password: str = 'password',
+                   log=None) -> list:
+    """
+    Создает пользователей, посты, дружбы и заявки набора spec через bulk_create, каждый кусок - в своей
+    транзакции, проставляет даты постов (post_ages) и пересчитывает счетчики созданных пользователей.
+    Пароль у всех один, хэш считается один раз.
+    Пока workers процессов генерируют следующие куски, этот процесс вставляет готовые.
+    Пользователей с префиксом spec.prefix в БД быть не должно. Возвращает id пользователей по индексам.
+    Ленты (api.feed) не заполняются: для этого есть manage.py backfill_feeds
+    """
+    from datetime import timedelta
+
+    from django.contrib.auth.hashers import make_password
+    from django.db import connection, transaction
+    from django.utils import timezone
+
+    from api.models import Post
+    from users.counters import repair_counters
+    from users.models import User, UserFriend
+
+    log = log or (lambda message: None)
+    if User.objects.filter(username__startswith=spec.prefix).exists():
+        raise ValueError(f'В базе уже есть пользователи с префиксом {spec.prefix}')
+
+    password_hash = make_password(password)
+
+    def insert(mapper, model, kind, generate, total, build, **kwargs):
+        started = time.perf_counter()
+        created = 0
+        for rows in mapper(partial(generate, spec), range(chunk_count(total))):
+            with transaction.atomic():
+                model.objects.bulk_create((build(row) for row in rows), batch_size=batch_size, **kwargs)
+            created += len(rows)
+        log(f'{kind}: {created} за {time.perf_counter() - started:.1f} с')
+
+    with _mapper(workers) as mapper, _fast_sqlite_writes():
+        insert(mapper, User, 'пользователи', user_rows, spec.users, lambda row: User(
+            username=f'{spec.prefix}{row[0]}', password=password_hash, first_name=row[1], last_name=row[2],
+            description=row[3],
+        ))
+        # Куски вставляются по порядку индексов, поэтому id растут вместе с индексами
+        user_ids = list(
+            User.objects.filter(username__startswith=spec.prefix).order_by('id').values_list('id', flat=True)
+        )
+
+        last_post_id = Post.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        insert(mapper, Post, 'посты', post_rows, spec.posts, lambda row: Post(
+            author_id=user_ids[row[0]], title=row[1], description=row[2],
+        ))
+
+        # created_date - auto_now_add, bulk_create ставит всем постам текущее время: даты обновляются после вставки.
+        # Один UPDATE через executemany: bulk_update строит CASE по id и на сотнях тысяч строк в разы медленнее
+        started = time.perf_counter()
+        now = timezone.now()
+        post_ids = list(
+            Post.objects.filter(id__gt=last_post_id, author_id__gte=user_ids[0]).order_by('id')
+            .values_list('id', flat=True)
+        )
+        quote, adapt = connection.ops.quote_name, connection.ops.adapt_datetimefield_value
+        sql = 'UPDATE %s SET %s = %%s WHERE %s = %%s' % (
+            quote(Post._meta.db_table), quote(Post._meta.get_field('created_date').column), quote(Post._meta.pk.column),
+        )
+        for chunk in range(chunk_count(spec.posts)):
+            ids = post_ids[chunk * CHUNK_SIZE:(chunk + 1) * CHUNK_SIZE]
+            ages = post_ages(spec, chunk)
+            rows = [(adapt(now - timedelta(seconds=age)), post_id) for post_id, age in zip(ids, ages)]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+        log(f'даты постов: {len(post_ids)} за {time.perf_counter() - started:.1f} с')
+
+        # Повторы пар из разных кусков отбрасывает уникальный индекс (user, friend)
+        insert(mapper, UserFriend, 'записи дружбы', friendship_rows, spec.friendships, lambda row: UserFriend(
+            user_id=user_ids[row[0]], friend_id=user_ids[row[1]], is_friend=True,
+        ), ignore_conflicts=True)
+        # Заявка между уже друзьями конфликтует с записью дружбы и тоже отбрасывается
+        insert(mapper, UserFriend, 'заявки в друзья', request_pairs, spec.friend_requests, lambda row: UserFriend(
+            user_id=user_ids[row[0]], friend_id=user_ids[row[1]], is_friend=False,
+        ), ignore_conflicts=True)
+
+        started = time.perf_counter()
+        repair_counters(User, UserFriend, Post, batch_size=1000, users=User.objects.filter(id__gte=user_ids[0]))
+        log(f'счетчики пересчитаны за {time.perf_counter() - started:.1f} с')
+    return user_ids
@@ -0,0 +1,77 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BACKGROUND_TASKS_WORKERS, thread_name_prefix='api-tasks'
+                )
+    return _executor
+
+
+def shutdown():
+    """Дожидается выполнения поставленных задач и останавливает пул (следующий submit создаст новый)"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def is_database_locked(error: Exception) -> bool:
+    return isinstance(error, OperationalError) and 'database is locked' in str(error)
+
+
+def _call(fn, args, kwargs):
+    """
+    SQLite допускает одного писателя: запись задачи во время транзакции запроса получает database is locked.
+    Такая задача повторяется с нарастающей паузой, поэтому задачи должны быть идемпотентными
+    """
+    retries = settings.BACKGROUND_TASKS_LOCK_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            fn(*args, **kwargs)
+            return
+        except Exception as e:
+            if not is_database_locked(e) or attempt == retries:
+                logger.exception('Фоновая задача %s завершилась с ошибкой', fn.__name__)
+                return
+        time.sleep(settings.BACKGROUND_TASKS_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def _run(fn, args, kwargs):
+    try:
+        _call(fn, args, kwargs)
+    finally:
+        # Соединение с БД у каждого потока свое, не оставляем его открытым в пуле
+        connection.close()
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Выполняет fn(*args, **kwargs) в пуле потоков после коммита текущей транзакции.
+    С BACKGROUND_TASKS_SYNC = True (только в тестах) задача выполняется сразу в текущем потоке.
+    Ошибка задачи пишется в лог и в обоих режимах не влияет на ответ: транзакция запроса уже зафиксирована.
+    """
+    def schedule():
+        if settings.BACKGROUND_TASKS_SYNC:
+            _call(fn, args, kwargs)
+        else:
+            get_executor().submit(_run, fn, args, kwargs)
+
+    transaction.on_commit(schedule)
@@ -1,3 +1,1004 @@
-from django.test import TestCase
+import io
+import json
+import os
+import pstats
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from api import async_views, image_variants, metrics, profiling, response_cache, streaming, synthetic, tasks, uploads
+from api.entity_cache import user_cache
+from api.management.commands import bench_endpoints
+from api.models import MediaBlob, Post, TimelineEntry
+from api.serializers import post_serializer, user_serializer
+from api.storage import get_content_storage
+from users import tokens
+from users.counters import repair_counters
+from users.models import User, UserFriend
+
+
+def streaming_body(response) -> bytes:
+    """Тело потокового ответа синхронного (api.views) или async def (api.async_views) view"""
+    if not response.is_async:
+        return b''.join(response.streaming_content)
+
+    async def read():
+        return b''.join([chunk async for chunk in response.streaming_content])
+    return async_to_sync(read)()
+
+
+class ImportTests(SimpleTestCase):
+    def test_models_do_not_import_pillow(self):
+        # Pillow нужен только загрузке и вариантам изображений, а не каждому процессу, импортирующему модели
+        code = ('import sys, django; django.setup(); '
+                'import api.models, api.serializers, api.image_variants, users.models; '
+                'sys.exit("PIL" in sys.modules or "api.images" in sys.modules)')
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True,
+                                env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'socialBackend.settings'})
+        self.assertEqual(result.returncode, 0, result.stderr.decode())
+
+
+# Фоновые задачи выполняются сразу после коммита, чтобы тесты видели их результат
+@override_settings(BACKGROUND_TASKS_SYNC=True)
+class ApiTestCase(TestCase):
+    def setUp(self):
+        # Кэши (ответы, сущности, версии) живут в процессе и переживают откат транзакции теста
+        for cache in caches.all():
+            cache.clear()
+
+    @staticmethod
+    def create_user(username, **fields) -> User:
+        return User.objects.create_user(username=username, password='password', **fields)
+
+    @staticmethod
+    def make_friends(user, friend):
+        UserFriend.objects.bulk_create([
+            UserFriend(user=user, friend=friend, is_friend=True),
+            UserFriend(user=friend, friend=user, is_friend=True),
+        ])
+
+
+class FriendsExpandCacheTests(ApiTestCase):
+    def test_expanded_friends_show_updated_profile(self):
+        user = self.create_user('user')
+        friend = self.create_user('friend', description='старое описание')
+        self.make_friends(user, friend)
+        url = f'/api/users/get/{user.id}/friends/?expand=users&fields=id,description'
+
+        first = self.client.get(url)
+        self.assertEqual(first.json()['users'][0]['description'], 'старое описание')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            friend.description = 'новое описание'
+            friend.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first.get('ETag', '"none"'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['users'][0]['description'], 'новое описание')
+
+
+class ResponseCacheTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(title='Заголовок', author=self.create_user('author'))
+        self.url = f'/api/posts/get/{self.post.id}/'
+
+    def test_conditional_get_returns_304(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header('ETag'))
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+    def test_update_changes_etag_and_body(self):
+        first = self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'Новый заголовок'
+            self.post.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()['title'], 'Новый заголовок')
+
+    def test_versions_expire(self):
+        # Изменение в другом процессе не видно в этом кэше, но версия живет не дольше API_RESPONSE_CACHE_TIMEOUT
+        versions = response_cache.get_versions(['post:1'])
+        later = time.time() + settings.API_RESPONSE_CACHE_TIMEOUT + 1
+        with mock.patch('time.time', return_value=later), mock.patch('time.time_ns', return_value=int(later * 1e9)):
+            self.assertNotEqual(response_cache.get_versions(['post:1']), versions)
+
+
+class PublicCacheTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('author')
+        self.url = f'/api/posts/get/{Post.objects.create(title="Пост", author=self.user).id}/'
+
+    def assertPublic(self, response):
+        cache_control = response['Cache-Control']
+        self.assertIn('public', cache_control)
+        self.assertIn(f'max-age={settings.API_PUBLIC_CACHE_MAX_AGE}', cache_control)
+        self.assertNotIn('private', cache_control)
+        self.assertNotIn('cookie', response.get('Vary', '').lower())
+        self.assertFalse(response.cookies)
+
+    def assertPrivate(self, response):
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+        vary = [value.strip().lower() for value in response['Vary'].split(',')]
+        self.assertIn('cookie', vary)
+        self.assertIn('authorization', vary)
+
+    def test_anonymous_get_is_public(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertPublic(response)
+
+        # Ответ 304 и 404 тоже можно хранить в общем кэше
+        self.assertPublic(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertPublic(self.client.get('/api/posts/get/0/'))
+
+    def test_session_request_is_private(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertPrivate(response)
+
+    def test_token_request_is_private(self):
+        access = tokens.issue_tokens(self.user)['access']
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, 200)
+        self.assertPrivate(response)
+
+    def test_csrf_endpoint_never_cached(self):
+        response = self.client.get('/api/users/auth/csrf/')
+        self.assertEqual(response.status_code, 200)
+        for directive in ('no-cache', 'no-store', 'private'):
+            self.assertIn(directive, response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+
+class EntityCacheTests(ApiTestCase):
+    @override_settings(ENTITY_CACHE_ALIAS=None)
+    def test_without_shared_cache(self):
+        # Без общего кэша остается только LRU процесса, в кэш 'default' ничего не пишется
+        user = self.create_user('user')
+        self.assertEqual(user_cache.get(user.id), user)
+        self.assertIsNone(caches['default'].get(user_cache._key(user.id)))
+        self.assertIsNone(user_cache.stats()['shared'])
+
+        user_cache.invalidate(user.id)
+        self.assertEqual(user_cache.get(user.id), user)
+
+
+def image_bytes(size=(64, 64), image_format='PNG') -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 50).convert('RGB').save(buffer, image_format)
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='test-media-'))
+class MediaTestCase(ApiTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.client.force_login(self.user)
+
+    def create_post(self, content: bytes, name='image.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/posts/create/', {
+                'title': 'Пост', 'image': SimpleUploadedFile(name, content),
+            })
+
+
+class UploadTests(MediaTestCase):
+    def test_valid_image(self):
+        response = self.create_post(image_bytes())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Post.objects.get(id=response.json()['post_id']).image)
+
+    @override_settings(UPLOAD_MAX_SIZES={'create_post': 1024})
+    def test_too_large(self):
+        response = self.create_post(image_bytes((256, 256)))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Post.objects.exists())
+
+    def test_not_an_image(self):
+        response = self.create_post(b'just some text, not an image' * 100, name='image.txt')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Post.objects.exists())
+
+    def test_not_an_image_rejected_by_signature(self):
+        # Без сигнатуры разрешенного формата остальные данные не ждем
+        self.assertIsNone(uploads.inspect_image_header(b'GIF8'))
+        with self.assertRaises(uploads.UploadError):
+            uploads.inspect_image_header(b'just some text, not an image')
+
+    def test_unsupported_format(self):
+        response = self.create_post(image_bytes(image_format='BMP'), name='image.bmp')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(UPLOAD_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        response = self.create_post(image_bytes())
+        self.assertEqual(response.status_code, 400)
+
+    def test_truncated_image(self):
+        # Заголовок PNG целый, тело обрезано: отклоняется до создания поста
+        content = image_bytes((256, 256))
+        response = self.create_post(content[:len(content) // 2])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Post.objects.exists())
+
+
+class MediaDedupTests(MediaTestCase):
+    def post_image(self, response) -> str:
+        return Post.objects.get(id=response.json()['post_id']).image.name
+
+    def test_same_content_stored_once(self):
+        content = image_bytes()
+        first = self.post_image(self.create_post(content, name='first.png'))
+        second = self.post_image(self.create_post(content, name='second.png'))
+
+        self.assertEqual(first, second)
+        self.assertEqual(MediaBlob.objects.get(name=first).ref_count, 2)
+
+    def test_extension_from_content(self):
+        # Расширение не зависит от имени файла у клиента
+        content = image_bytes(image_format='JPEG')
+        first = self.post_image(self.create_post(content, name='photo.jpeg'))
+        second = self.post_image(self.create_post(content, name='PHOTO.JPG'))
+        third = self.post_image(self.create_post(content, name='photo.png'))
+
+        self.assertEqual({first, second, third}, {first})
+        self.assertTrue(first.endswith('.jpg'))
+        self.assertEqual(MediaBlob.objects.get(name=first).ref_count, 3)
+
+    def test_delete_and_replace_release_references(self):
+        first = self.post_image(self.create_post(image_bytes()))
+        post = Post.objects.get(image=first)
+        self.create_post(image_bytes())
+
+        post.delete()
+        self.assertEqual(MediaBlob.objects.get(name=first).ref_count, 0)
+
+        # Замена файла: новая ссылка появляется, старая освобождается
+        other = Post.objects.get()
+        old_name = other.image.name
+        other.image = first
+        other.save()
+        self.assertEqual(MediaBlob.objects.get(name=first).ref_count, 1)
+        self.assertEqual(MediaBlob.objects.get(name=old_name).ref_count, 0)
+
+    def test_gc_removes_unused_files(self):
+        name = self.post_image(self.create_post(image_bytes()))
+        storage = get_content_storage()
+        self.assertTrue(storage.exists(name))
+        Post.objects.get(image=name).delete()
+
+        call_command('gc_media', grace=0, stdout=io.StringIO())
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(storage.exists(name))
+
+
+class ImageVariantsTests(MediaTestCase):
+    def test_variants_created(self):
+        post_id = self.create_post(image_bytes()).json()['post_id']
+        self.assertTrue(Post.objects.get(id=post_id).image_variants_ready)
+
+    def test_broken_image_keeps_original(self):
+        # Файл в хранилище мог появиться в обход проверки загрузки (админка, старые данные)
+        post = Post.objects.create(title='Пост', author=self.user)
+        post.image.save('broken.png', ContentFile(image_bytes()[:100]))
+
+        with self.assertLogs('api.image_variants', 'WARNING'):
+            self.assertFalse(image_variants.process_post_image(post.id))
+        post.refresh_from_db()
+        self.assertFalse(post.image_variants_ready)
+        self.assertTrue(post.image)
+
+
+class BatchTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        self.post_ids = [Post.objects.create(title=f'Пост {i}', author=author).id for i in range(3)]
+
+    def batch(self, ids: str, url='/api/posts/get/batch/'):
+        return self.client.get(url, {'ids': ids})
+
+    def test_order_of_ids(self):
+        ids = list(reversed(self.post_ids))
+        data = self.batch(','.join(map(str, ids))).json()
+        self.assertEqual([post['id'] for post in data['posts']], ids)
+        self.assertEqual(data['missing'], [])
+
+    def test_missing_ids(self):
+        missing = max(self.post_ids) + 1
+        data = self.batch(f'{missing},{self.post_ids[0]}').json()
+        self.assertEqual([post['id'] for post in data['posts']], [self.post_ids[0]])
+        self.assertEqual(data['missing'], [missing])
+
+    def test_duplicates_returned_once(self):
+        pk = self.post_ids[0]
+        response = self.client.get('/api/posts/get/batch/', {'ids': [f'{pk},{pk}', str(pk)]})
+        self.assertEqual([post['id'] for post in response.json()['posts']], [pk])
+
+    def test_users_batch(self):
+        user = User.objects.get(username='author')
+        data = self.batch(str(user.id), url='/api/users/get/batch/').json()
+        self.assertEqual([item['id'] for item in data['users']], [user.id])
+
+    @override_settings(API_BATCH_MAX_IDS=2)
+    def test_limit(self):
+        self.assertEqual(self.batch(','.join(map(str, self.post_ids[:2]))).status_code, 200)
+        response = self.batch(','.join(map(str, self.post_ids)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+    def test_malformed_ids(self):
+        for ids in ('', ',', 'abc', '1.5', '-1', '0', '+1', '1_0', str(2 ** 63), '99999999999999999999999'):
+            response = self.batch(ids)
+            self.assertEqual(response.status_code, 400, ids)
+            self.assertIn('error', response.json())
+
+    def test_largest_id(self):
+        self.assertEqual(self.batch(str(2 ** 63 - 1)).json()['missing'], [2 ** 63 - 1])
+
+
+class StreamingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        for i in range(5):
+            friend = self.create_user(f'friend{i}', first_name=f'Имя "{i}"', description='строка\nс переводом')
+            self.make_friends(self.user, friend)
+        self.url = f'/api/users/get/{self.user.id}/friends/'
+
+    def collect(self, chunks) -> str:
+        return ''.join(chunks)
+
+    @override_settings(API_STREAM_CHUNK_SIZE=2)
+    def test_chunks_are_valid_json(self):
+        extra = {'total': 5, 'note': 'конец'}
+        for items in ([], [1], list(range(5)), [{'a': 'б"в'}, None, 1.5]):
+            text = self.collect(streaming.iter_json_collection('items', iter(items), extra))
+            self.assertEqual(json.loads(text), {'items': items, **extra})
+
+            async def aitems():
+                for item in items:
+                    yield item
+
+            async def acollect():
+                chunks = streaming.aiter_json_collection('items', aitems(), extra)
+                return self.collect([chunk async for chunk in chunks])
+            self.assertEqual(async_to_sync(acollect)(), text)
+
+    @override_settings(API_STREAM_CHUNK_SIZE=2)
+    def test_first_chunk_before_items(self):
+        chunks = streaming.iter_json_collection('items', iter(range(5)))
+        self.assertEqual(next(chunks), '{"items": [')
+        self.assertEqual(list(chunks), ['0, 1', ', 2, 3', ', 4]}'])
+
+    @override_settings(API_STREAM_CHUNK_SIZE=2)
+    def test_stream_matches_buffered(self):
+        for query in ({}, {'expand': 'users'}, {'expand': 'users', 'fields': 'id,firstName,description'}):
+            buffered = self.client.get(self.url, query)
+            streamed = self.client.get(self.url, {**query, 'stream': '1'})
+            self.assertTrue(streamed.streaming)
+            self.assertEqual(streamed['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(streaming_body(streamed)), buffered.json(), query)
+
+
+class SerializerParityTests(MediaTestCase):
+    """RowSerializer по строкам .values_list() и Model.json дают тот же JSON, что и прежний ручной .json"""
+
+    @staticmethod
+    def legacy_post_json(post) -> dict:
+        return {
+            'id': post.id,
+            'title': post.title,
+            'description': post.description,
+            'created_date': post.created_date.timestamp(),
+            'image': post.image.url if post.image else None,
+            'author': post.author.id,
+        }
+
+    @staticmethod
+    def legacy_user_json(user) -> dict:
+        return {
+            'id': user.id,
+            'username': user.username,
+            'firstName': user.first_name,
+            'lastName': user.last_name,
+            'description': user.description,
+            'avatar': user.avatar.url if user.avatar else None,
+        }
+
+    def assertParity(self, serializer, queryset, legacy_json, new_keys):
+        rows = {row.id: serializer.serialize(row) for row in serializer.values(queryset)}
+        self.assertEqual(set(rows), {instance.id for instance in queryset})
+        for instance in queryset:
+            self.assertEqual(rows[instance.id], instance.json)
+            self.assertEqual({key: value for key, value in rows[instance.id].items() if key not in new_keys},
+                             legacy_json(instance))
+
+    def test_posts(self):
+        self.create_post(image_bytes())
+        Post.objects.create(title='Без картинки', description='', author=self.user)
+        self.assertParity(post_serializer, Post.objects.all(), self.legacy_post_json, {'image_variants'})
+
+    def test_users(self):
+        self.user.avatar = ContentFile(image_bytes(), name='avatar.png')
+        self.user.first_name, self.user.last_name = 'Имя', 'Фамилия'
+        self.user.save()
+        self.create_user('plain')
+        self.assertParity(user_serializer, User.objects.all(), self.legacy_user_json, {'avatar_variants'})
+
+    def test_subset_keeps_values(self):
+        row = next(iter(user_serializer.subset(['avatar', 'id']).values(User.objects.filter(id=self.user.id))))
+        subset = user_serializer.subset(['avatar', 'id']).serialize(row)
+        self.assertEqual(subset, {'id': self.user.id, 'avatar': self.user.json['avatar']})
+
+
+class PaginationTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        posts = [Post.objects.create(title=f'Пост {i}', author=author) for i in range(5)]
+        # Одинаковая дата у нескольких постов: порядок и граница страницы определяются id
+        Post.objects.filter(id__in=[post.id for post in posts[1:4]]).update(created_date=posts[1].created_date)
+        self.expected = [post.id for post in sorted(
+            Post.objects.all(), key=lambda post: (post.created_date, post.id), reverse=True
+        )]
+
+    def collect(self, url: str) -> list:
+        ids, cursor = [], None
+        while True:
+            response = self.client.get(url, {'limit': 2, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data['posts']), 2)
+            ids += [post['id'] for post in data['posts']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_collection_once(self):
+        self.assertEqual(self.collect('/api/posts/get/all/'), self.expected)
+
+    def test_user_posts_pages(self):
+        author = User.objects.get(username='author')
+        self.assertEqual(self.collect(f'/api/posts/get/user/{author.id}/'), self.expected)
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-a-cursor', 'W10', '!!!'):
+            response = self.client.get('/api/posts/get/all/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertIn('error', response.json())
+
+    def test_invalid_limit(self):
+        for limit in ('0', '-1', 'abc'):
+            self.assertEqual(self.client.get('/api/posts/get/all/', {'limit': limit}).status_code, 400, limit)
+
+    def test_legacy_returns_everything(self):
+        response = self.client.get('/api/posts/get/all/', {'legacy': '1'})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(streaming_body(response))
+        self.assertEqual(sorted(post['id'] for post in data['posts']), sorted(self.expected))
+
+
+@override_settings(BACKGROUND_TASKS_RETRY_DELAY=0)
+class TasksTests(SimpleTestCase):
+    def test_locked_database_is_retried(self):
+        task = mock.Mock(__name__='task', side_effect=[OperationalError('database is locked'), None])
+        tasks._call(task, (1,), {})
+        self.assertEqual(task.call_count, 2)
+
+    @override_settings(BACKGROUND_TASKS_LOCK_RETRIES=2)
+    def test_retries_are_limited(self):
+        task = mock.Mock(__name__='task', side_effect=OperationalError('database is locked'))
+        with self.assertLogs('api.tasks', 'ERROR'):
+            tasks._call(task, (), {})
+        self.assertEqual(task.call_count, 3)
+
+    def test_other_errors_are_not_retried(self):
+        task = mock.Mock(__name__='task', side_effect=OperationalError('no such table: api_post'))
+        with self.assertLogs('api.tasks', 'ERROR'):
+            tasks._call(task, (), {})
+        self.assertEqual(task.call_count, 1)
+
+
+class FeedTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader = self.create_user('reader')
+        self.author = self.create_user('author')
+        self.make_friends(self.reader, self.author)
+        User.objects.filter(id__in=[self.reader.id, self.author.id]).update(friend_count=1)
+
+    def publish(self, title: str, run_tasks=True) -> int:
+        self.client.force_login(self.author)
+        with self.captureOnCommitCallbacks(execute=run_tasks):
+            response = self.client.post('/api/posts/create/', {'title': title})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['post_id']
+
+    def feed_ids(self) -> list:
+        self.client.force_login(self.reader)
+        response = self.client.get('/api/posts/get/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [post['id'] for post in response.json()['posts']]
+
+    def timeline_ids(self) -> set:
+        return set(TimelineEntry.objects.filter(owner=self.reader).values_list('post_id', flat=True))
+
+    def test_fan_out(self):
+        post_id = self.publish('Пост')
+        self.assertEqual(self.timeline_ids(), {post_id})
+        self.assertTrue(Post.objects.get(id=post_id).fanned_out)
+        self.assertEqual(self.feed_ids(), [post_id])
+
+    def test_post_visible_before_fan_out(self):
+        post_id = self.publish('Пост', run_tasks=False)
+        self.assertEqual(self.timeline_ids(), set())
+        self.assertEqual(self.feed_ids(), [post_id])
+
+    @override_settings(FEED_FANOUT_MAX_FRIENDS=0)
+    def test_high_degree_author_read_on_request(self):
+        post_id = self.publish('Пост')
+        self.assertEqual(self.timeline_ids(), set())
+        self.assertFalse(Post.objects.get(id=post_id).fanned_out)
+        self.assertEqual(self.feed_ids(), [post_id])
+
+    def test_author_becomes_high_degree(self):
+        fanned_out = self.publish('До порога')
+        with override_settings(FEED_FANOUT_MAX_FRIENDS=0):
+            read_on_request = self.publish('После порога')
+            self.assertEqual(self.feed_ids(), [read_on_request, fanned_out])
+        self.assertEqual(self.timeline_ids(), {fanned_out})
+
+    def test_author_drops_below_threshold(self):
+        with override_settings(FEED_FANOUT_MAX_FRIENDS=0):
+            read_on_request = self.publish('Выше порога')
+        fanned_out = self.publish('Ниже порога')
+        self.assertEqual(self.feed_ids(), [fanned_out, read_on_request])
+        self.assertEqual(self.timeline_ids(), {fanned_out})
+
+    def test_new_friend_gets_backfill(self):
+        post_id = self.publish('Пост')
+        newcomer = self.create_user('newcomer')
+        self.client.force_login(newcomer)
+        self.client.post('/api/users/make-friend/', {'user_id': self.author.id}, content_type='application/json')
+        self.client.force_login(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/accept-friend/', {'user_id': newcomer.id},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(TimelineEntry.objects.filter(owner=newcomer, post_id=post_id).exists())
+
+    def test_unfriend_prunes_feed(self):
+        self.publish('Разложенный')
+        with override_settings(FEED_FANOUT_MAX_FRIENDS=0):
+            self.publish('Читается при запросе')
+
+        self.client.force_login(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/reject-friend/', {'user_id': self.author.id},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.timeline_ids(), set())
+        self.assertEqual(self.feed_ids(), [])
+
+
+@override_settings(MEDIA_SERVE_MODE='direct')
+class MediaServeTests(MediaTestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.write('files/data.bin', self.content)
+
+    @staticmethod
+    def write(name: str, content: bytes):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+
+    def get(self, name='files/data.bin', **headers):
+        return self.client.get(f'{settings.MEDIA_URL}{name}', **headers)
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range(self):
+        response = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+    def test_suffix_and_open_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+        response = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1023/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[1000:])
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=5000-', 'bytes=20-10', 'bytes=-0'):
+            response = self.get(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_empty_file_range(self):
+        self.write('files/empty.bin', b'')
+        for header in ('bytes=-5', 'bytes=0-'):
+            response = self.get('files/empty.bin', HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response['Content-Range'], 'bytes */0')
+
+    def test_multiple_ranges_return_full_file(self):
+        response = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_requests(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        # If-Range с другой версией - диапазон игнорируется
+        response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_outside_media_root(self):
+        # safe_join отклоняет выход из MEDIA_ROOT как SuspiciousFileOperation
+        self.assertEqual(self.get('../settings.py').status_code, 400)
+        self.assertEqual(self.get('files/missing.bin').status_code, 404)
+
+
+class RequestTimingTests(ApiTestCase):
+    # Формат, который разбирает bench_endpoints (QUERIES_RE)
+    SERVER_TIMING_RE = re.compile(
+        r'total;dur=\d+\.\d, view;dur=\d+\.\d, db;dur=\d+\.\d;desc="(\d+) queries", serialize;dur=\d+\.\d'
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/posts/get/{Post.objects.create(title="Пост", author=self.create_user("author")).id}/'
+
+    @override_settings(API_TIMING_SAMPLE_RATE=1.0)
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        header = response['Server-Timing']
+        self.assertRegex(header, f'^{self.SERVER_TIMING_RE.pattern}$')
+        self.assertEqual(int(self.SERVER_TIMING_RE.match(header).group(1)), len(queries))
+
+        match = bench_endpoints.QUERIES_RE.search(header)
+        self.assertEqual(int(match.group(2)), len(queries))
+
+    @override_settings(API_TIMING_SAMPLE_RATE=0.5)
+    def test_sampling(self):
+        with mock.patch('api.middleware.random.random', return_value=0.7):
+            header = self.client.get(self.url)['Server-Timing']
+        self.assertRegex(header, r'^total;dur=\d+\.\d, view;dur=\d+\.\d$')
+
+        with mock.patch('api.middleware.random.random', return_value=0.3):
+            self.assertRegex(self.client.get(self.url)['Server-Timing'], self.SERVER_TIMING_RE)
+
+    @override_settings(API_TIMING_HEADER=False)
+    def test_header_disabled(self):
+        self.assertFalse(self.client.get(self.url).has_header('Server-Timing'))
+
+    @override_settings(API_TIMING_SLOW_MS=0)
+    def test_slow_request_logged(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertIn('Медленный запрос GET', logs.output[0])
+        self.assertIn('[get_post]', logs.output[0])
+        self.assertIn('самый долгий SQL', logs.output[0])
+
+    @override_settings(API_TIMING_SLOW_MS=float('inf'), API_TIMING_QUERY_BUDGET=0)
+    def test_query_budget_logged(self):
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            self.client.get(self.url)
+        self.assertIn('SQL: ', logs.output[0])
+
+    @override_settings(API_TIMING_SLOW_MS=float('inf'))
+    def test_fast_request_not_logged(self):
+        with mock.patch('api.middleware.logger') as logger:
+            self.client.get(self.url)
+        logger.warning.assert_not_called()
+
+
+class ProfilingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp(prefix='test-profiles-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.directory = Path(directory)
+        context = override_settings(API_PROFILE_DIR=directory)
+        context.enable()
+        self.addCleanup(context.disable)
+        self.url = f'/api/posts/get/{Post.objects.create(title="Пост", author=self.create_user("author")).id}/'
+
+    def profile(self, mode=profiling.CPROFILE, token=None):
+        return self.client.get(self.url, HTTP_X_PROFILE=token or profiling.make_token(), HTTP_X_PROFILE_MODE=mode)
+
+    def test_cprofile_capture(self):
+        name = self.profile()['X-Profile-Capture']
+        self.assertEqual(profiling.parse_capture_name(name)[::2], ('get_post', profiling.CPROFILE))
+        stats = pstats.Stats(str(self.directory / name))
+        self.assertTrue(stats.total_calls)
+
+    def test_sample_capture(self):
+        name = self.profile(profiling.SAMPLE)['X-Profile-Capture']
+        self.assertEqual(profiling.parse_capture_name(name)[::2], ('get_post', profiling.SAMPLE))
+        with open(self.directory / name, encoding='utf-8') as file:
+            for line in file:
+                self.assertRegex(line, r'^\S.* \d+\n$')
+
+    def test_invalid_token_or_mode(self):
+        self.assertFalse(self.profile(token='bad').has_header('X-Profile-Capture'))
+        self.assertFalse(self.profile(mode='unknown').has_header('X-Profile-Capture'))
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_query_parameter_for_staff_only(self):
+        user = User.objects.get(username='author')
+        self.client.force_login(user)
+        self.assertFalse(self.client.get(self.url, {'profile': '1'}).has_header('X-Profile-Capture'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.is_staff = True
+            user.save()
+        self.assertTrue(self.client.get(self.url, {'profile': '1'}).has_header('X-Profile-Capture'))
+
+    @override_settings(API_PROFILE_RATE_LIMIT=1)
+    def test_rate_limit(self):
+        self.assertTrue(self.profile().has_header('X-Profile-Capture'))
+        self.assertFalse(self.profile().has_header('X-Profile-Capture'))
+
+    def test_profile_captures_command(self):
+        self.profile()
+        self.profile(profiling.SAMPLE)
+        output = io.StringIO()
+        call_command('profile_captures', stdout=output)
+        self.assertRegex(output.getvalue(), r'get_post\s+1\s+1\s')
+
+        output = io.StringIO()
+        call_command('profile_captures', view='get_post', stdout=output)
+        self.assertIn('cProfile, снимков: 1', output.getvalue())
+        self.assertIn('Сэмплер, снимков: 1', output.getvalue())
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='test-metrics-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.directory = Path(directory)
+        # Свой каталог, свои метрики и файл значений: метрики middleware других тестов не смешиваются
+        for context in (override_settings(API_METRICS_DIR=directory), mock.patch.dict(metrics._registry, clear=True),
+                        mock.patch.object(metrics, '_values', None), mock.patch.object(metrics, '_enabled', True)):
+            context.__enter__()
+            self.addCleanup(context.__exit__, None, None, None)
+
+    def test_values_survive_reopen(self):
+        values = metrics.MmapValues(self.directory / '1.db')
+        values.add('a', 1)
+        values.add('b', 0.5)
+        values.add('a', 2)
+
+        reopened = metrics.MmapValues(self.directory / '1.db')
+        reopened.add('a', 1)
+        entries = {key: value for key, value, _ in metrics.read_entries(reopened._mmap, reopened._used)}
+        self.assertEqual(entries, {'a': 4.0, 'b': 0.5})
+
+    def test_file_grows(self):
+        values = metrics.MmapValues(self.directory / '1.db')
+        keys = [f'key-{i}' * 20 for i in range(1000)]
+        for key in keys:
+            values.add(key, 1)
+        self.assertGreater(len(values._mmap), metrics.INITIAL_SIZE)
+        entries = {key: value for key, value, _ in metrics.read_entries(values._mmap, values._used)}
+        self.assertEqual(entries, dict.fromkeys(keys, 1.0))
+
+    def test_collect_sums_processes(self):
+        metrics.Counter('test_requests', 'Запросы', ('view',))
+        key = metrics._key('test_requests_total', [['view', 'a']])
+        for pid in (1, 2):
+            metrics.MmapValues(self.directory / f'{pid}.db').add(key, pid)
+        self.assertEqual(metrics.collect(), {('test_requests_total', (('view', 'a'),)): 3.0})
+        self.assertIn('test_requests_total{view="a"} 3.0', metrics.render().splitlines())
+
+    def test_render_prometheus_text(self):
+        counter = metrics.Counter('test_requests', 'Запросы', ('view', 'status'))
+        histogram = metrics.Histogram('test_duration_seconds', 'Время', ('view',), (0.1, 1))
+        counter.inc(view='a"b', status=200)
+        counter.inc(2, view='a"b', status=200)
+        for value in (0.05, 0.5, 0.7, 5):
+            histogram.observe(value, view='a')
+
+        self.assertEqual(metrics.render().splitlines(), [
+            '# HELP test_requests_total Запросы',
+            '# TYPE test_requests_total counter',
+            'test_requests_total{view="a\\"b",status="200"} 3.0',
+            '# HELP test_duration_seconds Время',
+            '# TYPE test_duration_seconds histogram',
+            'test_duration_seconds_bucket{view="a",le="0.1"} 1.0',
+            'test_duration_seconds_bucket{view="a",le="1.0"} 3.0',
+            'test_duration_seconds_bucket{view="a",le="+Inf"} 4.0',
+            'test_duration_seconds_sum{view="a"} 6.25',
+            'test_duration_seconds_count{view="a"} 4.0',
+        ])
+
+    def test_disabled_writes_nothing(self):
+        counter = metrics.Counter('test_requests', 'Запросы')
+        with mock.patch.object(metrics, '_enabled', False):
+            counter.inc()
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_clear_metrics(self):
+        metrics.Counter('test_requests', 'Запросы').inc()
+        self.assertTrue(metrics.collect())
+        call_command('clear_metrics', stdout=io.StringIO())
+        self.assertEqual(metrics.collect(), {})
+
+    @override_settings(API_METRICS_TOKEN=None, DEBUG=False)
+    def test_endpoint_requires_token_outside_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(API_METRICS_TOKEN='secret')
+    def test_endpoint_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer \xe9').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+
+class SyntheticSpecTests(SimpleTestCase):
+    def test_validation(self):
+        for kwargs in ({'users': 1}, {'exponent': 2}, {'exponent': 1.5}, {'days': 0}):
+            with self.assertRaises(ValueError, msg=kwargs):
+                synthetic.SyntheticSpec(**{'users': 10, 'posts': 10, **kwargs})
+        with self.assertRaises(CommandError):
+            call_command('seed_social', users=1, posts=1, stdout=io.StringIO())
+
+    def test_same_seed_same_rows(self):
+        generators = (synthetic.user_rows, synthetic.post_rows, synthetic.post_ages, synthetic.friendship_pairs,
+                      synthetic.request_pairs)
+        first, same, other = (synthetic.SyntheticSpec(30_000, 30_000, seed=seed) for seed in (1, 1, 2))
+        for generate in generators:
+            # Кусок не зависит от того, какие куски сгенерированы до него
+            self.assertEqual(generate(first, 2), generate(same, 2), generate.__name__)
+            self.assertEqual(generate(first, 0), generate(same, 0), generate.__name__)
+            self.assertNotEqual(generate(first, 0), generate(other, 0), generate.__name__)
+
+    def test_degree_distribution(self):
+        spec = synthetic.SyntheticSpec(5000, 0, friends=20, exponent=2.5)
+        pairs = set()
+        for chunk in range(synthetic.chunk_count(spec.friendships)):
+            pairs.update(synthetic.friendship_pairs(spec, chunk))
+        degrees = sorted(Counter(user for pair in pairs for user in pair).values(), reverse=True)
+        degrees += [0] * (spec.users - len(degrees))
+
+        # Повторы пар и дружба с собой отбрасываются, поэтому среднее немного ниже заданного
+        mean = sum(degrees) / spec.users
+        self.assertTrue(15 < mean <= 20, mean)
+        # Тяжелый хвост: у нескольких пользователей друзей на порядки больше, чем у типичного
+        median = degrees[spec.users // 2]
+        self.assertGreater(degrees[0], 20 * median)
+        self.assertLess(median, mean)
+
+    def test_post_ages(self):
+        spec = synthetic.SyntheticSpec(10, 25_000, days=30)
+        ages = [age for chunk in range(synthetic.chunk_count(spec.posts)) for age in synthetic.post_ages(spec, chunk)]
+        self.assertEqual(len(ages), spec.posts)
+        self.assertTrue(all(0 <= age <= 30 * 24 * 3600 for age in ages))
+        # Чем больше индекс поста, тем он новее, а посты покрывают весь период
+        self.assertEqual(ages, sorted(ages, reverse=True))
+        self.assertGreater(ages[0] - ages[-1], 29 * 24 * 3600)
+
+
+class SyntheticDatasetTests(ApiTestCase):
+    def test_create_dataset(self):
+        spec = synthetic.SyntheticSpec(50, 300, friends=4, requests=1, days=10)
+        before = timezone.now()
+        user_ids = synthetic.create_dataset(spec, batch_size=100)
+
+        self.assertEqual(User.objects.filter(id__in=user_ids).count(), 50)
+        self.assertEqual(repair_counters(User, UserFriend, Post, dry_run=True), 0)
+        # Дружба хранится в обе стороны
+        friendships = set(UserFriend.objects.filter(is_friend=True).values_list('user_id', 'friend_id'))
+        self.assertEqual(friendships, {(friend, user) for user, friend in friendships})
+
+        dates = list(Post.objects.order_by('id').values_list('created_date', flat=True))
+        self.assertEqual(len(dates), 300)
+        self.assertEqual(dates, sorted(dates))
+        self.assertGreater(dates[-1] - dates[0], timedelta(days=9))
+        self.assertGreaterEqual(dates[0], before - timedelta(days=10))
+
+        with self.assertRaises(ValueError):
+            synthetic.create_dataset(spec)
+
+
+class OpenApiTests(SimpleTestCase):
+    def test_schema_file_up_to_date(self):
+        # Падает, если view изменились, а openapi.json не пересобран командой build_openapi
+        call_command('build_openapi', check=True, stdout=io.StringIO())
+
+    def test_check_detects_stale_schema(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'openapi.json')
+            with override_settings(OPENAPI_SCHEMA_FILE=path):
+                with self.assertRaises(CommandError):
+                    call_command('build_openapi', check=True, stdout=io.StringIO())
+
+                call_command('build_openapi', stdout=io.StringIO())
+                call_command('build_openapi', check=True, stdout=io.StringIO())
+
+                with open(path, 'ab') as file:
+                    file.write(b'\n')
+                with self.assertRaises(CommandError):
+                    call_command('build_openapi', check=True, stdout=io.StringIO())
+
+
+class AsyncAuthTests(ApiTestCase):
+    def session_request(self, user):
+        self.client.force_login(user)
+        request = RequestFactory().get('/')
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        SessionMiddleware(lambda request: None).process_request(request)
+        return request
+
+    def test_session_user(self):
+        user = self.create_user('user')
+        self.assertEqual(async_to_sync(async_views.aget_user)(self.session_request(user)), user)
+
+    def test_session_invalidated_by_password_change(self):
+        user = self.create_user('user')
+        request = self.session_request(user)
+        user.set_password('new-password')
+        user.save()
+        self.assertFalse(async_to_sync(async_views.aget_user)(request).is_authenticated)
+
+    def test_anonymous(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda request: None).process_request(request)
+        self.assertFalse(async_to_sync(async_views.aget_user)(request).is_authenticated)
@@ -0,0 +1,160 @@
+"""
+Проверка загрузок изображений на лету.
+
+ImageUploadHandler стоит первым в FILE_UPLOAD_HANDLERS и пропускает данные дальше стандартным обработчикам
+(в памяти до FILE_UPLOAD_MAX_MEMORY_SIZE, дальше - во временный файл на диске). Запрос отклоняется:
+- сразу, если Content-Length больше лимита эндпоинта (UPLOAD_MAX_SIZES);
+- как только переданный файл превысил лимит;
+- по первым байтам файла, если в них нет сигнатуры разрешенного формата;
+- по первым килобайтам файла, если заголовок изображения не разбирается
+  или размеры в пикселях больше UPLOAD_MAX_PIXELS (защита от decompression bomb до декодирования);
+- после получения файла целиком, если Image.verify() находит повреждение (например, обрезанный PNG).
+Ошибка сохраняется в request.upload_error, view отвечает ею вместо обработки данных.
+"""
+import io
+import warnings
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+from PIL import Image, UnidentifiedImageError
+
+# Столько байт Image.open читает для определения формата по сигнатуре
+SIGNATURE_BYTES = 16
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def get_upload_limit(request) -> int:
+    resolver_match = getattr(request, 'resolver_match', None)
+    url_name = resolver_match.url_name if resolver_match else None
+    return settings.UPLOAD_MAX_SIZES.get(url_name, settings.UPLOAD_DEFAULT_MAX_SIZE)
+
+
+def get_upload_error(request):
+    return getattr(request, 'upload_error', None)
+
+
+def has_image_signature(head: bytes) -> bool:
+    """Начало файла совпадает с сигнатурой одного из UPLOAD_ALLOWED_FORMATS"""
+    Image.init()
+    prefix = head[:SIGNATURE_BYTES]
+    return any(Image.OPEN[image_format][1](prefix) for image_format in settings.UPLOAD_ALLOWED_FORMATS)
+
+
+def inspect_image_header(head: bytes):
+    """
+    (format, width, height) по началу файла. Image.open читает только заголовок, пиксели не декодируются.
+    None - сигнатура разрешенного формата есть, но данных пока недостаточно для разбора заголовка.
+    UploadError - файл не изображение разрешенного формата, остальные данные ждать незачем.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(head)) as image:
+                return image.format, image.width, image.height
+    except (Image.DecompressionBombWarning, Image.DecompressionBombError):
+        raise UploadError('Слишком большое разрешение изображения')
+    except (UnidentifiedImageError, OSError, EOFError):
+        # Неизвестный формат и обрезанный заголовок Pillow не различает, различаем по сигнатуре
+        pass
+
+    if len(head) < SIGNATURE_BYTES or has_image_signature(head):
+        return None
+    raise UploadError('Файл не является изображением')
+
+
+def verify_image(file):
+    """Проверка файла целиком без декодирования пикселей: структура и контрольные суммы (Image.verify)"""
+    try:
+        with Image.open(file) as image:
+            image.verify()
+    except (UnidentifiedImageError, OSError, EOFError, SyntaxError):
+        raise UploadError('Файл изображения поврежден')
+    finally:
+        file.seek(0)
+
+
+class ImageUploadHandler(FileUploadHandler):
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.limit = get_upload_limit(request)
+        self.received = 0
+        self.head = bytearray()
+        self.header_checked = False
+
+    def reject(self, error: UploadError):
+        if self.request is not None and get_upload_error(self.request) is None:
+            self.request.upload_error = error
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Тело больше лимита (с запасом на обычные поля формы) - не читаем его вообще
+        if content_length and content_length > self.limit + settings.UPLOAD_FORM_FIELDS_ALLOWANCE:
+            self.reject(UploadError('Файл слишком большой', status=413))
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = bytearray()
+        self.header_checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.limit:
+            self.reject(UploadError('Файл слишком большой', status=413))
+            raise StopUpload(connection_reset=True)
+
+        if not self.header_checked:
+            self.head += raw_data[:settings.UPLOAD_HEADER_MAX_BYTES - len(self.head)]
+            self.check_header(complete=False)
+
+        return raw_data
+
+    def check_header(self, complete: bool):
+        try:
+            header = inspect_image_header(bytes(self.head))
+            if header is None:
+                if complete or len(self.head) >= settings.UPLOAD_HEADER_MAX_BYTES:
+                    raise UploadError('Файл не является изображением')
+                return
+
+            image_format, width, height = header
+            if image_format not in settings.UPLOAD_ALLOWED_FORMATS:
+                raise UploadError(f'Формат {image_format} не поддерживается')
+            if width * height > settings.UPLOAD_MAX_PIXELS:
+                raise UploadError('Слишком большое разрешение изображения')
+        except UploadError as e:
+            self.reject(e)
+            raise StopUpload(connection_reset=True)
+
+        self.header_checked = True
+
+    def file_complete(self, file_size):
+        if not self.header_checked:
+            self.check_header(complete=True)
+
+        # Файл собирают следующие обработчики: получаем его у них, чтобы проверить целиком. Возвращенный файл
+        # MultiPartParser кладет в request.FILES и остальные обработчики уже не вызывает
+        handlers = self.request.upload_handlers
+        for handler in handlers[handlers.index(self) + 1:]:
+            file = handler.file_complete(file_size)
+            if file:
+                break
+        else:
+            return None
+
+        try:
+            verify_image(file)
+        except UploadError as e:
+            file.close()
+            self.reject(e)
+            raise StopUpload()
+        return file
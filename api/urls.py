@@ -1,22 +1,34 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Эндпоинты чтения, у которых есть async def версия (api.async_views)
+read_views = async_views if settings.API_ASYNC_VIEWS else views
 
 urlpatterns = [
-    path('posts/get/all/', views.get_all_posts_view, name='get_posts_collection'),
-    path('posts/get/user/<int:user_id>/', views.get_user_posts_view, name='user_posts'),
+    path('posts/get/all/', read_views.get_all_posts_view, name='get_posts_collection'),
+    path('posts/get/user/<int:user_id>/', read_views.get_user_posts_view, name='user_posts'),
+    path('posts/get/batch/', views.get_posts_batch_view, name='posts-batch'),
+    path('posts/get/feed/', views.get_feed_view, name='feed'),
     path('posts/create/', views.create_post_view, name='create_post'),
-    path('posts/get/<int:post_id>/', views.get_post_view, name='get_post'),
+    path('posts/get/<int:post_id>/', read_views.get_post_view, name='get_post'),
 
-    path('users/get/me/', views.get_user_self_view, name='user'),
-    path('users/get/<int:user_id>/', views.get_user_view, name='user'),
+    path('users/get/me/', read_views.get_user_self_view, name='user'),
+    path('users/get/me/counters/', views.user_counters_view, name='user-counters'),
+    path('users/get/<int:user_id>/', read_views.get_user_view, name='user'),
+    path('users/get/batch/', views.get_users_batch_view, name='users-batch'),
+    path('users/auth/csrf/', views.csrf_token_view, name='csrf'),
     path('users/auth/login/', views.user_login_view, name='login'),
     path('users/auth/logout/', views.user_logout_view, name='logout'),
-    path('users/get/<int:user_id>/friends-count/', views.user_friend_count_view, name='friend_count'),
-    path('users/get/<int:user_id>/friends/', views.user_friends_view, name='friends'),
-    path('users/get/me/friends-requests/', views.user_friends_requests_view, name='friends-requests'),
-    path('users/get/me/friends-requests-send/', views.user_friends_requests_send_view, name='friends-requests-send'),
+    path('users/auth/refresh/', views.refresh_tokens_view, name='refresh-tokens'),
+    path('users/get/<int:user_id>/friends-count/', read_views.user_friend_count_view, name='friend_count'),
+    path('users/get/<int:user_id>/friends/', read_views.user_friends_view, name='friends'),
+    path('users/get/me/friends-requests/', read_views.user_friends_requests_view, name='friends-requests'),
+    path('users/get/me/friends-requests-send/', read_views.user_friends_requests_send_view, name='friends-requests-send'),
     path('users/make-friend/', views.make_friend_view, name='make-friend'),
     path('users/accept-friend/', views.accept_friend_view, name='accept-friend'),
     path('users/reject-friend/', views.reject_friend_view, name='reject-friend'),
     path('users/update-profile/', views.update_user_view, name='update-profile'),
+
+    path('cache/stats/', views.entity_cache_stats_view, name='entity-cache-stats'),
 ]
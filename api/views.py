@@ -1,15 +1,27 @@
 import json
 import typing
 
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.core.exceptions import ValidationError
-from django.http import JsonResponse, HttpRequest, RawPostDataException
+from django.db import transaction
+from django.http import HttpRequest, RawPostDataException
+from django.views.decorators.cache import never_cache
 from django.views.decorators.csrf import ensure_csrf_cookie as ensure_csrf_cookie_base
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.decorators import api_view
 
+from api import feed, image_variants, response_cache, tasks
+from api.entity_cache import post_cache, user_cache
+from api.instrumentation import JsonResponse
 from api.models import Post
+from api.pagination import CursorError, paginate, paginate_merged, is_legacy_request, collection_parameters
+from api.response_cache import cached_response, public_cache
+from api.serializers import RowSerializer, post_serializer, user_serializer
+from api.streaming import is_stream_request, iterate, stream_collection, stream_parameter
+from api.uploads import get_upload_error
+from users import tokens
 from users.models import User, UserFriend
 
 
@@ -31,6 +43,127 @@ def get_request_data(request: HttpRequest) -> dict:
     return data
 
 
+def posts_collection_response(request, posts):
+    # Строки из .values_list() без создания экземпляров Post и без запроса автора на каждый пост
+    posts = post_serializer.values(posts)
+
+    if is_legacy_request(request):
+        # Вся коллекция целиком - только потоком, чтобы память не росла с числом постов
+        return stream_collection('posts', post_serializer.rows(iterate(posts)))
+
+    try:
+        page, next_cursor = paginate(posts, request)
+    except CursorError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'posts': tuple(post_serializer.rows(page)),
+        'next_cursor': next_cursor,
+    })
+
+
+def is_expand_request(request) -> bool:
+    return request.GET.get('expand', None) == 'users'
+
+
+def friends_ids_response(request, friends_queryset):
+    if is_expand_request(request):
+        return friends_expanded_response(request, friends_queryset)
+
+    if is_stream_request(request):
+        return stream_collection('users', iterate(friends_queryset.values_list('id', flat=True)))
+
+    return JsonResponse(User.friends_ids(friends_queryset))
+
+
+def friends_expanded_response(request, friends_queryset):
+    """Полные данные пользователей одним запросом. ?fields= выбирает из БД только нужные столбцы"""
+    serializer = user_serializer
+    fields = request.GET.get('fields', None)
+    if fields:
+        try:
+            serializer = user_serializer.subset([field.strip() for field in fields.split(',') if field.strip()])
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    values = serializer.values(friends_queryset)
+    if is_stream_request(request):
+        return stream_collection('users', serializer.rows(iterate(values)))
+
+    return JsonResponse({'users': tuple(serializer.rows(values))})
+
+
+friends_parameters = [
+    stream_parameter,
+    openapi.Parameter(
+        'expand', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['users'],
+        description='users - вместо id вернуть данные пользователей (как в users/get/<id>/)'
+    ),
+    openapi.Parameter(
+        'fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+        description='Только с expand=users: поля пользователя через запятую, например id,username,avatar'
+    ),
+]
+
+
+MAX_ID = 2 ** 63 - 1
+
+
+def get_batch_ids(request) -> list:
+    """id из ?ids=1,2,3 (или ?ids=1&ids=2) в порядке запроса, без повторов"""
+    ids = []
+    for part in ','.join(request.GET.getlist('ids')).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        # Только десятичные цифры (int() принимает и '+1', '1_0') и в пределах bigint: больше не влезает в запрос к БД
+        pk = int(part) if part.isascii() and part.isdigit() else 0
+        if not 1 <= pk <= MAX_ID:
+            raise ValueError(f'Некорректный id: {part}')
+        ids.append(pk)
+
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValueError('Не указаны ids')
+    if len(ids) > settings.API_BATCH_MAX_IDS:
+        raise ValueError(f'Можно запросить не больше {settings.API_BATCH_MAX_IDS} id за раз')
+    return ids
+
+
+def batch_response(request, key: str, serializer: RowSerializer, queryset):
+    try:
+        ids = get_batch_ids(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    rows = {row.id: row for row in serializer.values(queryset.filter(id__in=ids))}
+
+    return JsonResponse({
+        key: [serializer.serialize(rows[pk]) for pk in ids if pk in rows],
+        'missing': [pk for pk in ids if pk not in rows],
+    })
+
+
+def batch_schema(title: str, key: str, item_schema: openapi.Schema) -> openapi.Schema:
+    return openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        title=title,
+        required=[key, 'missing'],
+        properties={
+            key: openapi.Schema(type=openapi.TYPE_ARRAY, title='Найденные, в порядке ids', items=item_schema),
+            'missing': openapi.Schema(
+                type=openapi.TYPE_ARRAY, title='Ненайденные id', items=openapi.Schema(type=openapi.TYPE_INTEGER)
+            ),
+        }
+    )
+
+
+batch_ids_parameter = openapi.Parameter(
+    'ids', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+    description='id через запятую, не больше API_BATCH_MAX_IDS (по умолчанию 100)'
+)
+
+
 error_schema = openapi.Schema(
     type=openapi.TYPE_OBJECT,
     title='Ошибка',
@@ -49,21 +182,34 @@ success_schema = openapi.Schema(
     }
 )
 
+tokens_schema = openapi.Schema(
+    type=openapi.TYPE_OBJECT,
+    title='Вход',
+    required=['message'],
+    properties={
+        'message': openapi.Schema(type=openapi.TYPE_STRING, title='Текст успеха'),
+        'access': openapi.Schema(type=openapi.TYPE_STRING, title='Access-токен', description='Только при mode=token'),
+        'refresh': openapi.Schema(type=openapi.TYPE_STRING, title='Refresh-токен', description='Только при mode=token'),
+        'expiresIn': openapi.Schema(type=openapi.TYPE_INTEGER, title='Срок действия access-токена, сек'),
+    }
+)
+
 
 @swagger_auto_schema(
     operation_summary='Получение всех постов',
-    operation_description='Получение коллекции всех постов',
+    operation_description='Получение коллекции всех постов постранично, от новых к старым. Для следующей страницы '
+                          'передайте next_cursor из ответа в параметр cursor',
     methods=['GET'],
+    manual_parameters=collection_parameters,
     responses={
-        200: Post.collection_schema
+        200: Post.collection_schema,
+        400: error_schema,
     },
 )
 @api_view(['GET'])
-@ensure_csrf_cookie
+@public_cache
 def get_all_posts_view(request):
-    return JsonResponse({
-        'posts': tuple(map(lambda x: x.json, Post.objects.all()))
-    })
+    return posts_collection_response(request, Post.objects.all())
 
 
 @swagger_auto_schema(
@@ -76,10 +222,11 @@ def get_all_posts_view(request):
     },
 )
 @api_view(['GET'])
-@ensure_csrf_cookie
+@public_cache
+@cached_response('get_post', lambda post_id: [f'post:{post_id}'])
 def get_post_view(request, post_id):
     try:
-        post: Post = Post.objects.get(id=post_id)
+        post: Post = post_cache.get(post_id)
     except Post.DoesNotExist:
         return JsonResponse({'error': 'Пост не найден'}, status=404)
     return JsonResponse(post.json)
@@ -87,19 +234,67 @@ def get_post_view(request, post_id):
 
 @swagger_auto_schema(
     operation_summary='Получение постов пользователя',
-    operation_description='Получение коллекции всех постов от определенного пользователя с user_id',
+    operation_description='Получение коллекции всех постов от определенного пользователя с user_id постранично, '
+                          'от новых к старым. Для следующей страницы передайте next_cursor из ответа в параметр cursor',
     methods=['GET'],
+    manual_parameters=collection_parameters,
     responses={
-        200: Post.collection_schema
+        200: Post.collection_schema,
+        400: error_schema,
     },
 )
 @api_view(['GET'])
-@ensure_csrf_cookie
+@public_cache
+@cached_response('user_posts', lambda user_id: [f'user-posts:{user_id}'])
 def get_user_posts_view(request, user_id):
-    posts = Post.objects.filter(author__id=user_id).all()
+    return posts_collection_response(request, Post.objects.filter(author_id=user_id))
+
+
+@swagger_auto_schema(
+    operation_summary='Получение нескольких постов',
+    operation_description='Получение постов по списку id одним запросом. Посты возвращаются в порядке ids, '
+                          'ненайденные id перечисляются в missing',
+    methods=['GET'],
+    manual_parameters=[batch_ids_parameter],
+    responses={
+        200: batch_schema('Посты', 'posts', Post.schema),
+        400: error_schema,
+    },
+)
+@api_view(['GET'])
+@public_cache
+def get_posts_batch_view(request):
+    return batch_response(request, 'posts', post_serializer, Post.objects.all())
+
+
+@swagger_auto_schema(
+    operation_summary='Лента друзей',
+    operation_description='Посты друзей текущего пользователя постранично, от новых к старым. Для следующей страницы '
+                          'передайте next_cursor из ответа в параметр cursor. Пользователь должен быть авторизован',
+    methods=['GET'],
+    manual_parameters=collection_parameters[:2],
+    responses={
+        200: Post.collection_schema,
+        400: error_schema,
+        403: error_schema,
+    },
+)
+@api_view(['GET'])
+@ensure_csrf_cookie
+def get_feed_view(request):
+    user: User = request.user
+
+    if user.is_anonymous:
+        return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
+
+    try:
+        page, next_cursor = paginate_merged(request, feed.feed_sources(user))
+    except CursorError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
     return JsonResponse({
-        'posts': tuple(map(lambda x: x.json, posts))
+        'posts': tuple(post_serializer.rows(page)),
+        'next_cursor': next_cursor,
     })
 
 
@@ -145,6 +340,10 @@ def create_post_view(request):
             return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
 
         data = get_request_data(request)
+        upload_error = get_upload_error(request)
+        if upload_error:
+            return JsonResponse({'error': upload_error.message}, status=upload_error.status)
+
         title = data.get('title', None)
         description = data.get('description', '')
         image = request.FILES.get('image', None)
@@ -159,7 +358,12 @@ def create_post_view(request):
         except ValidationError as e:
             return JsonResponse({'error': e.message_dict}, status=400)
 
-        post.save()
+        with transaction.atomic():
+            post.save()
+            User.change_counters(user.id, post_count=1)
+            tasks.submit(feed.fan_out_post, post.id)
+            if post.image:
+                tasks.submit(image_variants.process_post_image, post.id)
 
         return JsonResponse({'message': 'Пост создан', 'post_id': post.id}, status=200)
 
@@ -177,16 +381,34 @@ def create_post_view(request):
     },
 )
 @api_view(['GET'])
-@ensure_csrf_cookie
+@public_cache
+@cached_response('user', lambda user_id: [f'user:{user_id}'])
 def get_user_view(request, user_id):
     try:
-        user: User = User.objects.get(id=user_id)
+        user: User = user_cache.get(user_id)
 
         return JsonResponse(user.json)
     except User.DoesNotExist:
         return JsonResponse({'error': 'Пользователь не найден'}, status=404)
 
 
+@swagger_auto_schema(
+    operation_summary='Получение нескольких пользователей',
+    operation_description='Получение пользователей по списку id одним запросом (например, id из списка друзей). '
+                          'Пользователи возвращаются в порядке ids, ненайденные id перечисляются в missing',
+    methods=['GET'],
+    manual_parameters=[batch_ids_parameter],
+    responses={
+        200: batch_schema('Пользователи', 'users', User.schema),
+        400: error_schema,
+    },
+)
+@api_view(['GET'])
+@public_cache
+def get_users_batch_view(request):
+    return batch_response(request, 'users', user_serializer, User.objects.all())
+
+
 @swagger_auto_schema(
     operation_summary='Получение текущего пользователя',
     operation_description='Получение общих данных страницы текущего пользователя',
@@ -207,23 +429,71 @@ def get_user_self_view(request):
     return JsonResponse(user.json)
 
 
+@swagger_auto_schema(
+    operation_summary='Получение счетчиков текущего пользователя',
+    operation_description='Количество друзей, входящих и исходящих заявок в друзья и постов текущего пользователя. '
+                          'Значения хранятся в профиле, запрос не считает их заново',
+    methods=['GET'],
+    responses={
+        200: User.counters_schema,
+        403: error_schema
+    },
+)
+@api_view(['GET'])
+@ensure_csrf_cookie
+def user_counters_view(request):
+    user: User = request.user
+
+    if user.is_anonymous:
+        return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
+
+    return JsonResponse(user.counters)
+
+
+@swagger_auto_schema(
+    operation_summary='Получение csrf-токена',
+    operation_description='Устанавливает cookie csrftoken и возвращает токен (также в заголовке X-CSRFToken). '
+                          'Токен передается в заголовке X-CSRFToken в POST-запросах с сессией. Публичные GET-запросы '
+                          'cookie не устанавливают, поэтому браузерный клиент вызывает этот эндпоинт перед входом',
+    methods=['GET'],
+    responses={
+        200: openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            title='csrf-токен',
+            required=['csrfToken'],
+            properties={
+                'csrfToken': openapi.Schema(type=openapi.TYPE_STRING, title='csrf-токен'),
+            }
+        ),
+    }
+)
+@api_view(['GET'])
+@never_cache
+@ensure_csrf_cookie
+def csrf_token_view(request):
+    return JsonResponse({'csrfToken': request.META['CSRF_COOKIE']})
+
+
 @swagger_auto_schema(
     operation_summary='Вход по логину и паролю',
     operation_description='Эндпоинт для входа пользователя по логину и паролю. Данные могут быть переданы в формате '
                           'JSON. При успехе - сервер привязывает пользователя к cookie csrf_token, он отправляется при любом '
-                          'запросе, потому вам необходимо его сохранять.',
+                          'запросе, потому вам необходимо его сохранять. С mode=token сессия не создается: в ответе '
+                          'access- и refresh-токены, access передается в заголовке Authorization: Bearer <токен>',
     methods=['POST'],
     responses={
-        200: success_schema,
+        200: tokens_schema,
         400: error_schema,
-        404: error_schema,
+        401: error_schema,
     },
     request_body=openapi.Schema(
         type=openapi.TYPE_OBJECT,
         required=['username', 'password'],
         properties={
             'username': openapi.Schema(type=openapi.TYPE_STRING, title='Логин пользователя'),
-            'password': openapi.Schema(type=openapi.TYPE_STRING, title='Пароль пользователя')
+            'password': openapi.Schema(type=openapi.TYPE_STRING, title='Пароль пользователя'),
+            'mode': openapi.Schema(type=openapi.TYPE_STRING, title='Способ входа', enum=['session', 'token'],
+                                   description='session (по умолчанию) - cookie сессии, token - подписанные токены'),
         }
     )
 )
@@ -238,29 +508,91 @@ def user_login_view(request):
     if username is None or password is None:
         return JsonResponse({'error': 'Не указан логин или пароль'}, status=400)
 
+    mode = data.get('mode', 'session')
+    if mode not in ('session', 'token'):
+        return JsonResponse({'error': 'Неизвестный способ входа'}, status=400)
+
     user = authenticate(request, username=username, password=password)
-    if user is not None:
-        login(request, user)
-        return JsonResponse({"message": "Вход подтвержден"})
-    else:
+    if user is None:
         return JsonResponse({'error': 'Пароль или логин не верны'}, status=401)
 
+    if mode == 'token':
+        return JsonResponse({"message": "Вход подтвержден", **tokens.issue_tokens(user)})
+
+    login(request, user)
+    return JsonResponse({"message": "Вход подтвержден"})
+
 
 @swagger_auto_schema(
     operation_summary='Выход из системы',
-    operation_description='Отвязывает csrf-токен пользователя от системы',
+    operation_description='Отвязывает csrf-токен пользователя от системы. При входе по токену отзывает refresh-токен '
+                          'из тела запроса, если он передан, и access-токен из заголовка Authorization (с Redis; '
+                          'без него access-токен действует до истечения срока)',
     methods=['POST'],
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'refresh': openapi.Schema(type=openapi.TYPE_STRING, title='Refresh-токен'),
+        }
+    ),
     responses={
         200: success_schema,
+        503: error_schema,
     }
 )
 @api_view(['POST'])
 @ensure_csrf_cookie
 def user_logout_view(request):
-    logout(request)
+    if isinstance(request.auth, dict):
+        try:
+            if tokens.is_revocable(tokens.ACCESS):
+                tokens.revoke(request.auth)
+            refresh = get_request_data(request).get('refresh', None)
+            if refresh:
+                tokens.revoke(tokens.read_token(tokens.REFRESH, refresh))
+        except tokens.RevokeError as e:
+            return JsonResponse({'error': str(e)}, status=503)
+        except tokens.TokenError:
+            # Недействительный refresh-токен отзывать не нужно
+            pass
+    else:
+        logout(request)
     return JsonResponse({'message': 'Выход выполнен'})
 
 
+@swagger_auto_schema(
+    operation_summary='Обновление токенов',
+    operation_description='Обмен refresh-токена на новую пару access- и refresh-токенов. Переданный refresh-токен '
+                          'после этого недействителен',
+    methods=['POST'],
+    request_body=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        required=['refresh'],
+        properties={
+            'refresh': openapi.Schema(type=openapi.TYPE_STRING, title='Refresh-токен'),
+        }
+    ),
+    responses={
+        200: tokens_schema,
+        400: error_schema,
+        401: error_schema,
+        503: error_schema,
+    }
+)
+@api_view(['POST'])
+def refresh_tokens_view(request):
+    refresh = get_request_data(request).get('refresh', None)
+    if not refresh:
+        return JsonResponse({'error': 'Не указан refresh-токен'}, status=400)
+
+    try:
+        return JsonResponse({'message': 'Токены обновлены', **tokens.refresh_tokens(refresh, user_cache.get)})
+    except tokens.RevokeError as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    except (tokens.TokenError, User.DoesNotExist) as e:
+        return JsonResponse({'error': str(e)}, status=401)
+
+
 @swagger_auto_schema(
     operation_summary='Получение количества друзей пользователя',
     operation_description='Возвращает объект с количеством друзей',
@@ -277,32 +609,35 @@ def user_logout_view(request):
     }
 )
 @api_view(['GET'])
-@ensure_csrf_cookie
+@public_cache
 def user_friend_count_view(request, user_id):
     try:
-        user: User = User.objects.get(id=user_id)
+        user: User = user_cache.get(user_id)
 
-        return JsonResponse({"friendCount": user.friends.count()})
+        return JsonResponse({"friendCount": user.friend_count})
     except User.DoesNotExist:
         return JsonResponse({'error': 'Пользователь не найден'}, status=404)
 
 
 @swagger_auto_schema(
     operation_summary='Получение списка друзей пользователя',
-    operation_description='Возвращает коллекцию id друзей пользователя',
+    operation_description='Возвращает коллекцию id друзей пользователя. С expand=users - коллекцию пользователей',
     methods=['GET'],
+    manual_parameters=friends_parameters,
     responses={
         200: User.friends_ids_schema,
         404: error_schema,
     }
 )
 @api_view(['GET'])
-@ensure_csrf_cookie
+@public_cache
+# С expand=users в ответе профили друзей, их изменения не меняют версию user-friends
+@cached_response('friends', lambda user_id: [f'user-friends:{user_id}'], bypass=is_expand_request)
 def user_friends_view(request, user_id):
     try:
-        user: User = User.objects.get(id=user_id)
+        user: User = user_cache.get(user_id)
 
-        return JsonResponse(User.friends_ids(user.friends.all()))
+        return friends_ids_response(request, user.friends.all())
     except User.DoesNotExist:
         return JsonResponse({'error': 'Пользователь не найден'}, status=404)
 
@@ -310,8 +645,9 @@ def user_friends_view(request, user_id):
 @swagger_auto_schema(
     operation_summary='Получение списка полученных заявок в друзья пользователя',
     operation_description='Возвращает коллекцию id пользователей которые прислали заявку для дружбы текущему '
-                          'пользователю',
+                          'пользователю. С expand=users - коллекцию пользователей',
     methods=['GET'],
+    manual_parameters=friends_parameters,
     responses={
         200: User.friends_ids_schema,
         403: error_schema,
@@ -326,14 +662,15 @@ def user_friends_requests_view(request):
     if user.is_anonymous:
         return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
 
-    return JsonResponse(User.friends_ids(user.friend_requests.all()))
+    return friends_ids_response(request, user.friend_requests.all())
 
 
 @swagger_auto_schema(
     operation_summary='Получение списка отправленных заявок в друзья пользователя',
     operation_description='Возвращает коллекцию id пользователей которым были отправлены заявки для дружбы от '
-                          'текущего пользователя',
+                          'текущего пользователя. С expand=users - коллекцию пользователей',
     methods=['GET'],
+    manual_parameters=friends_parameters,
     responses={
         200: User.friends_ids_schema,
         403: error_schema,
@@ -347,7 +684,7 @@ def user_friends_requests_send_view(request):
     if user.is_anonymous:
         return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
 
-    return JsonResponse(User.friends_ids(user.friend_requests_send.all()))
+    return friends_ids_response(request, user.friend_requests_send.all())
 
 
 def get_users_pair(request, data):
@@ -359,7 +696,7 @@ def get_users_pair(request, data):
         return False, JsonResponse({'error': 'Не указан id пользователя'}, status=400)
 
     try:
-        other_user = User.objects.get(id=user_id)
+        other_user = user_cache.get(user_id)
     except User.DoesNotExist:
         return False, JsonResponse({'error': 'Пользователь не найден'}, status=404)
 
@@ -401,7 +738,8 @@ def make_friend_view(request):
             return result
         user, friend = result
 
-        UserFriend.objects.create(user=user, friend=friend)
+        with transaction.atomic():
+            UserFriend.send_request(user, friend)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -438,12 +776,11 @@ def accept_friend_view(request):
             return result
         friend, user = result
 
-        try:
-            user_friend = UserFriend.objects.get(user=user, friend=friend, is_friend=False)
-        except UserFriend.DoesNotExist:
-            return JsonResponse({'error': 'Запрос не найден'}, status=404)
-        user_friend.is_friend = True
-        user_friend.save()
+        with transaction.atomic():
+            if not UserFriend.accept_request(user, friend):
+                return JsonResponse({'error': 'Запрос не найден'}, status=404)
+            tasks.submit(feed.on_friendship_created, user.id, friend.id)
+            transaction.on_commit(lambda: response_cache.invalidate(f'user-friends:{user.id}', f'user-friends:{friend.id}'))
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -451,8 +788,9 @@ def accept_friend_view(request):
 
 @swagger_auto_schema(
     operation_summary='Отклонение запроса в друзья',
-    operation_description='Отклоняет запрос в друзья текущему пользователю от указанного user_id. Текущий '
-                          'пользователь должен быть авторизован',
+    operation_description='Отклоняет запрос в друзья текущему пользователю от указанного user_id. Если запроса нет, '
+                          'а пользователи уже друзья - удаляет user_id из друзей. Текущий пользователь должен быть '
+                          'авторизован',
     methods=['POST'],
     request_body=openapi.Schema(
         type=openapi.TYPE_OBJECT,
@@ -479,16 +817,19 @@ def reject_friend_view(request):
             return result
         friend, user = result
 
-        try:
-            user_friend = UserFriend.objects.get(user=user, friend=friend, is_friend=False)
-        except UserFriend.DoesNotExist:
-            return JsonResponse({'error': 'Запрос не найден'}, status=404)
-        user_friend.delete()
-        user_friend.save()
+        with transaction.atomic():
+            if UserFriend.reject_request(user, friend):
+                return JsonResponse({'message': 'Запрос в друзья отклонён'})
+
+            # Заявки нет, но пользователи уже друзья - дружба удаляется в обе стороны
+            if not UserFriend.remove_friendship(user, friend):
+                return JsonResponse({'error': 'Запрос не найден'}, status=404)
+            tasks.submit(feed.on_friendship_removed, user.id, friend.id)
+            transaction.on_commit(lambda: response_cache.invalidate(f'user-friends:{user.id}', f'user-friends:{friend.id}'))
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
-    return JsonResponse({'message': 'Запрос в друзья отклонён'})
+    return JsonResponse({'message': 'Пользователь удалён из друзей'})
 
 @swagger_auto_schema(
     operation_summary='Обновление пользователя',
@@ -522,20 +863,29 @@ def update_user_view(request):
             return JsonResponse({'error': 'Пользователь не авторизован'}, status=403)
 
         data = get_request_data(request)
+        upload_error = get_upload_error(request)
+        if upload_error:
+            return JsonResponse({'error': upload_error.message}, status=upload_error.status)
 
         description = data.get('description', '')
         image = request.FILES.get('image', None)
 
         user.description = description if description else user.description
 
-        user.image = image if image else user.image
+        if image:
+            user.avatar = image
+            user.avatar_variants_ready = False
 
         try:
             user.full_clean()
         except ValidationError as e:
             return JsonResponse({'error': e.message_dict}, status=400)
 
-        user.save()
+        with transaction.atomic():
+            # Только поля профиля: request.user может быть копией из кэша, а счетчики меняются через F()
+            user.save(update_fields=['description', 'avatar', 'avatar_variants_ready'])
+            if image:
+                tasks.submit(image_variants.process_avatar, user.id)
 
         return JsonResponse({'message': 'Пользователь обновлен'}, status=200)
 
@@ -543,3 +893,23 @@ def update_user_view(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@swagger_auto_schema(
+    operation_summary='Статистика кэша сущностей',
+    operation_description='Попадания, промахи и вытеснения по уровням кэша пользователей и постов в текущем процессе. '
+                          'Только для персонала',
+    methods=['GET'],
+    responses={
+        200: openapi.Schema(type=openapi.TYPE_OBJECT, title='Статистика по кэшам users и posts'),
+        403: error_schema,
+    }
+)
+@api_view(['GET'])
+@ensure_csrf_cookie
+def entity_cache_stats_view(request):
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Недостаточно прав'}, status=403)
+
+    return JsonResponse({
+        'users': user_cache.stats(),
+        'posts': post_cache.stats(),
+    })
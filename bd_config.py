@@ -1,19 +1,22 @@
 import json
-import os
 from pathlib import Path
 
-__all__ = ["default_database"]
+__all__ = ["load_database"]
 
 BASE_DIR = Path(__file__).resolve().parent
 
-if not os.path.exists(os.path.join(BASE_DIR, 'config.json')):
-    with open(os.path.join(BASE_DIR, 'config.json'), 'w', encoding='utf-8') as config_file:
-        json.dump({
-            'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': str(BASE_DIR / 'db.sqlite3'),
-        }, config_file, ensure_ascii=False, indent=4)
+CONFIG_FILE = BASE_DIR / 'config.json'
 
+DEFAULT_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': str(BASE_DIR / 'db.sqlite3'),
+}
 
-with open(os.path.join(BASE_DIR, 'config.json'), 'r', encoding='utf-8') as config_file:
 
-    default_database = json.load(config_file)
+def load_database(path: Path = CONFIG_FILE) -> dict:
+    """Настройки БД из config.json, без файла - SQLite рядом с проектом. Файл не создается и не меняется"""
+    try:
+        with open(path, 'r', encoding='utf-8') as config_file:
+            return json.load(config_file)
+    except FileNotFoundError:
+        return dict(DEFAULT_DATABASE)
@@ -13,7 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 
 import os
-from bd_config import default_database
+from bd_config import load_database
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,12 +51,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Снаружи RequestTimingMiddleware: пишет в метрики его замеры
+    'api.middleware.MetricsMiddleware',
+    # Общее время запроса включает остальные middleware
+    'api.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # До SessionMiddleware: убирает Vary: Cookie у публичных анонимных ответов
+    'api.middleware.PublicCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # После AuthenticationMiddleware: ?profile= проверяет request.user
+    'api.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -87,7 +95,31 @@ WSGI_APPLICATION = 'socialBackend.wsgi.application'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 DATABASES = {
-    'default': default_database
+    'default': load_database()
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# shared - кэш, общий для всех процессов, для данных, которые должны совпадать во всех воркерах (отозванные токены).
+# Redis из REDIS_URL (нужен пакет redis), без него - таблица в БД (создается командой createcachetable после migrate)
+REDIS_URL = os.environ.get('REDIS_URL', None)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shared_cache',
+    },
 }
 
 
@@ -150,4 +182,158 @@ CORS_EXPOSE_HEADERS = [
 
 X_FRAME_OPTIONS = "SAMEORIGIN"
 
+# Пагинация коллекций (курсор по created_date, id)
+API_PAGE_SIZE = 20
+API_PAGE_SIZE_MAX = 100
+# Старый формат ответа (вся коллекция целиком) для всех запросов, без ?legacy=1
+API_LEGACY_COLLECTIONS = False
+
+# Максимум id в одном запросе users/get/batch/ и posts/get/batch/
+API_BATCH_MAX_IDS = 100
+
+# Размер порции при потоковой отдаче коллекций (строк за один fetch из БД)
+API_STREAM_CHUNK_SIZE = 2000
+
+# async def версии эндпоинтов чтения (api.async_views) - для запуска под ASGI (socialBackend.asgi)
+API_ASYNC_VIEWS = os.environ.get('API_ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+
+# Кэш ответов GET-эндпоинтов (api.response_cache). TIMEOUT - время жизни и ответов, и версий объектов:
+# с кэшем в процессе другие воркеры видят изменение не позже чем через столько секунд
+API_RESPONSE_CACHE_ALIAS = 'default'
+API_RESPONSE_CACHE_TIMEOUT = 300
+# Cache-Control публичных эндпоинтов для анонимных запросов (прокси, CDN), секунды
+API_PUBLIC_CACHE_MAX_AGE = 30
+API_PUBLIC_CACHE_STALE_WHILE_REVALIDATE = 300
+
+# Замеры запросов (api.middleware.RequestTimingMiddleware).
+# Доля запросов, у которых считаются SQL и сериализация (0..1), у остальных - только общее время
+API_TIMING_SAMPLE_RATE = float(os.environ.get('API_TIMING_SAMPLE_RATE', 1.0))
+# Заголовок Server-Timing в ответах
+API_TIMING_HEADER = True
+# Запросы дольше стольких мс или с большим числом SQL пишутся в лог api.middleware
+API_TIMING_SLOW_MS = 500
+API_TIMING_QUERY_BUDGET = 20
+
+# Профилирование запросов по требованию (api.profiling): заголовок X-Profile с токеном
+# из manage.py profile_captures --token или ?profile=cprofile|sample у персонала
+API_PROFILE_DIR = BASE_DIR / 'profiles'
+API_PROFILE_TOKEN_MAX_AGE = 60 * 60
+# Снимков в минуту, счетчик в кэше API_PROFILE_CACHE_ALIAS (общий для процессов, если кэш общий)
+API_PROFILE_RATE_LIMIT = 10
+API_PROFILE_CACHE_ALIAS = 'default'
+# Период сэмплера стека, секунды
+API_PROFILE_SAMPLE_INTERVAL = 0.002
+
+# Метрики Prometheus (api.metrics, /metrics): файлы значений процессов. Каталог нужно очищать перед запуском сервера
+# (manage.py clear_metrics), у всех воркеров он должен быть общим
+API_METRICS_DIR = os.environ.get('API_METRICS_DIR', BASE_DIR / 'metrics')
+# Если задан, /metrics требует заголовок Authorization: Bearer <токен>. Без токена /metrics работает только с DEBUG
+API_METRICS_TOKEN = os.environ.get('API_METRICS_TOKEN', None)
+
+# Кэш сущностей User/Post (api.entity_cache): LRU в процессе + общий кэш Django (только с Redis: общий кэш
+# в БД медленнее самой выборки). Локальный TTL - сколько процесс может отдавать запись, измененную в другом процессе
+ENTITY_CACHE_ALIAS = 'shared' if REDIS_URL else None
+ENTITY_CACHE_LOCAL_SIZE = 1000
+ENTITY_CACHE_LOCAL_TTL = 5
+ENTITY_CACHE_SHARED_TIMEOUT = 300
+
+# Фоновые задачи (api.tasks). SYNC - выполнять сразу после коммита в текущем потоке, включается только в тестах
+BACKGROUND_TASKS_WORKERS = 4
+BACKGROUND_TASKS_SYNC = False
+# Задача, получившая database is locked (SQLite), повторяется до LOCK_RETRIES раз с паузой от RETRY_DELAY секунд,
+# удваивающейся с каждой попыткой
+BACKGROUND_TASKS_LOCK_RETRIES = 5
+BACKGROUND_TASKS_RETRY_DELAY = 0.05
+
+# Варианты загруженных изображений (api.images): имя -> максимальная сторона в пикселях
+IMAGE_VARIANTS = {
+    'thumb': 150,
+    'medium': 600,
+    'full': 1600,
+}
+IMAGE_VARIANT_FORMAT = 'WEBP'  # или 'JPEG'
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANTS_DIR = 'variants'
+
+# Загрузка файлов (api.uploads): проверка на лету, файлы больше FILE_UPLOAD_MAX_MEMORY_SIZE пишутся на диск
+FILE_UPLOAD_HANDLERS = [
+    'api.uploads.ImageUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+# Лимит размера файла по имени url, для остальных эндпоинтов - UPLOAD_DEFAULT_MAX_SIZE
+UPLOAD_MAX_SIZES = {
+    'create_post': 10 * 1024 * 1024,
+    'update-profile': 5 * 1024 * 1024,
+}
+UPLOAD_DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+# Запас на обычные поля формы при проверке Content-Length
+UPLOAD_FORM_FIELDS_ALLOWANCE = 64 * 1024
+UPLOAD_ALLOWED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+UPLOAD_MAX_PIXELS = 40_000_000
+# Сколько байт от начала файла читается для разбора заголовка изображения
+UPLOAD_HEADER_MAX_BYTES = 256 * 1024
+
+# Контентно-адресуемое хранилище (api.storage): файлы по sha256 содержимого, один файл на одинаковые загрузки
+MEDIA_BLOBS_DIR = 'blobs'
+# Неиспользуемый файл удаляется командой gc_media не раньше, чем через это время после последнего изменения
+MEDIA_GC_GRACE_SECONDS = 3600
+# Cache-Control медиафайлов (api.media): файлы из MEDIA_BLOBS_DIR не меняются и кэшируются навсегда
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MEDIA_CACHE_MAX_AGE = 24 * 3600
+# Отдача медиафайлов (api.media): 'direct' - сам Django, 'x-accel' - nginx по X-Accel-Redirect,
+# 'x-sendfile' - веб-сервер по X-Sendfile
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'direct')
+# internal location nginx, указывающий на MEDIA_ROOT (для режима x-accel)
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Лента друзей (api.feed)
+FEED_FANOUT_BATCH_SIZE = 1000
+# Посты пользователей с большим числом друзей (на момент публикации) не раскладываются по лентам,
+# а читаются при запросе ленты
+FEED_FANOUT_MAX_FRIENDS = 5000
+# Сколько последних постов нового друга добавляется в ленту
+FEED_BACKFILL_SIZE = 100
+
+# С Redis сессии читаются из кэша, при промахе - из БД. Кэш сессий обязан быть общим для всех процессов:
+# с кэшем в процессе выход из системы в одном воркере не сбрасывает сессию, закэшированную в другом
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db' if REDIS_URL else 'django.contrib.sessions.backends.db'
+SESSION_CACHE_ALIAS = 'shared'
+
+AUTHENTICATION_BACKENDS = [
+    # Пользователь сессии берется из кэша сущностей
+    'users.backends.CachedModelBackend',
+    # Для сессий, созданных до появления CachedModelBackend
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        # Authorization: Bearer <access-токен> (users.tokens), без сессии и CSRF
+        'users.authentication.TokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+# Токены входа (users.tokens): время жизни в секундах и кэш списка отозванных токенов (должен быть общим)
+TOKEN_ACCESS_LIFETIME = 15 * 60
+TOKEN_REFRESH_LIFETIME = 14 * 24 * 3600
+TOKEN_DENY_LIST_CACHE_ALIAS = 'shared'
+# Сверять access-токены с deny-list на каждом запросе и отзывать их при выходе. Без Redis deny-list хранится в БД,
+# и проверка стоила бы запроса к БД на каждый запрос: access-токен тогда действует до истечения срока
+TOKEN_REVOKE_ACCESS = bool(REDIS_URL)
+
+# OpenAPI-схема (api.openapi): файл пишется командой build_openapi, без файла схема строится при первом запросе
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'openapi.json'
+OPENAPI_SCHEMA_MAX_AGE = 300
+
+SWAGGER_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+
 AUTH_USER_MODEL = "users.User"
@@ -14,38 +14,30 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
-
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Social API",
-      default_version='v1.0',
-      description="Общая документация для API Social",
-      contact=openapi.Contact(email="MikanDrawChannel@gmail.com"),
-
-   ),
-   public=True,
-   permission_classes=[permissions.AllowAny],
-)
-
+from django.urls import path, include, re_path
 
+from api.media import serve_media
+from api.metrics import metrics_view
+from api.openapi import schema_file_view, schema_ui_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
 
+    path('metrics', metrics_view, name='metrics'),
+
     path('api/', include('api.urls')),
 
-    path('docs/swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('docs/swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('docs/redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    re_path(r'^docs/swagger(?P<format>\.json|\.yaml)/$', schema_file_view, name='schema-json'),
+    path('docs/swagger/', schema_ui_view, {'renderer': 'swagger'}, name='schema-swagger-ui'),
+    path('docs/redoc/', schema_ui_view, {'renderer': 'redoc'}, name='schema-redoc'),
 
-]+static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+]
 
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
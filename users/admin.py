@@ -24,7 +24,9 @@ class CustomUserAdmin(UserAdmin):
     fieldsets = (
         (None, {"fields": ("username", "first_name", "last_name", "email", "avatar", "password", "description",)}),
         ("Разрешения", {"fields": ("is_staff", "is_active", "groups", "user_permissions")}),
+        ("Счетчики", {"fields": User.COUNTER_FIELDS}),
     )
+    readonly_fields = User.COUNTER_FIELDS
     add_fieldsets = (
         (None, {
             "classes": ("wide",),
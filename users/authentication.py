@@ -0,0 +1,36 @@
+from rest_framework import authentication, exceptions
+
+from api.entity_cache import user_cache
+from users.tokens import ACCESS, TokenError, read_token
+
+
+def get_bearer_token(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+class TokenAuthentication(authentication.BaseAuthentication):
+    """Authorization: Bearer <access-токен> (users.tokens). Запросы с токеном не проверяют CSRF"""
+
+    def authenticate(self, request):
+        token = get_bearer_token(request)
+        if token is None:
+            return None
+
+        try:
+            payload = read_token(ACCESS, token)
+            user = user_cache.get(payload['u'])
+        except TokenError as e:
+            raise exceptions.AuthenticationFailed(str(e))
+        except user_cache.model.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Пользователь не найден')
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('Пользователь не активен')
+        return user, payload
+
+    def authenticate_header(self, request):
+        return 'Bearer'
@@ -0,0 +1,17 @@
+from django.contrib.auth.backends import ModelBackend
+
+from api.entity_cache import user_cache
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend, который берет пользователя сессии из кэша сущностей (api.entity_cache) вместо запроса к auth_user.
+    Запись сбрасывается при сохранении пользователя (в том числе при смене пароля) и при выходе (api.signals)
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = user_cache.get(user_id)
+        except user_cache.model.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(queryset.order_by().values(field).annotate(count=Count('*')).values('count')), 0)
+
+
+def actual_counters(User, UserFriend, Post) -> dict:
+    """Выражения реальных значений счетчиков User. Модели передаются явно, чтобы работать и в миграциях"""
+    return {
+        'friend_count': _count(UserFriend.objects.filter(user=OuterRef('pk'), is_friend=True), 'user'),
+        'incoming_requests_count': _count(UserFriend.objects.filter(friend=OuterRef('pk'), is_friend=False), 'friend'),
+        'outgoing_requests_count': _count(UserFriend.objects.filter(user=OuterRef('pk'), is_friend=False), 'user'),
+        'post_count': _count(Post.objects.filter(author=OuterRef('pk')), 'author'),
+    }
+
+
+def repair_counters(User, UserFriend, Post, batch_size=1000, dry_run=False, users=None) -> int:
+    """
+    Пересчитывает счетчики пачками по batch_size пользователей (всех или выборки users) и исправляет расхождения.
+    Запись - один UPDATE с подзапросами, поэтому параллельные изменения через F() не теряются.
+    Возвращает количество пользователей с расхождениями.
+    """
+    counters = actual_counters(User, UserFriend, Post)
+    drift = Q()
+    for name in counters:
+        drift |= ~Q(**{name: F(f'actual_{name}')})
+
+    if users is None:
+        users = User.objects.all()
+
+    repaired = 0
+    last_id = 0
+    while True:
+        ids = list(users.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        drifted = list(
+            User.objects.filter(id__in=ids)
+            .annotate(**{f'actual_{name}': expression for name, expression in counters.items()})
+            .filter(drift)
+            .values_list('id', flat=True)
+        )
+        if drifted and not dry_run:
+            with transaction.atomic():
+                User.objects.filter(id__in=drifted).update(**counters)
+        repaired += len(drifted)
+
+    return repaired
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Post
+from users.counters import repair_counters
+from users.models import User, UserFriend
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков друзей, заявок и постов пользователей и исправление расхождений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Пользователей за один проход')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать расхождения, ничего не менять')
+
+    def handle(self, *args, **options):
+        repaired = repair_counters(User, UserFriend, Post, batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        if options['dry_run']:
+            self.stdout.write(f'Пользователей с расхождениями: {repaired}')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено пользователей: {repaired}'))
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:42
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_reverse_friendships(apps, schema_editor):
+    UserFriend = apps.get_model('users', 'UserFriend')
+
+    def reverse_of(is_friend):
+        return UserFriend.objects.filter(user_id=OuterRef('friend_id'), friend_id=OuterRef('user_id'), is_friend=is_friend)
+
+    # Встречная заявка на уже принятую дружбу становится принятой
+    UserFriend.objects.filter(is_friend=False).filter(Exists(reverse_of(True))).update(is_friend=True)
+
+    missing = UserFriend.objects.filter(is_friend=True).exclude(Exists(reverse_of(True)))
+    batch = []
+    for user_id, friend_id in missing.values_list('user_id', 'friend_id').iterator(chunk_size=BATCH_SIZE):
+        batch.append(UserFriend(user_id=friend_id, friend_id=user_id, is_friend=True))
+        if len(batch) >= BATCH_SIZE:
+            UserFriend.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        UserFriend.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_rename_userfriends_userfriend_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userfriend',
+            index=models.Index(fields=['user', 'is_friend'], name='user_friends_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfriend',
+            index=models.Index(fields=['friend', 'is_friend'], name='user_friends_friend_idx'),
+        ),
+        migrations.RunPython(backfill_reverse_friendships, migrations.RunPython.noop),
+    ]
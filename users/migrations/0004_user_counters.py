@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:43
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+BATCH_SIZE = 1000
+
+
+def fill_counters(apps, schema_editor):
+    # Копия расчета users.counters на момент миграции: код приложения может измениться, миграция - нет
+    User = apps.get_model('users', 'User')
+    UserFriend = apps.get_model('users', 'UserFriend')
+    Post = apps.get_model('api', 'Post')
+
+    def count(queryset, field):
+        return Coalesce(Subquery(queryset.order_by().values(field).annotate(count=Count('*')).values('count')), 0)
+
+    counters = {
+        'friend_count': count(UserFriend.objects.filter(user=OuterRef('pk'), is_friend=True), 'user'),
+        'incoming_requests_count': count(UserFriend.objects.filter(friend=OuterRef('pk'), is_friend=False), 'friend'),
+        'outgoing_requests_count': count(UserFriend.objects.filter(user=OuterRef('pk'), is_friend=False), 'user'),
+        'post_count': count(Post.objects.filter(author=OuterRef('pk')), 'author'),
+    }
+
+    last_id = 0
+    while True:
+        ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        last_id = ids[-1]
+        User.objects.filter(id__in=ids).update(**counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_symmetric_friendships'),
+        ('api', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='friend_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество друзей'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='incoming_requests_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Входящие заявки в друзья'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='outgoing_requests_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Исходящие заявки в друзья'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество постов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
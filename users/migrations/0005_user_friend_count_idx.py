@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['friend_count'], name='user_friend_count_idx'),
+        ),
+    ]
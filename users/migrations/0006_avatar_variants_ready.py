@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_user_friend_count_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_variants_ready',
+            field=models.BooleanField(default=False, verbose_name='Варианты аватарки созданы'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:52
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_avatar_variants_ready'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=api.storage.get_content_storage, upload_to='avatars/', verbose_name='Аватарка'),
+        ),
+    ]
@@ -1,40 +1,71 @@
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
-from drf_yasg import openapi
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from api.entity_cache import user_cache
+from api.serializers import lazy_schema, user_serializer
+from api.storage import get_content_storage
 
 
 class User(AbstractUser):
     objects = UserManager()
 
-    avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name='Аватарка')
+    avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name='Аватарка',
+                               storage=get_content_storage)
+    avatar_variants_ready = models.BooleanField(default=False, verbose_name='Варианты аватарки созданы')
     description = models.TextField(default="", verbose_name='Описание профиля', blank=True)
 
-    schema = openapi.Schema(
-        title='Пользователь',
-        type=openapi.TYPE_OBJECT,
-        required=['id', 'username', 'firstName', 'lastName', 'description'],
-        properties={
-            'id': openapi.Schema(type=openapi.TYPE_INTEGER, title='ID', description='ID пользователя'),
-            'username': openapi.Schema(type=openapi.TYPE_STRING, title='Логин'),
-            'firstName': openapi.Schema(type=openapi.TYPE_STRING, title='Имя'),
-            'lastName': openapi.Schema(type=openapi.TYPE_STRING, title='Фамилия'),
-            'description': openapi.Schema(type=openapi.TYPE_STRING, title='Описание профиля'),
-            'avatar': openapi.Schema(type=openapi.TYPE_STRING, title='Аватар', description='Ссылка на изображение'),
-        }
-    )
+    # Денормализованные счетчики, меняются только через change_counters, сверяются командой repair_counters
+    friend_count = models.PositiveIntegerField(default=0, verbose_name='Количество друзей')
+    incoming_requests_count = models.PositiveIntegerField(default=0, verbose_name='Входящие заявки в друзья')
+    outgoing_requests_count = models.PositiveIntegerField(default=0, verbose_name='Исходящие заявки в друзья')
+    post_count = models.PositiveIntegerField(default=0, verbose_name='Количество постов')
+
+    COUNTER_FIELDS = ('friend_count', 'incoming_requests_count', 'outgoing_requests_count', 'post_count')
 
+    schema = lazy_schema(user_serializer.schema)
 
     @property
     def json(self):
+        return user_serializer.from_instance(self)
+
+    @property
+    def counters(self):
         return {
-            'id': self.id,
-            'username': self.username,
-            'firstName': self.first_name,
-            'lastName': self.last_name,
-            'description': self.description,
-            'avatar': self.avatar.url if self.avatar else None,
+            'friendCount': self.friend_count,
+            'incomingRequestsCount': self.incoming_requests_count,
+            'outgoingRequestsCount': self.outgoing_requests_count,
+            'postCount': self.post_count,
         }
 
+    @lazy_schema
+    def counters_schema():
+        from drf_yasg import openapi
+
+        return openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            title='Счетчики пользователя',
+            required=['friendCount', 'incomingRequestsCount', 'outgoingRequestsCount', 'postCount'],
+            properties={
+                'friendCount': openapi.Schema(type=openapi.TYPE_INTEGER, title='Количество друзей'),
+                'incomingRequestsCount': openapi.Schema(type=openapi.TYPE_INTEGER, title='Входящие заявки в друзья'),
+                'outgoingRequestsCount': openapi.Schema(type=openapi.TYPE_INTEGER, title='Исходящие заявки в друзья'),
+                'postCount': openapi.Schema(type=openapi.TYPE_INTEGER, title='Количество постов'),
+            }
+        )
+
+    @classmethod
+    def change_counters(cls, user_id, **deltas):
+        """Атомарное изменение счетчиков одним UPDATE через F(), без чтения строки"""
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if deltas:
+            cls.objects.filter(id=user_id).update(**{
+                name: Greatest(F(name) + delta, 0) for name, delta in deltas.items()
+            })
+            # update() не вызывает сигналы сохранения, кэш сущностей сбрасывается явно
+            transaction.on_commit(lambda: user_cache.invalidate(user_id))
+
     @property
     def friends(self):
         return UserFriend.get_friends(self)
@@ -49,28 +80,37 @@ class User(AbstractUser):
 
     @staticmethod
     def friends_ids(friends_queryset):
-        return {"users": [friend.id for friend in friends_queryset]}
-
-    friends_ids_schema = openapi.Schema(
-        type=openapi.TYPE_OBJECT,
-        title='Пользователи',
-        properties={
-            'users': openapi.Schema(
-                type=openapi.TYPE_ARRAY,
-                title='id пользователей',
-                items=openapi.Schema(
-                    type=openapi.TYPE_INTEGER,
-                    title='ID',
+        return {"users": list(friends_queryset.values_list('id', flat=True))}
+
+    @lazy_schema
+    def friends_ids_schema():
+        from drf_yasg import openapi
+
+        return openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            title='Пользователи',
+            properties={
+                'users': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    title='id пользователей',
+                    items=openapi.Schema(
+                        type=openapi.TYPE_INTEGER,
+                        title='ID',
+                    )
                 )
-            )
-        }
-    )
+            }
+        )
 
     class Meta:
         db_table = 'auth_user'
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
 
+        indexes = [
+            # Поиск пользователей с очень большим числом друзей для ленты (api.feed)
+            models.Index(fields=['friend_count'], name='user_friend_count_idx'),
+        ]
+
     def __str__(self) -> str:
         return " ".join((self.first_name, self.last_name)).strip() or self.username
 
@@ -87,18 +127,85 @@ class UserFriend(models.Model):
         verbose_name_plural = 'Друзья'
 
         unique_together = [['user', 'friend']]
+        indexes = [
+            models.Index(fields=['user', 'is_friend'], name='user_friends_user_idx'),
+            models.Index(fields=['friend', 'is_friend'], name='user_friends_friend_idx'),
+        ]
+
 
+    # Принятая дружба хранится в обе стороны (user -> friend и friend -> user, обе с is_friend=True),
+    # поэтому друзья пользователя - это один поиск по индексу (user, is_friend)
 
     @classmethod
     def get_friends(cls, user):
-        return (cls.objects.filter(user=user) | cls.objects.filter(friend=user)).filter(is_friend=True)
+        return User.objects.filter(friend_friends__user=user, friend_friends__is_friend=True)
+
+    @classmethod
+    def count_friends(cls, user):
+        return cls.objects.filter(user=user, is_friend=True).count()
 
     @classmethod
     def get_friend_requests(cls, user):
-        return cls.objects.filter(friend=user, is_friend=False)
+        return User.objects.filter(user_friends__friend=user, user_friends__is_friend=False)
 
     @classmethod
     def get_friend_requests_send(cls, user):
-        return cls.objects.filter(user=user, is_friend=False)
+        return User.objects.filter(friend_friends__user=user, friend_friends__is_friend=False)
+
+    @classmethod
+    def get_friendship(cls, user, friend):
+        return cls.objects.filter(
+            models.Q(user=user, friend=friend) | models.Q(user=friend, friend=user),
+            is_friend=True,
+        )
+
+    # Методы изменения дружбы вызываются внутри транзакции и сразу обновляют счетчики пользователей
 
+    @classmethod
+    def send_request(cls, user, friend):
+        user_friend = cls.objects.create(user=user, friend=friend)
+        User.change_counters(user.id, outgoing_requests_count=1)
+        User.change_counters(friend.id, incoming_requests_count=1)
+        return user_friend
 
+    @classmethod
+    def accept_request(cls, user, friend) -> bool:
+        """
+        Принимает заявку user -> friend и создает (или принимает встречную) обратную запись.
+        False - заявки нет. Первый запрос - UPDATE: на SQLite транзакция сразу берет блокировку записи и ждет
+        других писателей, а не получает database is locked при повышении блокировки чтения
+        """
+        if not cls.objects.filter(user=user, friend=friend, is_friend=False).update(is_friend=True):
+            return False
+        _, created = cls.objects.update_or_create(
+            user_id=friend.id, friend_id=user.id,
+            defaults={'is_friend': True},
+        )
+
+        # Если встречная заявка уже была - она тоже закрыта
+        closed_back_request = 0 if created else -1
+        User.change_counters(
+            user.id,
+            friend_count=1, outgoing_requests_count=-1, incoming_requests_count=closed_back_request
+        )
+        User.change_counters(
+            friend.id,
+            friend_count=1, incoming_requests_count=-1, outgoing_requests_count=closed_back_request
+        )
+        return True
+
+    @classmethod
+    def reject_request(cls, user, friend) -> bool:
+        deleted, _ = cls.objects.filter(user=user, friend=friend, is_friend=False).delete()
+        if deleted:
+            User.change_counters(user.id, outgoing_requests_count=-1)
+            User.change_counters(friend.id, incoming_requests_count=-1)
+        return bool(deleted)
+
+    @classmethod
+    def remove_friendship(cls, user, friend) -> bool:
+        deleted, _ = cls.get_friendship(user, friend).delete()
+        if deleted:
+            User.change_counters(user.id, friend_count=-1)
+            User.change_counters(friend.id, friend_count=-1)
+        return bool(deleted)
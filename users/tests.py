@@ -1,3 +1,180 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from api.models import Post
+from users import tokens
+from users.counters import repair_counters
+from users.models import User, UserFriend
+
+
+# Фоновые задачи выполняются сразу после коммита, чтобы тесты видели их результат
+@override_settings(BACKGROUND_TASKS_SYNC=True)
+class UsersTestCase(TestCase):
+    def setUp(self):
+        # Кэши (сущности, версии, deny-list) переживают откат транзакции теста
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create_user(username='user', password='password')
+
+    def bearer(self, access: str) -> dict:
+        return {'HTTP_AUTHORIZATION': f'Bearer {access}'}
+
+
+class TokenTests(UsersTestCase):
+    def login(self) -> dict:
+        response = self.client.post('/api/users/auth/login/', {
+            'username': 'user', 'password': 'password', 'mode': 'token',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def refresh(self, refresh: str):
+        return self.client.post('/api/users/auth/refresh/', {'refresh': refresh}, content_type='application/json')
+
+    def test_access_token_authenticates(self):
+        issued = self.login()
+        response = self.client.get('/api/users/get/me/', **self.bearer(issued['access']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.user.id)
+
+    @override_settings(TOKEN_REVOKE_ACCESS=True)
+    def test_logout_revokes_access_and_refresh(self):
+        issued = self.login()
+        response = self.client.post('/api/users/auth/logout/', {'refresh': issued['refresh']},
+                                    content_type='application/json', **self.bearer(issued['access']))
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get('/api/users/get/me/', **self.bearer(issued['access'])).status_code, 401)
+        self.assertEqual(self.refresh(issued['refresh']).status_code, 401)
+
+    @override_settings(TOKEN_REVOKE_ACCESS=False)
+    def test_access_not_checked_without_revocation(self):
+        # Без TOKEN_REVOKE_ACCESS запрос с access-токеном не читает deny-list
+        issued = self.login()
+        response = self.client.post('/api/users/auth/logout/', {'refresh': issued['refresh']},
+                                    content_type='application/json', **self.bearer(issued['access']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(issued['refresh']).status_code, 401)
+
+        with mock.patch.object(tokens._deny_list(), 'get') as get:
+            self.assertEqual(self.client.get('/api/users/get/me/', **self.bearer(issued['access'])).status_code, 200)
+        get.assert_not_called()
+
+    def test_refresh_rotates_tokens(self):
+        issued = self.login()
+        response = self.refresh(issued['refresh'])
+        self.assertEqual(response.status_code, 200)
+        rotated = response.json()
+        self.assertNotEqual(rotated['refresh'], issued['refresh'])
+
+        # Старый refresh-токен после обмена недействителен, новый работает
+        self.assertEqual(self.refresh(issued['refresh']).status_code, 401)
+        self.assertEqual(self.refresh(rotated['refresh']).status_code, 200)
+
+    def test_revoke_claims_token_once(self):
+        # Параллельные обмены одного refresh-токена: отозвать его может только один
+        payload = tokens.read_token(tokens.REFRESH, tokens.issue_tokens(self.user)['refresh'])
+        self.assertTrue(tokens.revoke(payload))
+        self.assertFalse(tokens.revoke(payload))
+
+    def test_revoke_fails_fast(self):
+        # DatabaseCache.add возвращает False и при database is locked: это не значит, что токен уже отозван
+        payload = tokens.read_token(tokens.REFRESH, tokens.issue_tokens(self.user)['refresh'])
+        deny_list = tokens._deny_list()
+        with mock.patch.object(deny_list, 'add', return_value=False) as add:
+            with self.assertRaises(tokens.RevokeError):
+                tokens.revoke(payload)
+        self.assertEqual(add.call_count, 1)
+
+    def test_refresh_reports_failed_revoke(self):
+        issued = self.login()
+        with mock.patch.object(tokens._deny_list(), 'add', return_value=False):
+            response = self.refresh(issued['refresh'])
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('error', response.json())
+
+    def test_password_change_invalidates_refresh(self):
+        issued = self.login()
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertEqual(self.refresh(issued['refresh']).status_code, 401)
+
+
+class FriendshipTests(UsersTestCase):
+    def setUp(self):
+        super().setUp()
+        self.friend = User.objects.create_user(username='friend', password='password')
+
+    def post_as(self, user, url: str, other) -> int:
+        self.client.force_login(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'user_id': other.id}, content_type='application/json')
+        return response.status_code
+
+    def assertCounters(self, user, **expected):
+        user.refresh_from_db()
+        self.assertEqual({name: getattr(user, name) for name in expected}, expected)
+
+    def assertRows(self, *rows):
+        self.assertEqual(
+            set(UserFriend.objects.values_list('user_id', 'friend_id', 'is_friend')),
+            {(user.id, friend.id, is_friend) for user, friend, is_friend in rows},
+        )
+        # Денормализованные счетчики совпадают с пересчитанными
+        self.assertEqual(repair_counters(User, UserFriend, Post, dry_run=True), 0)
+
+    def test_request_and_accept(self):
+        self.assertEqual(self.post_as(self.user, '/api/users/make-friend/', self.friend), 200)
+        self.assertRows((self.user, self.friend, False))
+        self.assertCounters(self.user, outgoing_requests_count=1, incoming_requests_count=0, friend_count=0)
+        self.assertCounters(self.friend, outgoing_requests_count=0, incoming_requests_count=1, friend_count=0)
+
+        self.assertEqual(self.post_as(self.friend, '/api/users/accept-friend/', self.user), 200)
+        self.assertRows((self.user, self.friend, True), (self.friend, self.user, True))
+        for user in (self.user, self.friend):
+            self.assertCounters(user, outgoing_requests_count=0, incoming_requests_count=0, friend_count=1)
+
+    def test_accept_closes_counter_request(self):
+        # Обе стороны отправили заявки: принятие одной закрывает и встречную
+        self.post_as(self.user, '/api/users/make-friend/', self.friend)
+        self.post_as(self.friend, '/api/users/make-friend/', self.user)
+        self.assertEqual(self.post_as(self.friend, '/api/users/accept-friend/', self.user), 200)
+
+        self.assertRows((self.user, self.friend, True), (self.friend, self.user, True))
+        for user in (self.user, self.friend):
+            self.assertCounters(user, outgoing_requests_count=0, incoming_requests_count=0, friend_count=1)
+
+    def test_accept_without_request(self):
+        self.assertEqual(self.post_as(self.friend, '/api/users/accept-friend/', self.user), 404)
+        # Принять можно только входящую заявку, но не свою исходящую
+        self.post_as(self.user, '/api/users/make-friend/', self.friend)
+        self.assertEqual(self.post_as(self.user, '/api/users/accept-friend/', self.friend), 404)
+        self.assertRows((self.user, self.friend, False))
+
+    def test_reject_request(self):
+        self.post_as(self.user, '/api/users/make-friend/', self.friend)
+        self.assertEqual(self.post_as(self.friend, '/api/users/reject-friend/', self.user), 200)
+
+        self.assertRows()
+        for user in (self.user, self.friend):
+            self.assertCounters(user, outgoing_requests_count=0, incoming_requests_count=0, friend_count=0)
+
+    def test_remove_friendship(self):
+        self.post_as(self.user, '/api/users/make-friend/', self.friend)
+        self.post_as(self.friend, '/api/users/accept-friend/', self.user)
+        # Удалить из друзей может любая сторона
+        self.assertEqual(self.post_as(self.user, '/api/users/reject-friend/', self.friend), 200)
+
+        self.assertRows()
+        for user in (self.user, self.friend):
+            self.assertCounters(user, friend_count=0)
+        self.assertEqual(self.post_as(self.user, '/api/users/reject-friend/', self.friend), 404)
+
+    def test_anonymous(self):
+        self.client.logout()
+        response = self.client.post('/api/users/make-friend/', {'user_id': self.friend.id},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertRows()
@@ -0,0 +1,116 @@
+"""
+Подписанные токены доступа для клиентов без сессии и CSRF (мобильные приложения, скрипты).
+
+Токен - JSON с id пользователя, id токена (jti) и временем истечения, подписанный HMAC (django.core.signing)
+с отдельной солью для access и refresh. Отозванные токены хранятся в кэше по jti до истечения их срока (deny-list),
+поэтому список не растет. Кэш TOKEN_DENY_LIST_CACHE_ALIAS должен быть общим для всех процессов, иначе отозванный
+токен продолжает действовать в других воркерах.
+
+Refresh-токены сверяются с deny-list при каждом обмене. Access-токен проверяется на каждом запросе, поэтому
+сверяется и отзывается только с TOKEN_REVOKE_ACCESS (с Redis): без него это запрос к БД на каждый запрос,
+а короткоживущий access-токен после выхода действует до истечения срока.
+"""
+import secrets
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+class TokenError(Exception):
+    pass
+
+
+class RevokeError(TokenError):
+    """Записать токен в deny-list не удалось: токен по-прежнему действует"""
+
+
+def _signer(kind: str) -> signing.Signer:
+    return signing.Signer(salt=f'users.tokens.{kind}')
+
+
+def _deny_list():
+    return caches[settings.TOKEN_DENY_LIST_CACHE_ALIAS]
+
+
+def _deny_key(jti: str) -> str:
+    return f'token-deny:{jti}'
+
+
+def _password_stamp(user) -> str:
+    # Смена пароля делает недействительными выданные refresh-токены
+    return user.get_session_auth_hash()[:16]
+
+
+def make_token(kind: str, user, lifetime: int) -> str:
+    payload = {'u': user.pk, 'j': secrets.token_urlsafe(9), 'e': int(time.time()) + lifetime}
+    if kind == REFRESH:
+        payload['h'] = _password_stamp(user)
+    return _signer(kind).sign_object(payload)
+
+
+def issue_tokens(user) -> dict:
+    return {
+        'access': make_token(ACCESS, user, settings.TOKEN_ACCESS_LIFETIME),
+        'refresh': make_token(REFRESH, user, settings.TOKEN_REFRESH_LIFETIME),
+        'expiresIn': settings.TOKEN_ACCESS_LIFETIME,
+    }
+
+
+def is_revocable(kind: str) -> bool:
+    return kind == REFRESH or settings.TOKEN_REVOKE_ACCESS
+
+
+def read_token(kind: str, token: str) -> dict:
+    """Полезная нагрузка действующего токена. TokenError - подпись не сходится, срок истек или токен отозван"""
+    try:
+        payload = _signer(kind).unsign_object(token)
+    except signing.BadSignature:
+        raise TokenError('Некорректный токен')
+
+    if payload['e'] <= time.time():
+        raise TokenError('Срок действия токена истек')
+    if is_revocable(kind) and _deny_list().get(_deny_key(payload['j'])) is not None:
+        raise TokenError('Токен отозван')
+    return payload
+
+
+def revoke(payload: dict) -> bool:
+    """
+    Отзывает токен. False - токен уже отозван, в том числе параллельным запросом (cache.add атомарен).
+    RevokeError - записать токен в deny-list не удалось; запись не повторяется, чтобы не задерживать запрос
+    """
+    ttl = int(payload['e'] - time.time()) + 1
+    if ttl <= 0:
+        return True
+
+    deny_list, key = _deny_list(), _deny_key(payload['j'])
+    if deny_list.add(key, 1, ttl):
+        return True
+    # DatabaseCache.add возвращает False и при ошибке БД (на SQLite - database is locked при параллельной
+    # записи). Отозванным токен считается, только если ключ действительно есть
+    if deny_list.get(key) is not None:
+        return False
+    raise RevokeError('Не удалось отозвать токен, повторите запрос')
+
+
+def check_refresh_user(payload: dict, user):
+    if not user.is_active or payload.get('h') != _password_stamp(user):
+        raise TokenError('Токен отозван')
+
+
+def refresh_tokens(token: str, get_user) -> dict:
+    """
+    Обмен refresh-токена на новую пару. Старый refresh-токен отзывается (ротация): из параллельных обменов
+    одного токена успешен только первый
+    """
+    payload = read_token(REFRESH, token)
+    user = get_user(payload['u'])
+    check_refresh_user(payload, user)
+    if not revoke(payload):
+        raise TokenError('Токен отозван')
+    return issue_tokens(user)